@@ -1,22 +1,185 @@
+from django.conf import settings
 from django.contrib import admin
-from . import models
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Sum
+from django.utils.functional import cached_property
+from . import models, search
+from .rendering import render_markdown
+from .session_counters import repair
+
+
+def estimated_count(queryset):
+    """The table's row count from the database statistics, or None when there are none"""
+    db = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    try:
+        with db.cursor() as cursor:
+            if db.vendor == 'postgresql':
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            elif db.vendor == 'sqlite':
+                # Kept by ANALYZE; the first number is the table's row count
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    # PostgreSQL reports -1 for a table never vacuumed or analyzed
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Counts an unfiltered change list from the table statistics once it passes ADMIN_EXACT_COUNT_LIMIT"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > settings.ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
 
 # Register your models here.
 @admin.register(models.AnalysisSession)
 class AnalysisSessionAdmin(admin.ModelAdmin):
-    # list_display = ('user', 'analysis_type', 'title', 'created_at', 'updated_at', 'is_completed')
-    # list_filter = ('analysis_type', 'is_completed', 'created_at')
+    # Listed from the session table alone: the counters replace per-row message counts
+    list_display = ('title', 'user', 'analysis_type', 'message_count', 'last_message_at', 'last_message_preview')
+    list_filter = ('analysis_type', 'is_completed', 'created_at')
     # search_fields = ('title',   )
-    pass
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    # Filtered lists skip the second COUNT(*) of the whole table
+    show_full_result_count = False
+    readonly_fields = ('message_count', 'last_message_at', 'last_message_preview', 'archived_at')
         
         
 @admin.register(models.ChatMessage)
 class ChatMessageAdmin(admin.ModelAdmin):
     list_display = ('session', 'is_user', 'timestamp', 'short_content')
     list_filter = ('is_user', 'timestamp')
-    search_fields = ('content', 'session__title', 'session__user__username')
+    # Searched through the full-text index (chat.search), not icontains scans
+    search_fields = ('content',)
+    search_help_text = 'Full-text search of message content; every word must match.'
+    list_select_related = ('session__user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = ('content_html',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(search.matches(search_term)), False
+    
+    def save_model(self, request, obj, form, change):
+        obj.content_html = '' if obj.is_user else render_markdown(obj.content)
+        super().save_model(request, obj, form, change)
+        # The message may have moved from another session
+        repair({obj.session_id, form.initial.get('session')} - {None})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        repair([obj.session_id])
+
+    def delete_queryset(self, request, queryset):
+        session_ids = set(queryset.values_list('session_id', flat=True))
+        super().delete_queryset(request, queryset)
+        repair(session_ids)
     
     def short_content(self, obj):
         return (obj.content[:75] + '...') if len(obj.content) > 75 else obj.content
     short_content.short_description = 'Content'
     
+
+
+@admin.register(models.MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    # The data column is never loaded for the list
+    list_display = ('session', 'message_count', 'raw_bytes', 'compressed_bytes', 'created_at')
+    list_select_related = ('session__user',)
+    exclude = ('data',)
+    readonly_fields = ('session', 'message_count', 'raw_bytes', 'compressed_bytes', 'created_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('data')
+
+    def has_add_permission(self, request):
+        return False
+
+    # The archive holds the only copy of its messages
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(models.ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('session', 'status', 'attempts', 'run_after', 'locked_by', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('session__title', 'session__user__username')
+    list_select_related = ('session__user',)
+
+
+class GranularityFilter(admin.SimpleListFilter):
+    """Days or hours, never both: the daily rows already add up the hourly ones"""
+
+    title = 'granularity'
+    parameter_name = 'granularity'
+
+    def lookups(self, request, model_admin):
+        return models.UsageRollup.GRANULARITIES
+
+    def value(self):
+        return super().value() or models.UsageRollup.DAY
+
+    def choices(self, changelist):
+        for value, label in self.lookup_choices:
+            yield {
+                'selected': self.value() == value,
+                'query_string': changelist.get_query_string({self.parameter_name: value}),
+                'display': label,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset.filter(granularity=self.value())
+
+
+@admin.register(models.UsageRollup)
+class UsageRollupAdmin(admin.ModelAdmin):
+    """Usage reporting, read from the rollups kept by `manage.py rollup_usage` (chat.rollups)"""
+
+    list_display = (
+        'period_start', 'granularity', 'analysis_type', 'session_type', 'sessions_started',
+        'messages', 'user_messages', 'sessions_completed', 'average_turns',
+    )
+    list_filter = (GranularityFilter, 'session_type', 'analysis_type')
+    date_hierarchy = 'period_start'
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            totals = changelist.queryset.aggregate(**{
+                name: Sum(name) for name in ('sessions_started', 'messages', 'sessions_completed', 'completion_turns')
+            })
+            totals['average_turns'] = self._average(totals['completion_turns'], totals['sessions_completed'])
+            response.context_data['usage_totals'] = totals
+        return response
+
+    @staticmethod
+    def _average(turns, completed):
+        return round(turns / completed, 1) if completed else None
+
+    @admin.display(description='Avg. turns to completion')
+    def average_turns(self, obj):
+        return self._average(obj.completion_turns, obj.sessions_completed)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
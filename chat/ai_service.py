@@ -1,284 +1,557 @@
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import client as genai_client
+from google.generativeai.types import BlockedPromptException, StopCandidateException, content_types
+from google.generativeai.types.generation_types import AsyncGenerateContentResponse
+from django.conf import settings
+import asyncio
+import logging
 import os
+import threading
+import time
+import weakref
 from dotenv import load_dotenv
 
+from . import llm_cache
+from .circuit_breaker import get_breaker
+from .metrics import SIZE_BUCKETS, Histogram
+from .stub_llm import get_stub_model
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
+GEMINI_CALL_DURATION = Histogram(
+    'gemini_call_duration_seconds', 'Gemini call latency per model and outcome (ok, error, timeout, refused)',
+    ['model', 'outcome'],
+)
+GEMINI_PROMPT_CHARS = Histogram('gemini_prompt_chars', 'Prompt size sent to Gemini', ['model'], buckets=SIZE_BUCKETS)
+GEMINI_RESPONSE_CHARS = Histogram(
+    'gemini_response_chars', 'Reply size received from Gemini', ['model'], buckets=SIZE_BUCKETS,
+)
+
+# Process-wide Gemini client state. genai.configure() throws away every
+# client it has built, so it must run once per process and never per request.
+_client_lock = threading.Lock()
+_configured = False
+_models = {}
+# gRPC asyncio clients, per event loop: their channels belong to the loop that created them
+_async_clients_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _client_options():
+    """Connection options shared by the sync client (through genai) and the async ones"""
+    # The same keys, in the same order, that genai.configure() falls back on
+    return {'api_key': os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY')}
+
+
+def _configure():
+    global _configured
+    if not _configured:
+        genai.configure(client_options=_client_options(), transport=settings.GEMINI_TRANSPORT or None)
+        _configured = True
+
+
+def get_gemini_model(model_name=None):
+    """Return the shared GenerativeModel for ``model_name`` (default: settings.GEMINI_MODEL).
+
+    The model and its underlying channel are built once per process and
+    reused by every request, so the connection and TLS session stay warm.
+    """
+    model_name = model_name or settings.GEMINI_MODEL
+    if settings.GEMINI_STUB:
+        return get_stub_model(model_name)
+    model = _models.get(model_name)
+    if model is None:
+        with _client_lock:
+            model = _models.get(model_name)
+            if model is None:
+                _configure()
+                # The model picks up genai's default generative client on first use,
+                # which stays shared because genai is never reconfigured
+                model = genai.GenerativeModel(model_name)
+                _models[model_name] = model
+    return model
+
+
+class AsyncGeminiModel:
+    """generate_content_async() for one model over an asyncio gRPC client.
+
+    genai's own async client is one per process and takes its transport from
+    genai.configure(), which names the sync transport; gRPC asyncio channels
+    also belong to the loop that made them. So each loop gets its own client,
+    built with the sync client's options.
+    """
+
+    def __init__(self, model_name, client):
+        self.model_name = model_name if model_name.startswith('models/') else f'models/{model_name}'
+        self.client = client
+
+    async def generate_content_async(self, prompt, request_options=None):
+        request = glm.GenerateContentRequest(model=self.model_name, contents=content_types.to_contents(prompt))
+        request.contents[-1].role = 'user'
+        response = await self.client.generate_content(request, **(request_options or {}))
+        return AsyncGenerateContentResponse.from_response(response)
+
+
+class ThreadedGeminiModel:
+    """generate_content_async() that runs the shared sync model in a worker thread.
+
+    Used with GEMINI_TRANSPORT=rest: the client library has no asyncio REST
+    transport.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    async def generate_content_async(self, prompt, request_options=None):
+        # get_gemini_model() may take _client_lock, so it runs in the thread too
+        return await asyncio.to_thread(
+            lambda: get_gemini_model(self.model_name).generate_content(prompt, request_options=request_options)
+        )
+
+
+def get_async_gemini_model(model_name=None):
+    """Like get_gemini_model, but safe to await from the running event loop"""
+    model_name = model_name or settings.GEMINI_MODEL
+    if settings.GEMINI_STUB:
+        return get_stub_model(model_name)
+    if settings.GEMINI_TRANSPORT == 'rest':
+        return ThreadedGeminiModel(model_name)
+    loop = asyncio.get_running_loop()
+    # Held for the dictionary lookups only, never across a client build or an
+    # await, so it cannot stall the loop behind another thread's I/O
+    with _async_clients_lock:
+        client = _async_clients.get(loop)
+    if client is None:
+        # Creating the channel does not connect, so this does not block the loop
+        client = glm.GenerativeServiceAsyncClient(client_options=_client_options(), transport='grpc_asyncio')
+        with _async_clients_lock:
+            client = _async_clients.setdefault(loop, client)
+    return AsyncGeminiModel(model_name, client)
+
+
+def warm_up(model_names=None):
+    """Build the shared client before the first request arrives.
+
+    Called from gunicorn's post_worker_init hook (see gunicorn.conf.py), so
+    each worker pays the client setup cost at boot rather than on a user's turn.
+    """
+    if settings.GEMINI_STUB:
+        return
+    with _client_lock:
+        _configure()
+        genai_client.get_default_generative_client()
+    for model_name in model_names or model_chain():
+        get_gemini_model(model_name)
+
+
+class GeminiUnavailable(Exception):
+    """No model in the chain produced a reply before the deadline"""
+
+
+def model_chain(primary=None):
+    """``primary`` (default: settings.GEMINI_MODEL) followed by the fallback models"""
+    return list(dict.fromkeys([primary or settings.GEMINI_MODEL, *settings.GEMINI_FALLBACK_MODELS]))
+
+
+def _is_model_failure(error):
+    """Whether an error says the model is unhealthy, rather than that the request was refused"""
+    # Rate limiting (429, including ResourceExhausted) is a 4xx that still means back off
+    if isinstance(error, google_exceptions.TooManyRequests):
+        return True
+    return not isinstance(
+        error, (google_exceptions.ClientError, BlockedPromptException, StopCandidateException, ValueError)
+    )
+
+
+def _attempts(models, deadline, attempt_timeout=None):
+    """Yield (model_name, breaker, timeout) for each model worth calling before the deadline"""
+    models = models or model_chain()
+    attempt_timeout = attempt_timeout or settings.GEMINI_ATTEMPT_TIMEOUT
+    deadline_at = time.monotonic() + (deadline or settings.GEMINI_DEADLINE)
+    for index, model_name in enumerate(models):
+        remaining = deadline_at - time.monotonic()
+        if remaining < settings.GEMINI_MIN_ATTEMPT_TIMEOUT:
+            return
+        breaker = get_breaker(model_name)
+        if not breaker.allow():
+            continue
+        # The last model may use whatever is left of the budget
+        timeout = remaining if index == len(models) - 1 else min(remaining, attempt_timeout)
+        yield model_name, breaker, timeout
+
+
+def _request_options(timeout):
+    # The client's default retries ServiceUnavailable for up to 600s; the chain
+    # falls through to the next model instead
+    return {'timeout': timeout, 'retry': None}
+
+
+def _outcome(error):
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, google_exceptions.DeadlineExceeded)):
+        return 'timeout'
+    return 'error' if _is_model_failure(error) else 'refused'
+
+
+def _observe(model_name, started, prompt, response_chars=None, error=None):
+    GEMINI_CALL_DURATION.observe(
+        time.monotonic() - started, model=model_name, outcome='ok' if error is None else _outcome(error)
+    )
+    GEMINI_PROMPT_CHARS.observe(len(prompt), model=model_name)
+    if response_chars is not None:
+        GEMINI_RESPONSE_CHARS.observe(response_chars, model=model_name)
+
+
+def _record_error(model_name, breaker, error):
+    """Update the breaker for a failed call. Returns True if the next model should be tried."""
+    if not _is_model_failure(error):
+        breaker.record_success()
+        return False
+    breaker.record_failure()
+    logger.warning("Gemini model %s failed: %s", model_name, error)
+    return True
+
+
+def generate_text(prompt, models=None, deadline=None, attempt_timeout=None):
+    """Generate a reply down the model chain within ``deadline`` seconds.
+
+    Each model gets at most ``attempt_timeout`` (default:
+    GEMINI_ATTEMPT_TIMEOUT) seconds, and models whose circuit is open are skipped. Returns (text, model_name). Raises
+    GeminiUnavailable if no model answered in time, or the error itself if
+    the request was refused (bad request, blocked prompt).
+    """
+    last_error = None
+    for model_name, breaker, timeout in _attempts(models, deadline, attempt_timeout):
+        started = time.monotonic()
+        try:
+            response = get_gemini_model(model_name).generate_content(
+                prompt, request_options=_request_options(timeout)
+            )
+            text = response.text
+        except Exception as e:
+            _observe(model_name, started, prompt, error=e)
+            if not _record_error(model_name, breaker, e):
+                raise
+            last_error = e
+            continue
+        _observe(model_name, started, prompt, len(text))
+        breaker.record_success()
+        return text, model_name
+    raise GeminiUnavailable(f"No Gemini model answered in time (last error: {last_error})")
+
+
+async def agenerate_text(prompt, models=None, deadline=None):
+    """Async variant of generate_text"""
+    last_error = None
+    for model_name, breaker, timeout in _attempts(models, deadline):
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                get_async_gemini_model(model_name).generate_content_async(
+                    prompt, request_options=_request_options(timeout)
+                ),
+                timeout,
+            )
+            text = response.text
+        except Exception as e:
+            _observe(model_name, started, prompt, error=e)
+            if not _record_error(model_name, breaker, e):
+                raise
+            last_error = e
+            continue
+        _observe(model_name, started, prompt, len(text))
+        breaker.record_success()
+        return text, model_name
+    raise GeminiUnavailable(f"No Gemini model answered in time (last error: {last_error})")
+
+
+def stream_text(prompt, models=None, deadline=None):
+    """Yield (model_name, chunk) pairs from the first model in the chain that answers.
+
+    The chain only falls through until the first chunk arrives; an error after
+    that is raised to the caller. The per-model timeout bounds the whole stream.
+    """
+    last_error = None
+    for model_name, breaker, timeout in _attempts(models, deadline):
+        started = time.monotonic()
+        streamed = 0
+        try:
+            stream = get_gemini_model(model_name).generate_content(
+                prompt, stream=True, request_options=_request_options(timeout)
+            )
+            for chunk in stream:
+                if chunk.text:
+                    streamed += len(chunk.text)
+                    yield model_name, chunk.text
+        except Exception as e:
+            _observe(model_name, started, prompt, error=e)
+            if not _record_error(model_name, breaker, e) or streamed:
+                raise
+            last_error = e
+            continue
+        _observe(model_name, started, prompt, streamed)
+        breaker.record_success()
+        return
+    raise GeminiUnavailable(f"No Gemini model answered in time (last error: {last_error})")
+
+
+ANALYSIS_PROMPTS = {
+    'vitamin_minerals': """
+        You are a medical AI assistant analyzing vitamin and mineral intake.
+        Ask specific questions about:
+        - Daily food consumption patterns
+        - Fruits and vegetables intake frequency
+        - Dairy, meat, and plant-based protein sources
+        - Supplement usage and types
+        - Any deficiency symptoms like fatigue, skin issues, or hair problems
+        - Dietary restrictions or preferences
+        
+        Ask 3-5 targeted, conversational questions to assess potential vitamin/mineral deficiencies.
+        Be empathetic and professional.
+    """,
+    'exercise_routine': """
+        Analyze weekly exercise habits. Ask about:
+        - Types of exercise (cardio, strength, flexibility)
+        - Frequency (days per week) and duration
+        - Intensity levels and progression
+        - Recovery practices and rest days
+        - Fitness goals and current challenges
+        - Any pain or discomfort during/after exercise
+    """,
+    'food_quality': """
+        Analyze weekly food quality. Ask about:
+        - Processed vs whole food consumption
+        - Meal preparation habits
+        - Fruit and vegetable variety and quantity
+        - Healthy fat sources
+        - Sugar and salt intake
+        - Eating patterns and timing
+    """,
+    'sleep_quality': """
+        Analyze sleep quality and habits. Ask about:
+        - Sleep duration and consistency
+        - Bedtime routine
+        - Sleep environment factors
+        - Factors affecting sleep (caffeine, stress, etc.)
+        - Energy levels upon waking
+        - Sleep tracking if any
+    """,
+    'stress_levels': """
+        Analyze stress levels and daily workload. Ask about:
+        - Daily stress triggers and sources
+        - Workload and time management
+        - Coping mechanisms
+        - Work-life balance
+        - Physical symptoms of stress
+        - Relaxation practices
+    """,
+    'hydration': """
+        Analyze hydration levels. Ask about:
+        - Daily water intake and sources
+        - Other fluid consumption
+        - Signs of dehydration
+        - Factors affecting hydration needs
+        - Hydration habits throughout the day
+    """,
+    'mental_wellbeing': """
+        Analyze mental well-being routine. Ask about:
+        - Daily mood patterns
+        - Stress management techniques
+        - Social connections and support
+        - Hobbies and leisure activities
+        - Mental health practices
+        - Work satisfaction
+    """,
+    'energy_levels': """
+        Analyze daily energy levels. Ask about:
+        - Energy patterns throughout the day
+        - Factors that boost or drain energy
+        - Sleep quality impact
+        - Nutrition's effect on energy
+        - Exercise impact on energy
+    """,
+    'meal_balance': """
+        Analyze weekly meal balance. Ask about:
+        - Macronutrient distribution
+        - Meal timing and frequency
+        - Food variety across the week
+        - Portion sizes
+        - Snacking habits
+    """,
+    'digestion': """
+        Analyze digestion and gut health. Ask about:
+        - Regular digestion patterns
+        - Food intolerances or sensitivities
+        - Gut symptoms (bloating, gas, etc.)
+        - Fiber intake
+        - Probiotic food consumption
+    """,
+    'calorie_intake': """
+        Analyze daily calorie intake. Ask about:
+        - Typical daily meals and portions
+        - Snacking habits
+        - Beverage calories
+        - Hunger and fullness cues
+        - Weight management goals
+    """,
+    'posture': """
+        Analyze posture and ergonomics. Ask about:
+        - Daily sitting/standing patterns
+        - Workstation setup
+        - Posture awareness
+        - Any discomfort or pain
+        - Movement breaks frequency
+    """,
+    'exercise_balance': """
+        Analyze cardio vs strength training balance. Ask about:
+        - Current exercise split
+        - Fitness goals alignment
+        - Recovery between sessions
+        - Performance progression
+    """,
+    'hormone_health': """
+        Analyze hormone-supporting lifestyle. Ask about:
+        - Sleep quality and patterns
+        - Stress management
+        - Nutrition for hormonal balance
+        - Environmental factors
+        - Energy and mood patterns
+    """,
+    'immune_health': """
+        Analyze immune-supporting habits. Ask about:
+        - Illness frequency and recovery
+        - Sleep and stress factors
+        - Nutrition for immunity
+        - Supplement usage
+        - Lifestyle factors affecting immunity
+    """,
+    'productivity': """
+        Analyze daily productivity and burnout risk. Ask about:
+        - Workload and deadlines
+        - Focus and concentration
+        - Breaks and recovery
+        - Motivation levels
+        - Work satisfaction
+    """,
+    'screen_time': """
+        Analyze screen time and blue-light exposure. Ask about:
+        - Daily screen usage patterns
+        - Eye comfort and strain
+        - Evening screen habits
+        - Blue light protection measures
+        - Digital detox practices
+    """,
+    'environmental_toxins': """
+        Analyze household environmental toxins. Ask about:
+        - Cleaning product types
+        - Air and water quality
+        - Plastic usage
+        - Home ventilation
+        - Chemical exposure concerns
+    """,
+    'caffeine': """
+        Analyze caffeine and stimulant consumption. Ask about:
+        - Daily caffeine sources and amounts
+        - Timing of consumption
+        - Effects on sleep and energy
+        - Dependency feelings
+        - Alternative energy sources
+    """,
+    'alcohol': """
+        Analyze alcohol intake and lifestyle balance. Ask about:
+        - Drinking frequency and quantity
+        - Social drinking patterns
+        - Effects on sleep and mood
+        - Health concerns
+        - Balance with other lifestyle factors
+    """,
+    'menstrual_health': """
+        Analyze menstrual cycle health. Ask about:
+        - Cycle regularity and symptoms
+        - PMS experiences
+        - Impact on daily life
+        - Management strategies
+        - Hormonal concerns
+    """,
+    'mobility': """
+        Analyze daily mobility and flexibility. Ask about:
+        - Daily movement patterns
+        - Stretching routine
+        - Joint health and stiffness
+        - Mobility limitations
+        - Exercise variety
+    """,
+    'chronic_pain': """
+        Analyze chronic pain or discomfort. Ask about:
+        - Pain locations and patterns
+        - Triggers and relievers
+        - Impact on daily activities
+        - Management strategies
+        - Professional consultations
+    """,
+    'default': """
+        Ask relevant questions to analyze this health aspect.
+        Focus on gathering specific, actionable information in a conversational way.
+    """
+}
+
+FALLBACK_QUESTIONS = {
+    'vitamin_minerals': "To understand your vitamin and mineral intake, could you tell me about your typical daily meals and any supplements you take?",
+    'exercise_routine': "Let's start by understanding your current exercise routine. What types of physical activity do you typically do each week?",
+    'food_quality': "I'd like to learn about your eating habits. What does a typical day of meals look like for you?",
+    'sleep_quality': "Let's discuss your sleep patterns. How many hours do you usually sleep and what's your bedtime routine like?",
+    'stress_levels': "To understand your stress levels, could you describe a typical workday and how you manage daily pressures?",
+    'hydration': "Let's talk about your hydration habits. How much water do you typically drink in a day?",
+    'mental_wellbeing': "I'd like to understand your mental wellbeing. How have you been feeling emotionally lately?",
+    'energy_levels': "Let's discuss your energy patterns. When during the day do you feel most and least energetic?",
+    'meal_balance': "To analyze your meal balance, could you describe what you typically eat for breakfast, lunch, and dinner?",
+    'digestion': "I'd like to understand your digestive health. How would you describe your typical digestion patterns?",
+    'calorie_intake': "Let's talk about your food intake. What does a typical day of eating look like for you?",
+    'posture': "To understand your posture habits, could you describe your typical work setup and how you sit during the day?",
+    'exercise_balance': "Let's discuss your exercise routine. What's the balance between cardio and strength training in your week?",
+    'hormone_health': "I'd like to understand factors affecting your hormonal balance. How would you describe your sleep and stress levels?",
+    'immune_health': "Let's talk about your immune health. How often do you get sick and how quickly do you recover?",
+    'productivity': "To understand your productivity patterns, could you describe a typical workday and how you manage your tasks?",
+    'screen_time': "Let's discuss your screen usage. How many hours per day do you typically spend looking at screens?",
+    'environmental_toxins': "I'd like to understand your environmental exposures. What types of cleaning products do you use at home?",
+    'caffeine': "Let's talk about your caffeine intake. How much coffee, tea, or other caffeinated drinks do you consume daily?",
+    'alcohol': "To understand your alcohol consumption, how often do you typically drink alcoholic beverages?",
+    'menstrual_health': "I'd like to understand your menstrual cycle. How regular are your periods and what symptoms do you experience?",
+    'mobility': "Let's discuss your mobility. How often do you stretch or do flexibility exercises?",
+    'chronic_pain': "I'd like to understand any discomfort you experience. Where do you feel pain and how does it affect your daily life?"
+}
+
+
+def fallback_questions(analysis_type):
+    """Static opening questions, used when Gemini is unavailable"""
+    return FALLBACK_QUESTIONS.get(analysis_type, f"I'll help analyze your {analysis_type.replace('_', ' ')}. Could you tell me more about your current habits and any concerns you have?")
+
+
 class AIService:
-    def __init__(self):
-        # Configure Gemini with correct API version
-        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+    def generate_analysis_questions(self, analysis_type, user_context=""):
+        """Generate opening questions with Gemini. Raises if the call fails."""
         
-        # # Get available models to verify
-        # try:
-        #     available_models = genai.list_models()
-        #     print("Available models:")
-        #     for model in available_models:
-        #         print(f"- {model.name}")
-        # except Exception as e:
-        #     print(f"Error listing models: {e}")
-    
-    def get_model(self):
-        """Get the correct Gemini model"""
-        try:
-            # Try the newer model names
-            return genai.GenerativeModel('gemini-2.5-pro')
-        except:
-            try:
-                # Fallback to other possible model names
-                return genai.GenerativeModel('models/gemini-pro')
-            except:
-                # Last fallback
-                return genai.GenerativeModel('gemini-pro')
-    
+        prompt = ANALYSIS_PROMPTS.get(analysis_type, ANALYSIS_PROMPTS['default'])
+        
+        text, _ = generate_text(
+            f"{prompt}\n\nUser context: {user_context}\n\nPlease provide 3-5 specific questions to start the conversation:"
+        )
+        return text
+
     def get_analysis_questions(self, analysis_type, user_context=""):
         """Generate questions for specific analysis types using Gemini"""
         
-        analysis_prompts = {
-            'vitamin_minerals': """
-                You are a medical AI assistant analyzing vitamin and mineral intake.
-                Ask specific questions about:
-                - Daily food consumption patterns
-                - Fruits and vegetables intake frequency
-                - Dairy, meat, and plant-based protein sources
-                - Supplement usage and types
-                - Any deficiency symptoms like fatigue, skin issues, or hair problems
-                - Dietary restrictions or preferences
-                
-                Ask 3-5 targeted, conversational questions to assess potential vitamin/mineral deficiencies.
-                Be empathetic and professional.
-            """,
-            'exercise_routine': """
-                Analyze weekly exercise habits. Ask about:
-                - Types of exercise (cardio, strength, flexibility)
-                - Frequency (days per week) and duration
-                - Intensity levels and progression
-                - Recovery practices and rest days
-                - Fitness goals and current challenges
-                - Any pain or discomfort during/after exercise
-            """,
-            'food_quality': """
-                Analyze weekly food quality. Ask about:
-                - Processed vs whole food consumption
-                - Meal preparation habits
-                - Fruit and vegetable variety and quantity
-                - Healthy fat sources
-                - Sugar and salt intake
-                - Eating patterns and timing
-            """,
-            'sleep_quality': """
-                Analyze sleep quality and habits. Ask about:
-                - Sleep duration and consistency
-                - Bedtime routine
-                - Sleep environment factors
-                - Factors affecting sleep (caffeine, stress, etc.)
-                - Energy levels upon waking
-                - Sleep tracking if any
-            """,
-            'stress_levels': """
-                Analyze stress levels and daily workload. Ask about:
-                - Daily stress triggers and sources
-                - Workload and time management
-                - Coping mechanisms
-                - Work-life balance
-                - Physical symptoms of stress
-                - Relaxation practices
-            """,
-            'hydration': """
-                Analyze hydration levels. Ask about:
-                - Daily water intake and sources
-                - Other fluid consumption
-                - Signs of dehydration
-                - Factors affecting hydration needs
-                - Hydration habits throughout the day
-            """,
-            'mental_wellbeing': """
-                Analyze mental well-being routine. Ask about:
-                - Daily mood patterns
-                - Stress management techniques
-                - Social connections and support
-                - Hobbies and leisure activities
-                - Mental health practices
-                - Work satisfaction
-            """,
-            'energy_levels': """
-                Analyze daily energy levels. Ask about:
-                - Energy patterns throughout the day
-                - Factors that boost or drain energy
-                - Sleep quality impact
-                - Nutrition's effect on energy
-                - Exercise impact on energy
-            """,
-            'meal_balance': """
-                Analyze weekly meal balance. Ask about:
-                - Macronutrient distribution
-                - Meal timing and frequency
-                - Food variety across the week
-                - Portion sizes
-                - Snacking habits
-            """,
-            'digestion': """
-                Analyze digestion and gut health. Ask about:
-                - Regular digestion patterns
-                - Food intolerances or sensitivities
-                - Gut symptoms (bloating, gas, etc.)
-                - Fiber intake
-                - Probiotic food consumption
-            """,
-            'calorie_intake': """
-                Analyze daily calorie intake. Ask about:
-                - Typical daily meals and portions
-                - Snacking habits
-                - Beverage calories
-                - Hunger and fullness cues
-                - Weight management goals
-            """,
-            'posture': """
-                Analyze posture and ergonomics. Ask about:
-                - Daily sitting/standing patterns
-                - Workstation setup
-                - Posture awareness
-                - Any discomfort or pain
-                - Movement breaks frequency
-            """,
-            'exercise_balance': """
-                Analyze cardio vs strength training balance. Ask about:
-                - Current exercise split
-                - Fitness goals alignment
-                - Recovery between sessions
-                - Performance progression
-            """,
-            'hormone_health': """
-                Analyze hormone-supporting lifestyle. Ask about:
-                - Sleep quality and patterns
-                - Stress management
-                - Nutrition for hormonal balance
-                - Environmental factors
-                - Energy and mood patterns
-            """,
-            'immune_health': """
-                Analyze immune-supporting habits. Ask about:
-                - Illness frequency and recovery
-                - Sleep and stress factors
-                - Nutrition for immunity
-                - Supplement usage
-                - Lifestyle factors affecting immunity
-            """,
-            'productivity': """
-                Analyze daily productivity and burnout risk. Ask about:
-                - Workload and deadlines
-                - Focus and concentration
-                - Breaks and recovery
-                - Motivation levels
-                - Work satisfaction
-            """,
-            'screen_time': """
-                Analyze screen time and blue-light exposure. Ask about:
-                - Daily screen usage patterns
-                - Eye comfort and strain
-                - Evening screen habits
-                - Blue light protection measures
-                - Digital detox practices
-            """,
-            'environmental_toxins': """
-                Analyze household environmental toxins. Ask about:
-                - Cleaning product types
-                - Air and water quality
-                - Plastic usage
-                - Home ventilation
-                - Chemical exposure concerns
-            """,
-            'caffeine': """
-                Analyze caffeine and stimulant consumption. Ask about:
-                - Daily caffeine sources and amounts
-                - Timing of consumption
-                - Effects on sleep and energy
-                - Dependency feelings
-                - Alternative energy sources
-            """,
-            'alcohol': """
-                Analyze alcohol intake and lifestyle balance. Ask about:
-                - Drinking frequency and quantity
-                - Social drinking patterns
-                - Effects on sleep and mood
-                - Health concerns
-                - Balance with other lifestyle factors
-            """,
-            'menstrual_health': """
-                Analyze menstrual cycle health. Ask about:
-                - Cycle regularity and symptoms
-                - PMS experiences
-                - Impact on daily life
-                - Management strategies
-                - Hormonal concerns
-            """,
-            'mobility': """
-                Analyze daily mobility and flexibility. Ask about:
-                - Daily movement patterns
-                - Stretching routine
-                - Joint health and stiffness
-                - Mobility limitations
-                - Exercise variety
-            """,
-            'chronic_pain': """
-                Analyze chronic pain or discomfort. Ask about:
-                - Pain locations and patterns
-                - Triggers and relievers
-                - Impact on daily activities
-                - Management strategies
-                - Professional consultations
-            """,
-            'default': """
-                Ask relevant questions to analyze this health aspect.
-                Focus on gathering specific, actionable information in a conversational way.
-            """
-        }
-        
-        prompt = analysis_prompts.get(analysis_type, analysis_prompts['default'])
-        
         try:
-            # Get the correct model
-            model = self.get_model()
-            
-            # Generate content with Gemini
-            response = model.generate_content(
-                f"{prompt}\n\nUser context: {user_context}\n\nPlease provide 3-5 specific questions to start the conversation:"
-            )
-            return response.text
+            return self.generate_analysis_questions(analysis_type, user_context)
         except Exception as e:
-            print(f"Gemini API Error: {e}")
-            # Fallback response
-            fallback_questions = {
-                'vitamin_minerals': "To understand your vitamin and mineral intake, could you tell me about your typical daily meals and any supplements you take?",
-                'exercise_routine': "Let's start by understanding your current exercise routine. What types of physical activity do you typically do each week?",
-                'food_quality': "I'd like to learn about your eating habits. What does a typical day of meals look like for you?",
-                'sleep_quality': "Let's discuss your sleep patterns. How many hours do you usually sleep and what's your bedtime routine like?",
-                'stress_levels': "To understand your stress levels, could you describe a typical workday and how you manage daily pressures?",
-                'hydration': "Let's talk about your hydration habits. How much water do you typically drink in a day?",
-                'mental_wellbeing': "I'd like to understand your mental wellbeing. How have you been feeling emotionally lately?",
-                'energy_levels': "Let's discuss your energy patterns. When during the day do you feel most and least energetic?",
-                'meal_balance': "To analyze your meal balance, could you describe what you typically eat for breakfast, lunch, and dinner?",
-                'digestion': "I'd like to understand your digestive health. How would you describe your typical digestion patterns?",
-                'calorie_intake': "Let's talk about your food intake. What does a typical day of eating look like for you?",
-                'posture': "To understand your posture habits, could you describe your typical work setup and how you sit during the day?",
-                'exercise_balance': "Let's discuss your exercise routine. What's the balance between cardio and strength training in your week?",
-                'hormone_health': "I'd like to understand factors affecting your hormonal balance. How would you describe your sleep and stress levels?",
-                'immune_health': "Let's talk about your immune health. How often do you get sick and how quickly do you recover?",
-                'productivity': "To understand your productivity patterns, could you describe a typical workday and how you manage your tasks?",
-                'screen_time': "Let's discuss your screen usage. How many hours per day do you typically spend looking at screens?",
-                'environmental_toxins': "I'd like to understand your environmental exposures. What types of cleaning products do you use at home?",
-                'caffeine': "Let's talk about your caffeine intake. How much coffee, tea, or other caffeinated drinks do you consume daily?",
-                'alcohol': "To understand your alcohol consumption, how often do you typically drink alcoholic beverages?",
-                'menstrual_health': "I'd like to understand your menstrual cycle. How regular are your periods and what symptoms do you experience?",
-                'mobility': "Let's discuss your mobility. How often do you stretch or do flexibility exercises?",
-                'chronic_pain': "I'd like to understand any discomfort you experience. Where do you feel pain and how does it affect your daily life?"
-            }
-            return fallback_questions.get(analysis_type, f"I'll help analyze your {analysis_type.replace('_', ' ')}. Could you tell me more about your current habits and any concerns you have?")
+            logger.warning("Gemini API error: %s", e)
+            return fallback_questions(analysis_type)
 
-    def generate_analysis_report(self, analysis_type, user_responses):
-        """Generate final analysis based on user responses using Gemini"""
-        
-        prompt = f"""
+    def build_report_prompt(self, analysis_type, user_responses):
+        return f"""
         Based on the following conversation about the user's {analysis_type.replace('_', ' ')},
         provide a comprehensive analysis with:
         
@@ -293,14 +566,72 @@ class AIService:
         
         Please structure your response clearly with headings for each section.
         """
+
+    def report_fallback(self, analysis_type):
+        return f"Based on our conversation, I recommend focusing on balanced {analysis_type.replace('_', ' ')} habits. Consider consulting with a healthcare provider for personalized advice tailored to your specific situation."
+
+    def write_analysis_report(self, analysis_type, user_responses, deadline=None, attempt_timeout=None):
+        """Generate the analysis report with Gemini. Raises if the call fails."""
+        
+        text, _ = generate_text(
+            self.build_report_prompt(analysis_type, user_responses),
+            deadline=deadline,
+            attempt_timeout=attempt_timeout,
+        )
+        return text
+
+    def generate_analysis_report(self, analysis_type, user_responses):
+        """Generate final analysis based on user responses using Gemini"""
+        
+        try:
+            return self.write_analysis_report(analysis_type, user_responses)
+        except Exception as e:
+            logger.warning("Gemini API error: %s", e)
+            return self.report_fallback(analysis_type)
+
+    async def generate_analysis_report_async(self, analysis_type, user_responses):
+        """Async variant of generate_analysis_report for ASGI views"""
+        
+        prompt = self.build_report_prompt(analysis_type, user_responses)
+        
+        try:
+            text, _ = await agenerate_text(prompt)
+            return text
+        except Exception as e:
+            logger.warning("Gemini API error: %s", e)
+            return self.report_fallback(analysis_type)
+
+    def summarize_conversation(self, previous_summary, conversation_history):
+        """Fold older conversation turns into the running summary.
+
+        Returns None when Gemini is unavailable, so the caller keeps the old
+        summary and retries on a later turn.
+        """
+        
+        prompt = f"""
+        You maintain a running clinical-intake summary of a conversation between a user and Doctor AI.
+        Update the existing summary with the new conversation turns below.
+        
+        Guidelines:
+        - Keep every fact the user shared (symptoms, habits, quantities, timings, concerns)
+        - Note which questions Doctor AI has already asked
+        - Be concise, use short bullet points, no headings
+        
+        Existing summary:
+        {previous_summary or "(none yet)"}
+        
+        New conversation turns:
+        {conversation_history}
+        
+        Updated summary:
+        """
         
         try:
-            model = self.get_model()
-            response = model.generate_content(prompt)
-            return response.text
+            text, _ = generate_text(prompt, models=model_chain(settings.CHAT_SUMMARY_MODEL))
+            return text.strip()
         except Exception as e:
-            print(f"Gemini API Error: {e}")
-            return f"Based on our conversation, I recommend focusing on balanced {analysis_type.replace('_', ' ')} habits. Consider consulting with a healthcare provider for personalized advice tailored to your specific situation."
+            logger.warning("Gemini API error: %s", e)
+            return None
 
     def chat_response(self, conversation_history, analysis_type):
         """Generate contextual chat responses using Gemini"""
@@ -319,10 +650,15 @@ class AIService:
         """
         
         try:
-            model = self.get_model()
-            full_prompt = f"{system_prompt}\n\nConversation history:\n{conversation_history}\n\nYour response:"
-            response = model.generate_content(full_prompt)
-            return response.text
+            cache_key = llm_cache.response_cache_key(settings.GEMINI_MODEL, system_prompt, conversation_history)
+            text = llm_cache.lookup(cache_key)
+            if text is None:
+                full_prompt = f"{system_prompt}\n\nConversation history:\n{conversation_history}\n\nYour response:"
+                text, model_name = generate_text(full_prompt)
+                # A fallback model's reply is not what the cache key promises
+                if model_name == settings.GEMINI_MODEL:
+                    llm_cache.store(cache_key, text)
+            return text
         except Exception as e:
-            print(f"Gemini API Error: {e}")
+            logger.warning("Gemini API error: %s", e)
             return "I appreciate you sharing that information. Could you tell me more about your current habits or concerns?"
\ No newline at end of file
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import fragment_cache  # noqa: F401 - connects the invalidation receivers
+
+        if settings.METRICS_ENABLED:
+            from . import metrics, middleware  # noqa: F401 - connects the query counter
+
+            metrics.register_chat_stats()
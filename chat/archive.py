@@ -0,0 +1,115 @@
+"""
+Cold storage for the messages of idle sessions.
+
+`manage.py archive_sessions` moves the messages of sessions untouched for
+CHAT_ARCHIVE_AFTER_DAYS out of ChatMessage into one MessageArchive row per
+session: the message rows as a zlib-compressed JSON list. The session is
+marked with archived_at. Its counters, summary and report stay where they
+are, so session lists never notice.
+
+Code that reads a session's messages checks archived_at and, for an archived
+session, calls all_messages(). That merges the archive with any rows still
+in ChatMessage, so opening an old conversation costs one decompression.
+
+The next turn in an archived session calls restore() in the turn's
+transaction (views._finish_turn). The messages go back to ChatMessage with
+their original ids and timestamps, so the clients' message ids stay valid.
+
+Archived messages leave the full-text index (chat.search) with their rows.
+Search goes on to them after the indexed matches by reading the user's
+archives, so they stay findable, only more slowly; restored messages are
+back in the index.
+"""
+import json
+import zlib
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AnalysisSession, ChatMessage, MessageArchive
+
+COMPRESSION_LEVEL = 9
+BATCH_SIZE = 500
+FIELDS = ('id', 'is_user', 'timestamp', 'content', 'content_html')
+
+
+def pack(rows):
+    """Message rows (dicts with FIELDS) as (compressed data, raw size)"""
+    raw = json.dumps(
+        [[row['id'], row['is_user'], row['timestamp'].isoformat(), row['content'], row['content_html']] for row in rows],
+        ensure_ascii=False,
+        separators=(',', ':'),
+    ).encode()
+    return zlib.compress(raw, COMPRESSION_LEVEL), len(raw)
+
+
+def unpack(data):
+    """The message rows stored by pack(), oldest first"""
+    return [
+        {
+            'id': message_id,
+            'is_user': is_user,
+            'timestamp': datetime.fromisoformat(timestamp),
+            'content': content,
+            'content_html': content_html,
+        }
+        for message_id, is_user, timestamp, content, content_html in json.loads(zlib.decompress(bytes(data)))
+    ]
+
+
+def all_messages(session_id):
+    """Every message of an archived session as dicts with FIELDS, oldest first"""
+    rows = list(ChatMessage.objects.filter(session_id=session_id).values(*FIELDS))
+    data = MessageArchive.objects.filter(pk=session_id).values_list('data', flat=True).first()
+    if data is not None:
+        rows += unpack(data)
+    rows.sort(key=lambda row: (row['timestamp'], row['id']))
+    return rows
+
+
+def archive_session(session_id, idle_before):
+    """Move a session's messages to the archive if it is still idle since ``idle_before``.
+
+    Returns the archive, or None if the session was skipped.
+    """
+    with transaction.atomic():
+        session = (
+            AnalysisSession.objects.select_for_update()
+            .filter(pk=session_id, archived_at__isnull=True, updated_at__lt=idle_before)
+            .only('id')
+            .first()
+        )
+        if session is None:
+            return None
+        rows = list(ChatMessage.objects.filter(session_id=session_id).order_by('timestamp', 'id').values(*FIELDS))
+        if not rows:
+            return None
+        data, raw_bytes = pack(rows)
+        archive = MessageArchive.objects.create(
+            session_id=session_id,
+            data=data,
+            message_count=len(rows),
+            raw_bytes=raw_bytes,
+            compressed_bytes=len(data),
+        )
+        ChatMessage.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        # update() leaves updated_at alone: archiving is not activity
+        AnalysisSession.objects.filter(pk=session_id).update(archived_at=timezone.now())
+    return archive
+
+
+def restore(session_id):
+    """Move an archived session's messages back to ChatMessage. Call it in a transaction."""
+    data = MessageArchive.objects.filter(pk=session_id).values_list('data', flat=True).first()
+    # Deleting the archive claims it: a concurrent restore deletes nothing and stops here
+    if data is not None and MessageArchive.objects.filter(pk=session_id).delete()[0]:
+        rows = unpack(data)
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(session_id=session_id, **{field: row[field] for field in FIELDS}) for row in rows
+        ], batch_size=BATCH_SIZE)
+        # auto_now_add stamped them with the current time
+        for message, row in zip(messages, rows):
+            message.timestamp = row['timestamp']
+        ChatMessage.objects.bulk_update(messages, ['timestamp'], batch_size=BATCH_SIZE)
+    AnalysisSession.objects.filter(pk=session_id).update(archived_at=None)
@@ -0,0 +1,101 @@
+"""
+Per-model circuit breakers for Gemini calls.
+
+After settings.GEMINI_BREAKER_THRESHOLD consecutive failures a model's
+breaker opens, and calls skip that model for settings.GEMINI_BREAKER_COOLDOWN
+seconds. After the cool-down one trial call is let through (half-open): if it
+succeeds the breaker closes, if it fails the breaker opens again.
+
+Breakers are per process, so each worker finds out about a degraded model on
+its own.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=None, cooldown=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.GEMINI_BREAKER_THRESHOLD
+        self.cooldown = cooldown or settings.GEMINI_BREAKER_COOLDOWN
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.counts = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go to this model now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            # A trial call that never reported back gets replaced after another cool-down
+            if now - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self.opened_at = now
+                return True
+            # Open, or half-open with the trial call still in flight
+            self.counts['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.counts['successes'] += 1
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info("Circuit breaker for %s closed", self.name)
+            self.state = CLOSED
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.counts['failures'] += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.counts['opened'] += 1
+                logger.warning(
+                    "Circuit breaker for %s opened after %s consecutive failures",
+                    self.name, self.consecutive_failures,
+                )
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'open_for_seconds': round(time.monotonic() - self.opened_at, 1) if self.opened_at else 0,
+                **self.counts,
+            }
+
+
+_breakers_lock = threading.Lock()
+_breakers = {}
+
+
+def get_breaker(name):
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def get_breaker_stats():
+    """State and counters of every breaker in this process, keyed by model name"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
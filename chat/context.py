@@ -0,0 +1,221 @@
+"""
+Conversation context compaction.
+
+Only the most recent turns of a conversation are sent to Gemini verbatim.
+Older turns are folded into a running summary stored on the session, so the
+prompt for a turn stays within settings.CHAT_CONTEXT_TOKEN_BUDGET no matter
+how long the conversation gets. Recent turns that outgrow the budget are
+folded as well, so nothing drops out of the context for more than a turn.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+
+from .ai_service import AIService
+from .guest_store import get_guest_store
+from .models import AnalysisSession, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {
+    'turns': 0,
+    'prompt_tokens': 0,
+    'uncompacted_tokens': 0,
+    'tokens_saved': 0,
+    'summaries_updated': 0,
+}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='context-compaction')
+_pending_lock = threading.Lock()
+_pending = set()
+
+
+def estimate_tokens(text):
+    # Gemini averages roughly four characters per token for English text
+    return (len(text) + 3) // 4
+
+
+def format_history(messages):
+    """Render (is_user, content) pairs the way the prompts expect"""
+    return "\n".join(
+        f"{'User' if is_user else 'Doctor AI'}: {content}"
+        for is_user, content in messages
+    )
+
+
+def recent_message_count():
+    return settings.CHAT_CONTEXT_RECENT_TURNS * 2
+
+
+def _summary_block(summary):
+    return f"Summary of the earlier conversation:\n{summary}\n\n" if summary else ''
+
+
+def _message_cost(is_user, content):
+    # The line and its newline
+    return estimate_tokens(format_history([(is_user, content)])) + 1
+
+
+def _fitting_count(messages, summary):
+    """How many of the latest messages fit the token budget after the summary (at least one)"""
+    used = estimate_tokens(_summary_block(summary))
+    count = 0
+    for is_user, content in reversed(messages):
+        cost = _message_cost(is_user, content)
+        # Always keep the latest message, however long
+        if count and used + cost > settings.CHAT_CONTEXT_TOKEN_BUDGET:
+            break
+        used += cost
+        count += 1
+    return count
+
+
+def build_conversation_history(messages, summary='', summary_source_tokens=0):
+    """Build the prompt history from the running summary and the messages after it.
+
+    ``messages`` are the (is_user, content) pairs not yet folded into
+    ``summary``. If they do not fit the token budget the oldest are left out
+    of this prompt. Returns (history, number of messages left out); pass the
+    number on to maybe_compact_session, which folds them into the summary
+    before the next turn.
+    """
+    kept = messages[len(messages) - _fitting_count(messages, summary):]
+    history = _summary_block(summary) + format_history(kept)
+    uncompacted = summary_source_tokens + sum(_message_cost(is_user, content) for is_user, content in messages)
+    _record_turn(estimate_tokens(history), uncompacted)
+    return history, len(messages) - len(kept)
+
+
+def _record_turn(prompt_tokens, uncompacted_tokens):
+    with _stats_lock:
+        _stats['turns'] += 1
+        _stats['prompt_tokens'] += prompt_tokens
+        _stats['uncompacted_tokens'] += uncompacted_tokens
+        _stats['tokens_saved'] += max(uncompacted_tokens - prompt_tokens, 0)
+
+
+def get_compaction_stats():
+    """Token counters since process start, estimated at ~4 characters per token"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _messages_to_fold(messages, summary):
+    """The oldest messages: beyond the recent turns, or no longer fitting the token budget"""
+    fitting = _fitting_count(messages, summary)
+    to_fold = messages[:len(messages) - min(recent_message_count(), fitting)]
+    # Messages left out of the prompt are folded at once; otherwise wait for a batch
+    if len(messages) <= fitting and len(to_fold) < settings.CHAT_CONTEXT_FOLD_MESSAGES:
+        return []
+    return to_fold
+
+
+def compact_session(session_id):
+    """Fold a saved session's older messages into its summary. Returns True if it changed."""
+    session = AnalysisSession.objects.only(
+        'summary', 'summary_message_count', 'summary_source_tokens'
+    ).get(pk=session_id)
+    start = session.summary_message_count
+
+    messages = list(
+        ChatMessage.objects.filter(session_id=session_id)
+        .order_by('timestamp', 'id')
+        .values_list('is_user', 'content')[start:]
+    )
+    to_fold = _messages_to_fold(messages, session.summary)
+    if not to_fold:
+        return False
+
+    folded_text = format_history(to_fold)
+    summary = AIService().summarize_conversation(session.summary, folded_text)
+    if not summary:
+        return False
+
+    # update() leaves updated_at alone, and the filter drops a racing compaction
+    updated = AnalysisSession.objects.filter(pk=session_id, summary_message_count=start).update(
+        summary=summary,
+        summary_message_count=start + len(to_fold),
+        summary_source_tokens=F('summary_source_tokens') + estimate_tokens(folded_text),
+    )
+    if updated:
+        _record_summary(session_id, len(to_fold))
+    return bool(updated)
+
+
+def compact_guest_session(session_id):
+    """Fold a guest session's older messages into its summary in the guest store"""
+    guest_store = get_guest_store()
+    guest_session = guest_store.get(session_id)
+    if guest_session is None:
+        return False
+
+    start = guest_session.get('summary_message_count', 0)
+    messages = [(msg['is_user'], msg['content']) for msg in guest_session['messages'][start:]]
+    to_fold = _messages_to_fold(messages, guest_session.get('summary', ''))
+    if not to_fold:
+        return False
+
+    folded_text = format_history(to_fold)
+    summary = AIService().summarize_conversation(guest_session.get('summary', ''), folded_text)
+    if not summary:
+        return False
+
+    # Apply to the latest copy so messages added during the Gemini call are kept
+    guest_session = guest_store.get(session_id)
+    if guest_session is None or guest_session.get('summary_message_count', 0) != start:
+        return False
+    guest_session['summary'] = summary
+    guest_session['summary_message_count'] = start + len(to_fold)
+    guest_session['summary_source_tokens'] = guest_session.get('summary_source_tokens', 0) + estimate_tokens(folded_text)
+    guest_store.save(session_id, guest_session)
+    _record_summary(session_id, len(to_fold))
+    return True
+
+
+def _record_summary(session_id, folded):
+    with _stats_lock:
+        _stats['summaries_updated'] += 1
+    logger.info("Folded %s messages into the summary of session %s", folded, session_id)
+
+
+def maybe_compact_session(session_id, unsummarized_count, left_out=0):
+    """Schedule compaction of a saved session once enough old messages have built up,
+    or once messages were left out of a prompt"""
+    _schedule(('session', session_id), unsummarized_count, left_out, compact_session, session_id)
+
+
+def maybe_compact_guest_session(session_id, unsummarized_count, left_out=0):
+    """Schedule compaction of a guest session, as maybe_compact_session"""
+    _schedule(('guest', session_id), unsummarized_count, left_out, compact_guest_session, session_id)
+
+
+def _schedule(key, unsummarized_count, left_out, compact, *args):
+    if not left_out and unsummarized_count - recent_message_count() < settings.CHAT_CONTEXT_FOLD_MESSAGES:
+        return
+
+    if not settings.CHAT_CONTEXT_BACKGROUND:
+        compact(*args)
+        return
+
+    with _pending_lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+    _executor.submit(_run_compaction, key, compact, *args)
+
+
+def _run_compaction(key, compact, *args):
+    try:
+        compact(*args)
+    except Exception:
+        logger.exception("Context compaction failed for %s", key)
+    finally:
+        with _pending_lock:
+            _pending.discard(key)
+        # Worker threads get their own DB connections; do not leak them
+        connections.close_all()
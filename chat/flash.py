@@ -0,0 +1,57 @@
+"""
+One-shot flags set by one request and read by the next, kept out of the session.
+
+The login and register views flag the event the dashboard reports to Pendo.
+Keeping such flags in the session costs a session write to set them and
+another to pop them. Here they live in a signed cookie (FLASH_STORE =
+'cookie', the default) or in the cache under the session key (FLASH_STORE =
+'cache'), so reading one writes nothing to the database.
+
+A flag expires after settings.FLASH_MAX_AGE seconds if it is never read.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+SALT = 'chat.flash'
+
+
+def _cookie_name(name):
+    return f'flash_{name}'
+
+
+def _cache_key(request, name):
+    return f'flash:{request.session.session_key}:{name}'
+
+
+def set_flash(request, response, name, value):
+    if settings.FLASH_STORE == 'cache':
+        # Only sessions that have a key can hold a flag
+        if request.session.session_key:
+            cache.set(_cache_key(request, name), value, settings.FLASH_MAX_AGE)
+        return
+    response.set_signed_cookie(
+        _cookie_name(name),
+        value,
+        salt=SALT,
+        max_age=settings.FLASH_MAX_AGE,
+        httponly=True,
+        samesite='Lax',
+        secure=settings.SESSION_COOKIE_SECURE,
+    )
+
+
+def get_flash(request, name):
+    """The flag's value, or None; clear it with clear_flash on the response"""
+    if settings.FLASH_STORE == 'cache':
+        if not request.session.session_key:
+            return None
+        return cache.get(_cache_key(request, name))
+    return request.get_signed_cookie(_cookie_name(name), default=None, salt=SALT, max_age=settings.FLASH_MAX_AGE)
+
+
+def clear_flash(request, response, name):
+    if settings.FLASH_STORE == 'cache':
+        if request.session.session_key:
+            cache.delete(_cache_key(request, name))
+    elif _cookie_name(name) in request.COOKIES:
+        response.delete_cookie(_cookie_name(name), samesite='Lax')
@@ -0,0 +1,67 @@
+"""
+Cached template fragments.
+
+Templates cache fragments with ``{% cache fragment_cache_ttl <name> ... using=fragment_cache %}``
+in the cache named by settings.FRAGMENT_CACHE (by default the "fragments"
+file cache, kept apart from the default cache so fragments and the data in
+it don't evict each other). fragment_context() provides those variables.
+
+- Fragments that are the same for everyone (the analysis-type grid) are
+  cached under their name alone.
+- Fragments built from a user's sessions (the dashboard's recent sessions
+  and counts) also vary on the user id and on the user's fragment version.
+  Changing any of the user's sessions gives them a new version, so their
+  fragments are rebuilt on the next render and the old ones expire unused.
+
+A version is a random token rather than a counter. A version evicted from
+the cache is replaced by a new token, never by one an old fragment was
+stored under.
+
+Sessions saved or deleted through the ORM are handled by the signal
+receivers below. Bulk writes that skip signals (queryset update() and
+bulk_update(), as used by chat.session_counters) call
+invalidate_user_fragments() themselves.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import AnalysisSession
+
+
+def _version_key(user_id):
+    return f'fragments:user:{user_id}:version'
+
+
+def user_fragment_version(user_id):
+    return caches[settings.FRAGMENT_CACHE].get_or_set(_version_key(user_id), lambda: uuid.uuid4().hex, None)
+
+
+def invalidate_user_fragments(*user_ids):
+    versions = {_version_key(user_id): uuid.uuid4().hex for user_id in set(user_ids) if user_id is not None}
+    if not versions:
+        return
+    # After the commit: a render between the new version and the commit
+    # would cache the old data under the new version
+    transaction.on_commit(lambda: caches[settings.FRAGMENT_CACHE].set_many(versions, None))
+
+
+def fragment_context(user=None):
+    """Template variables for {% cache %} blocks"""
+    context = {
+        'fragment_cache': settings.FRAGMENT_CACHE,
+        'fragment_cache_ttl': settings.FRAGMENT_CACHE_TTL,
+    }
+    if user is not None and user.is_authenticated:
+        context['fragment_version'] = user_fragment_version(user.id)
+    return context
+
+
+@receiver(post_save, sender=AnalysisSession)
+@receiver(post_delete, sender=AnalysisSession)
+def session_changed(sender, instance, **kwargs):
+    invalidate_user_fragments(instance.user_id)
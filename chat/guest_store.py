@@ -0,0 +1,235 @@
+"""
+Storage for guest (not logged in) chat sessions.
+
+Guest conversations are not saved to the database. They live in a guest
+session store chosen by settings.GUEST_SESSION_STORE:
+
+- InMemoryGuestSessionStore keeps sessions in the worker process. It is the
+  fastest option, but each gunicorn worker has its own sessions.
+- SQLiteGuestSessionStore keeps sessions in a local SQLite file
+  (settings.GUEST_SESSION_SQLITE_PATH). It is shared by every worker on the
+  host, so a guest's turns can land on any worker.
+- CacheGuestSessionStore keeps sessions in a Django cache
+  (settings.GUEST_SESSION_CACHE), for deployments with Redis or Memcached
+  shared across hosts.
+
+Sessions expire GUEST_SESSION_TTL seconds after their last write. Each session
+keeps at most GUEST_SESSION_MAX_MESSAGES messages and GUEST_SESSION_MAX_CHARS
+characters; the oldest messages are dropped first.
+
+Callers follow a get / modify / save cycle: ``get`` returns a copy, and
+changes are only visible to other requests once passed to ``save``.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class BaseGuestSessionStore:
+    def __init__(self, ttl=None, max_messages=None, max_chars=None):
+        self.ttl = ttl or settings.GUEST_SESSION_TTL
+        self.max_messages = max_messages or settings.GUEST_SESSION_MAX_MESSAGES
+        self.max_chars = max_chars or settings.GUEST_SESSION_MAX_CHARS
+
+    def get(self, session_id):
+        """Return a copy of the session data, or None if it is missing or expired"""
+        raise NotImplementedError
+
+    def save(self, session_id, data):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def size(self):
+        """Number of stored sessions, or None if the backend cannot count them cheaply"""
+        raise NotImplementedError
+
+    def create(self, data):
+        """Save a new session and return its id"""
+        session_id = str(uuid.uuid4())
+        self.save(session_id, data)
+        return session_id
+
+    def enforce_caps(self, data):
+        """Drop the oldest messages until the session fits the size caps"""
+        messages = data['messages']
+        excess = max(len(messages) - self.max_messages, 0)
+        total = sum(len(message['content']) for message in messages)
+        while excess < len(messages) - 1 and total > self.max_chars:
+            total -= len(messages[excess]['content'])
+            excess += 1
+        if excess:
+            data['messages'] = messages[excess:]
+            # Keep the rolling summary (chat.context) pointing at the same messages
+            if data.get('summary_message_count'):
+                data['summary_message_count'] = max(data['summary_message_count'] - excess, 0)
+        return data
+
+
+class InMemoryGuestSessionStore(BaseGuestSessionStore):
+    """Per-process store with TTL expiry from the last use and LRU eviction beyond GUEST_SESSION_MAX_ENTRIES"""
+
+    def __init__(self, max_entries=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries or settings.GUEST_SESSION_MAX_ENTRIES
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            now = time.monotonic()
+            if expires_at < now:
+                del self._sessions[session_id]
+                return None
+            # A read renews the session too, which keeps the order by last use
+            # and by expiry the same
+            self._sessions[session_id] = (now + self.ttl, data)
+            self._sessions.move_to_end(session_id)
+            return copy.deepcopy(data)
+
+    def save(self, session_id, data):
+        data = self.enforce_caps(copy.deepcopy(data))
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic() + self.ttl, data)
+            self._sessions.move_to_end(session_id)
+            self._evict()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def size(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _evict(self):
+        # The least recently used sessions sit at the front, and as get() and
+        # save() both renew the expiry they are the ones that expire first, so
+        # neither pass has to scan the whole store
+        now = time.monotonic()
+        while self._sessions and next(iter(self._sessions.values()))[0] < now:
+            self._sessions.popitem(last=False)
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+
+
+class SQLiteGuestSessionStore(BaseGuestSessionStore):
+    """Store shared by every process on the host through a SQLite file.
+
+    Expired and least recently saved sessions beyond GUEST_SESSION_MAX_ENTRIES
+    are evicted every ``evict_every`` saves, which keeps COUNT(*) off the
+    per-turn path.
+    """
+
+    evict_every = 100
+
+    def __init__(self, path=None, max_entries=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path or settings.GUEST_SESSION_SQLITE_PATH)
+        self.max_entries = max_entries or settings.GUEST_SESSION_MAX_ENTRIES
+        self._local = threading.local()
+        self._saves = 0
+        self._saves_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS guest_session ("
+                " session_id TEXT PRIMARY KEY, data TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, saved_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS guest_session_expires_at ON guest_session (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS guest_session_saved_at ON guest_session (saved_at)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._connection().execute(
+            "SELECT data FROM guest_session WHERE session_id = ? AND expires_at > ?",
+            (str(session_id), time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id, data):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO guest_session (session_id, data, expires_at, saved_at) VALUES (?, ?, ?, ?)",
+                (str(session_id), json.dumps(self.enforce_caps(data)), now + self.ttl, now),
+            )
+        with self._saves_lock:
+            self._saves += 1
+            evict = self._saves % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def delete(self, session_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM guest_session WHERE session_id = ?", (str(session_id),))
+
+    def size(self):
+        return self._connection().execute("SELECT COUNT(*) FROM guest_session").fetchone()[0]
+
+    def evict(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM guest_session WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM guest_session WHERE session_id IN ("
+                " SELECT session_id FROM guest_session ORDER BY saved_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class CacheGuestSessionStore(BaseGuestSessionStore):
+    """Store shared by every process using the GUEST_SESSION_CACHE cache.
+
+    Expiry uses the cache timeout. Eviction beyond the entry limit is left to
+    the cache backend (MAX_ENTRIES for the built-in backends, the eviction
+    policy for Redis or Memcached).
+    """
+
+    key_prefix = 'guest_session:'
+
+    def __init__(self, cache_alias=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = caches[cache_alias or settings.GUEST_SESSION_CACHE]
+
+    def get(self, session_id):
+        return self.cache.get(self.key_prefix + str(session_id))
+
+    def save(self, session_id, data):
+        self.cache.set(self.key_prefix + str(session_id), self.enforce_caps(data), timeout=self.ttl)
+
+    def delete(self, session_id):
+        self.cache.delete(self.key_prefix + str(session_id))
+
+    def size(self):
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_guest_store():
+    """The configured guest session store, one per process"""
+    return import_string(settings.GUEST_SESSION_STORE)()
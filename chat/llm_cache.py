@@ -0,0 +1,273 @@
+"""
+Content-addressed cache of Gemini chat replies.
+
+Many turns send byte-identical prompts: the same opening questions answered
+with "yes" or "I don't know", or a retry after a client timeout. Replies are
+cached under a hash of (model, system prompt, normalised conversation
+history), so a repeated prompt is answered without calling Gemini.
+
+The backend is chosen by settings.LLM_CACHE_BACKEND:
+
+- InMemoryResponseCache keeps replies in the worker process.
+- SQLiteResponseCache keeps replies in a local SQLite file
+  (settings.LLM_CACHE_SQLITE_PATH) shared by every worker on the host.
+- CacheResponseCache uses a Django cache (settings.LLM_CACHE_CACHE).
+
+Entries expire after LLM_CACHE_TTL seconds, and the least recently used are
+evicted beyond LLM_CACHE_MAX_ENTRIES. Cache errors never fail a turn; they
+count as a miss.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'bypassed': 0, 'errors': 0}
+
+
+class BaseResponseCache:
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl or settings.LLM_CACHE_TTL
+        self.max_entries = max_entries or settings.LLM_CACHE_MAX_ENTRIES
+
+    def get(self, key):
+        """Return the cached reply text, or None"""
+        raise NotImplementedError
+
+    def set(self, key, text):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class InMemoryResponseCache(BaseResponseCache):
+    """Per-process LRU cache"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, text = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return text
+
+    def set(self, key, text):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteResponseCache(BaseResponseCache):
+    """LRU cache shared by every process on the host through a SQLite file.
+
+    Expired and least recently used entries beyond LLM_CACHE_MAX_ENTRIES are
+    evicted every ``evict_every`` writes.
+    """
+
+    evict_every = 100
+
+    def __init__(self, path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path or settings.LLM_CACHE_SQLITE_PATH)
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_response ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_response_used_at ON llm_response (used_at)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT response FROM llm_response WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        # Hits are rare next to a Gemini call, so recording them for LRU is cheap enough
+        with conn:
+            conn.execute("UPDATE llm_response SET used_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, text):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_response (key, response, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, text, now + self.ttl, now),
+            )
+        with self._writes_lock:
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM llm_response")
+
+    def evict(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM llm_response WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM llm_response WHERE key IN ("
+                " SELECT key FROM llm_response ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class CacheResponseCache(BaseResponseCache):
+    """Cache shared through the LLM_CACHE_CACHE Django cache; eviction is left to the backend.
+
+    Keys carry a generation number kept in the cache. clear() moves to the
+    next generation instead of clearing a cache other data may share; the
+    old entries expire with their TTL.
+    """
+
+    key_prefix = 'llm_response:'
+
+    def __init__(self, cache_alias=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = caches[cache_alias or settings.LLM_CACHE_CACHE]
+
+    @property
+    def generation_key(self):
+        return self.key_prefix + 'generation'
+
+    def _key(self, key):
+        generation = self.cache.get(self.generation_key)
+        if generation is None:
+            self.cache.add(self.generation_key, 1, timeout=None)
+            generation = self.cache.get(self.generation_key, 1)
+        return f'{self.key_prefix}{generation}:{key}'
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, text):
+        self.cache.set(self._key(key), text, timeout=self.ttl)
+
+    def clear(self):
+        try:
+            self.cache.incr(self.generation_key)
+        except ValueError:
+            # No generation yet, so every entry is in the first one
+            self.cache.add(self.generation_key, 2, timeout=None)
+
+
+@lru_cache(maxsize=None)
+def get_response_cache():
+    """The configured response cache, one per process"""
+    return import_string(settings.LLM_CACHE_BACKEND)()
+
+
+def normalise_history(conversation_history):
+    """Ignore case and whitespace differences that do not change the reply"""
+    return "\n".join(
+        " ".join(line.split())
+        for line in conversation_history.casefold().splitlines()
+        if line.strip()
+    )
+
+
+def prompt_key(model_name, system_prompt, conversation_history):
+    """Content hash of a prompt; also keys in-flight calls in chat.single_flight"""
+    payload = json.dumps([model_name, " ".join(system_prompt.split()), normalise_history(conversation_history)])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def response_cache_key(model_name, system_prompt, conversation_history):
+    """Cache key for a prompt, or None when the cache is disabled"""
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    return prompt_key(model_name, system_prompt, conversation_history)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def lookup(key):
+    """Return the cached reply for a key, or None. A None key bypasses the cache."""
+    if key is None:
+        _count('bypassed')
+        return None
+    try:
+        text = get_response_cache().get(key)
+    except Exception as e:
+        _count('errors')
+        logger.warning("LLM response cache lookup failed: %s", e)
+        return None
+    _count('hits' if text is not None else 'misses')
+    return text
+
+
+def peek(key):
+    """Like lookup, without counting a hit or miss; for callers polling for another worker's reply"""
+    if key is None:
+        return None
+    try:
+        return get_response_cache().get(key)
+    except Exception:
+        return None
+
+
+def store(key, text):
+    if key is None or not text:
+        return
+    try:
+        get_response_cache().set(key, text)
+    except Exception as e:
+        _count('errors')
+        logger.warning("LLM response cache store failed: %s", e)
+        return
+    _count('stores')
+
+
+def get_llm_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
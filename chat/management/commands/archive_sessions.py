@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat import archive
+from chat.models import AnalysisSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the messages of sessions idle for --days into compressed cold storage (chat/archive.py). "
+        "Each session is archived in its own transaction, so the command can be stopped and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help='Archive sessions not updated for this many days',
+        )
+        parser.add_argument('--sessions', nargs='*', type=int, help='Only these session ids')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Session ids read per query')
+        parser.add_argument('--limit', type=int, help='Stop after archiving this many sessions')
+
+    def handle(self, *args, **options):
+        idle_before = timezone.now() - timedelta(days=options['days'])
+        sessions = AnalysisSession.objects.filter(
+            archived_at__isnull=True, updated_at__lt=idle_before, message_count__gt=0,
+        ).order_by('pk')
+        if options['sessions']:
+            sessions = sessions.filter(pk__in=options['sessions'])
+
+        # Walk the candidates in id order; archived sessions drop out of the filter, so a rerun resumes
+        archived = messages = raw_bytes = compressed_bytes = 0
+        last_id = 0
+        while options['limit'] is None or archived < options['limit']:
+            session_ids = list(sessions.filter(pk__gt=last_id).values_list('pk', flat=True)[:options['chunk_size']])
+            if not session_ids:
+                break
+            for session_id in session_ids:
+                if options['limit'] is not None and archived >= options['limit']:
+                    break
+                last_id = session_id
+                stored = archive.archive_session(session_id, idle_before)
+                if stored is None:
+                    continue
+                archived += 1
+                messages += stored.message_count
+                raw_bytes += stored.raw_bytes
+                compressed_bytes += stored.compressed_bytes
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  up to session {last_id}: {archived} archived")
+
+        if options['verbosity']:
+            ratio = f", {raw_bytes / compressed_bytes:.1f}x smaller" if compressed_bytes else ''
+            self.stdout.write(self.style.SUCCESS(
+                f"{archived} sessions archived ({messages} messages): "
+                f"{raw_bytes / 1024:.1f} KB of messages stored in {compressed_bytes / 1024:.1f} KB{ratio}"
+            ))
@@ -0,0 +1,136 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chat.models import AnalysisSession, ChatMessage
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a synthetic chat history and compare the hot-path query plans and timings "
+        "with and without the chat indexes. Everything runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--sessions', type=int, default=5000, help='Sessions in total')
+        parser.add_argument('--messages', type=int, default=200, help='Messages per session')
+        parser.add_argument('--queries', type=int, default=200, help='Timed queries per case')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not connection.features.can_rollback_ddl:
+            self.stderr.write("This database cannot roll back DDL, so the indexes cannot be dropped safely.")
+            return
+
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        started = time.perf_counter()
+        users, session_ids = self.populate(options)
+        self.stdout.write(
+            f"{len(users)} users, {len(session_ids)} sessions, {len(session_ids) * options['messages']} messages "
+            f"on {connection.vendor} ({time.perf_counter() - started:.1f}s to build)"
+        )
+
+        cases = {
+            'session messages': lambda: ChatMessage.objects.filter(
+                session_id=random.choice(session_ids)
+            ).order_by('timestamp', 'id').values_list('is_user', 'content'),
+            'sessions page': lambda: AnalysisSession.objects.filter(
+                user=random.choice(users)
+            ).order_by('-updated_at', '-id').values(
+                'id', 'title', 'analysis_type', 'created_at', 'updated_at', 'is_completed',
+                'message_count', 'last_message_at', 'last_message_preview',
+            )[:21],
+            'dashboard recent': lambda: AnalysisSession.objects.filter(user=random.choice(users))[:5],
+        }
+
+        with_indexes = self.measure(cases, options['queries'], 'with indexes')
+        # Back to the old schema, with only the foreign key indexes. Plain SQL
+        # because SQLite's schema editor refuses to run inside a transaction;
+        # the rollback restores the real indexes.
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for model, column in ((AnalysisSession, 'user_id'), (ChatMessage, 'session_id')):
+                for index in model._meta.indexes:
+                    cursor.execute(f"DROP INDEX {quote(index.name)}")
+                cursor.execute(
+                    f"CREATE INDEX {quote('bench_' + column)} ON {quote(model._meta.db_table)} ({quote(column)})"
+                )
+        without_indexes = self.measure(cases, options['queries'], 'without indexes')
+
+        for label in cases:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{label}"))
+            for title, results in (('without indexes', without_indexes), ('with indexes', with_indexes)):
+                timings, plan = results[label]
+                self.stdout.write(
+                    f"  {title:<16} p50 {statistics.median(timings):8.3f} ms   "
+                    f"p95 {timings[int(len(timings) * 0.95) - 1]:8.3f} ms"
+                )
+                for line in plan.splitlines():
+                    self.stdout.write(f"      {line}")
+
+    def populate(self, options):
+        users = User.objects.bulk_create(
+            User(username=f'bench-index-{i}') for i in range(options['users'])
+        )
+        sessions = AnalysisSession.objects.bulk_create(
+            (
+                AnalysisSession(user=random.choice(users), analysis_type='general', title=f'Bench {i}')
+                for i in range(options['sessions'])
+            ),
+            batch_size=options['batch_size'],
+        )
+        session_ids = [session.id for session in sessions]
+
+        # Interleave sessions like real traffic, so a session's messages are
+        # spread over the whole table rather than stored next to each other
+        batch = []
+        for turn in range(options['messages']):
+            for session_id in session_ids:
+                batch.append(ChatMessage(session_id=session_id, content=f'Message {turn}', is_user=turn % 2 == 0))
+                if len(batch) >= options['batch_size']:
+                    ChatMessage.objects.bulk_create(batch)
+                    batch = []
+        ChatMessage.objects.bulk_create(batch)
+
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        return users, session_ids
+
+    def explain(self, queryset, phase):
+        # The phase comment keeps sqlite3 from serving the plan cached before the indexes were dropped
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql} /* {phase} */", params)
+            return "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+
+    def measure(self, cases, queries, phase):
+        results = {}
+        for label, build in cases.items():
+            plan = self.explain(build(), phase)
+            list(build())  # warm the page cache so the first phase is not penalised
+            timings = []
+            for _ in range(queries):
+                queryset = build()
+                start = time.perf_counter()
+                list(queryset)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            results[label] = (timings, plan)
+        return results
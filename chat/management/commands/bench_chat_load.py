@@ -0,0 +1,301 @@
+import http.cookiejar
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client, override_settings
+
+from chat.models import AnalysisSession
+from chat.views import FALLBACK_RESPONSE
+
+USER_PREFIX = 'bench-load-'
+PASSWORD = 'bench-load-password'
+QUERIES_SAMPLE_RE = re.compile(r'^doctor_ai_http_request_db_queries_(sum|count)\{view="([^"]+)"\} (\S+)$', re.MULTILINE)
+ANSWERS = [
+    "I sleep about {n} hours on weeknights and a bit more at weekends.",
+    "Mostly coffee in the morning, maybe {n} cups, and water during the day.",
+    "I walk to work and go to the gym {n} times a week.",
+    "Not really, though I feel tired around {n} pm most days.",
+    "I'm not sure. It started about {n} weeks ago.",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(max(round(pct / 100 * len(values)) - 1, 0), len(values) - 1)]
+
+
+class LocalClient:
+    """Requests through Django's handler in this process, with no network in between"""
+
+    def __init__(self, user=None):
+        self.client = Client()
+        if user is not None:
+            self.client.force_login(user)
+
+    def request(self, method, path, payload=None, stream=False):
+        """Return (status, parsed JSON or None, seconds to the first byte)"""
+        start = time.perf_counter()
+        if method == 'POST':
+            response = self.client.post(path, json.dumps(payload), content_type='application/json')
+        else:
+            response = self.client.get(path)
+        if not response.streaming:
+            return response.status_code, _json(response.content), time.perf_counter() - start
+        first_byte = None
+        body = b''
+        for chunk in response.streaming_content:
+            first_byte = first_byte or time.perf_counter() - start
+            body += chunk
+        return response.status_code, _last_sse_event(body), first_byte
+
+
+class HTTPClient:
+    """Requests to a running server, with its own cookies"""
+
+    def __init__(self, base_url, username=None):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        if username:
+            self.login(username)
+
+    def login(self, username):
+        self.opener.open(f"{self.base_url}/login/").read()
+        csrf = next(cookie.value for cookie in self.cookies if cookie.name == 'csrftoken')
+        data = urllib.parse.urlencode({'username': username, 'password': PASSWORD, 'csrfmiddlewaretoken': csrf})
+        request = urllib.request.Request(
+            f"{self.base_url}/login/", data=data.encode(), headers={'Referer': f"{self.base_url}/login/"},
+        )
+        self.opener.open(request).read()
+
+    def request(self, method, path, payload=None, stream=False):
+        start = time.perf_counter()
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method=method, headers={'Content-Type': 'application/json'},
+        )
+        try:
+            with self.opener.open(request, timeout=120) as response:
+                first = response.read(1)
+                first_byte = time.perf_counter() - start
+                body = first + response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            return e.code, None, time.perf_counter() - start
+        parsed = _last_sse_event(body) if stream else _json(body)
+        return status, parsed, first_byte
+
+
+def _json(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def _last_sse_event(body):
+    events = [event for event in body.decode().split('\n\n') if event.startswith('data: ')]
+    return json.loads(events[-1][6:]) if events else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive multi-turn chat conversations (start_analysis, send_message x N, load_session) for guest and "
+        "logged-in users, and report throughput, latency percentiles and database queries per request. "
+        "Runs in-process against the stub Gemini backend by default, or against a running server with --url."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=50)
+        parser.add_argument('--turns', type=int, default=4, help='send_message calls per conversation')
+        parser.add_argument('--concurrency', type=int, default=10, help='Conversations in flight at once')
+        parser.add_argument('--guest-ratio', type=float, default=0.5, help='Share of conversations by guests')
+        parser.add_argument('--stream', action='store_true', help='Use the streaming send_message endpoint')
+        parser.add_argument('--async-api', action='store_true', help='Use the /api/async/ endpoints')
+        parser.add_argument(
+            '--url', help='Base URL of a running server (start it with GEMINI_STUB=True) instead of in-process',
+        )
+        parser.add_argument('--metrics-token', default='', help='METRICS_TOKEN of the server, for query counts')
+        parser.add_argument('--latency', type=float, help='Median stub Gemini latency in seconds (in-process)')
+        parser.add_argument('--error-rate', type=float, help='Stub Gemini error rate (in-process)')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users and their sessions')
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+        if options['stream'] and options['async_api']:
+            self.stderr.write("There is no async streaming endpoint; use --stream or --async-api.")
+            return
+
+        overrides = {'GEMINI_STUB': True, 'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if options['latency'] is not None:
+            overrides['GEMINI_STUB_LATENCY'] = options['latency']
+        if options['error_rate'] is not None:
+            overrides['GEMINI_STUB_ERROR_RATE'] = options['error_rate']
+
+        users = self.create_users(options)
+        try:
+            if options['url']:
+                self.run(options, users)
+            else:
+                with override_settings(**overrides):
+                    self.run(options, users)
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def create_users(self, options):
+        # One user per concurrent conversation is enough; their sessions pile up like a real account's
+        count = min(options['concurrency'], options['conversations'])
+        password = make_password(PASSWORD)
+        existing = set(User.objects.filter(username__startswith=USER_PREFIX).values_list('username', flat=True))
+        User.objects.bulk_create(
+            User(username=f'{USER_PREFIX}{n}', password=password)
+            for n in range(count) if f'{USER_PREFIX}{n}' not in existing
+        )
+        return list(User.objects.filter(username__startswith=USER_PREFIX).order_by('id')[:count])
+
+    def run(self, options, users):
+        self.results = defaultdict(list)
+        self.results_lock = threading.Lock()
+        api = '/api/async' if options['async_api'] else '/api'
+        send_path = f'{api}/send_message/stream/' if options['stream'] else f'{api}/send_message/'
+        plan = [random.random() >= options['guest_ratio'] for _ in range(options['conversations'])]
+
+        queries_before = self.query_totals(options)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            futures = [
+                executor.submit(
+                    self.conversation, n, users[n % len(users)] if authenticated else None,
+                    api, send_path, options,
+                )
+                for n, authenticated in enumerate(plan)
+            ]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+        queries = {
+            view: (total - queries_before.get(view, (0, 0))[0], count - queries_before.get(view, (0, 0))[1])
+            for view, (total, count) in self.query_totals(options).items()
+        }
+        self.report(options, plan, elapsed, queries)
+
+    def client(self, user, options):
+        if options['url']:
+            return HTTPClient(options['url'], user.username if user else None)
+        return LocalClient(user)
+
+    def conversation(self, n, user, api, send_path, options):
+        try:
+            client = self.client(user, options)
+            analysis_type = random.choice(AnalysisSession.ANALYSIS_TYPES)[0]
+            data = self.call(client, 'start_analysis', 'POST', f'{api}/start_analysis/', {'analysis_type': analysis_type})
+            session_id = data and data.get('session_id')
+            if not session_id:
+                return
+            for turn in range(options['turns']):
+                # Unique answers, so the reply cache does not short-circuit the turns
+                message = f"{random.choice(ANSWERS).format(n=random.randint(1, 9))} ({n}.{turn})"
+                self.call(client, 'send_message', 'POST', send_path, {'session_id': session_id, 'message': message},
+                          stream=options['stream'])
+            if user is not None:
+                self.call(client, 'load_session', 'GET', f'/api/sessions/{session_id}/')
+        finally:
+            if not options['url']:
+                connections.close_all()
+
+    def call(self, client, label, method, path, payload=None, stream=False):
+        start = time.perf_counter()
+        try:
+            status, data, first_byte = client.request(method, path, payload, stream=stream)
+        except Exception as e:
+            status, data, first_byte = f'error: {e}', None, None
+        elapsed = time.perf_counter() - start
+        ok = status == 200 and not (data or {}).get('error')
+        # Gemini failures still answer 200, with the canned reply
+        fallback = ok and (data or {}).get('ai_response') == FALLBACK_RESPONSE
+        with self.results_lock:
+            self.results[label].append((elapsed, first_byte or elapsed, ok, fallback))
+        return data if ok else None
+
+    def query_totals(self, options):
+        """{view: (queries, requests)} so far, from the request metrics"""
+        if not settings.METRICS_ENABLED and not options['url']:
+            return {}
+        if options['url']:
+            request = urllib.request.Request(f"{options['url'].rstrip('/')}/metrics")
+            if options['metrics_token']:
+                request.add_header('Authorization', f"Bearer {options['metrics_token']}")
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    text = response.read().decode()
+            except (urllib.error.URLError, OSError):
+                return {}
+            samples = [(kind, view, float(value)) for kind, view, value in QUERIES_SAMPLE_RE.findall(text)]
+        else:
+            from chat.middleware import REQUEST_QUERIES
+
+            samples = [
+                (sample.rsplit('_', 1)[1], labels['view'], value)
+                for sample, labels, value in REQUEST_QUERIES.samples()
+                if sample.endswith(('_sum', '_count'))
+            ]
+        totals = defaultdict(lambda: [0.0, 0.0])
+        for kind, view, value in samples:
+            totals[view][0 if kind == 'sum' else 1] += value
+        return {view: tuple(values) for view, values in totals.items()}
+
+    def report(self, options, plan, elapsed, queries):
+        requests = sum(len(results) for results in self.results.values())
+        errors = sum(not ok for results in self.results.values() for _, _, ok, _ in results)
+        target = options['url'] or f"in-process, stub latency {settings.GEMINI_STUB_LATENCY}s"
+        self.stdout.write(
+            f"{len(plan)} conversations ({plan.count(False)} guest, {plan.count(True)} logged in), "
+            f"{options['turns']} turns, concurrency {options['concurrency']}, "
+            f"{'streaming' if options['stream'] else 'async' if options['async_api'] else 'sync'} API, {target}"
+        )
+        self.stdout.write(
+            f"{elapsed:.1f}s, {requests} requests, {requests / elapsed:.1f} req/s, "
+            f"{len(plan) / elapsed:.2f} conversations/s, {errors} errors"
+        )
+        self.stdout.write(
+            f"\n{'endpoint':<16} {'count':>6} {'errors':>6} {'fallback':>8} "
+            f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttfb p50':>9}"
+        )
+        for label in ('start_analysis', 'send_message', 'load_session'):
+            results = self.results.get(label)
+            if not results:
+                continue
+            timings = sorted(elapsed * 1000 for elapsed, _, _, _ in results)
+            first_bytes = sorted(first_byte * 1000 for _, first_byte, _, _ in results)
+            self.stdout.write(
+                f"{label:<16} {len(results):>6} {sum(not ok for _, _, ok, _ in results):>6} "
+                f"{sum(fallback for _, _, _, fallback in results):>8} "
+                f"{percentile(timings, 50):>9.1f} {percentile(timings, 95):>9.1f} {percentile(timings, 99):>9.1f} "
+                f"{percentile(first_bytes, 50):>9.1f}"
+            )
+
+        if not queries:
+            self.stdout.write("\nNo query counts (metrics disabled or /metrics not readable; see --metrics-token)")
+            return
+        self.stdout.write(f"\n{'view':<24} {'requests':>8} {'queries/request':>16}")
+        for view, (total, count) in sorted(queries.items()):
+            if count:
+                self.stdout.write(f"{view:<24} {int(count):>8} {total / count:>16.1f}")
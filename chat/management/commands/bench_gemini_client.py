@@ -0,0 +1,65 @@
+import os
+import statistics
+import time
+
+import google.generativeai as genai
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from google.generativeai import client as genai_client
+
+from chat import ai_service
+
+
+class Command(BaseCommand):
+    help = "Measure per-turn Gemini client setup cost: a new client per request vs the shared process-wide client"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--turns', type=int, default=200, help='Chat turns to simulate per mode')
+        parser.add_argument(
+            '--network', action='store_true',
+            help='Also make one count_tokens call per turn, so connection and TLS setup are included (needs GEMINI_API_KEY)',
+        )
+
+    def handle(self, *args, **options):
+        turns = options['turns']
+        network = options['network']
+        # Client construction needs a key even when no request is made
+        api_key = os.environ.setdefault('GEMINI_API_KEY', 'benchmark-key')
+        model_name = settings.GEMINI_MODEL
+
+        def per_request_client():
+            # What every request did before: reconfigure, rebuild the model and its channel
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(model_name)
+            model._client = genai_client.get_default_generative_client()
+            return model
+
+        def shared_client():
+            model = ai_service.get_gemini_model(model_name)
+            if model._client is None:
+                model._client = genai_client.get_default_generative_client()
+            return model
+
+        results = {}
+        for label, setup in (('per-request', per_request_client), ('shared', shared_client)):
+            timings = []
+            for _ in range(turns):
+                start = time.perf_counter()
+                model = setup()
+                if network:
+                    model.count_tokens('ping')
+                timings.append((time.perf_counter() - start) * 1000)
+            results[label] = timings
+
+            # The per-request mode reconfigured genai; reset so the shared client starts cold
+            ai_service._configured = False
+            ai_service._models.clear()
+
+        self.stdout.write(f"{turns} turns, model={model_name}, network={'yes' if network else 'no'}")
+        self.stdout.write(f"{'mode':<12} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'total ms':>10}")
+        for label, timings in results.items():
+            timings.sort()
+            self.stdout.write(
+                f"{label:<12} {statistics.mean(timings):>10.3f} {timings[len(timings) // 2]:>10.3f} "
+                f"{timings[int(len(timings) * 0.95) - 1]:>10.3f} {sum(timings):>10.1f}"
+            )
@@ -0,0 +1,91 @@
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management.base import BaseCommand
+
+from chat.guest_store import CacheGuestSessionStore, InMemoryGuestSessionStore, SQLiteGuestSessionStore
+
+
+class Command(BaseCommand):
+    help = "Benchmark throughput and memory of the guest session stores"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=2000, help='Guest sessions to simulate')
+        parser.add_argument('--turns', type=int, default=10, help='Turns per session')
+        parser.add_argument('--message-size', type=int, default=600, help='Characters per message')
+        parser.add_argument(
+            '--cache-alias',
+            help='Benchmark the cache store against this CACHES alias instead of a temporary file cache',
+        )
+
+    def handle(self, *args, **options):
+        sessions = options['sessions']
+        turns = options['turns']
+        content = 'x' * options['message_size']
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_store = CacheGuestSessionStore(cache_alias=options['cache_alias'] or settings.GUEST_SESSION_CACHE)
+            if not options['cache_alias']:
+                cache_store.cache = FileBasedCache(
+                    os.path.join(tmp_dir, 'cache'), {'OPTIONS': {'MAX_ENTRIES': settings.GUEST_SESSION_MAX_ENTRIES}}
+                )
+
+            stores = [
+                ('in-memory', InMemoryGuestSessionStore(), None),
+                ('sqlite', SQLiteGuestSessionStore(path=os.path.join(tmp_dir, 'sqlite', 'guest_sessions.sqlite3')), os.path.join(tmp_dir, 'sqlite')),
+                ('cache', cache_store, None if options['cache_alias'] else os.path.join(tmp_dir, 'cache')),
+            ]
+
+            self.stdout.write(
+                f"{sessions} sessions x {turns} turns, {options['message_size']} chars per message, "
+                f"max {settings.GUEST_SESSION_MAX_ENTRIES} entries"
+            )
+            self.stdout.write(
+                f"{'store':<10} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'py heap MB':>11} {'disk MB':>9} {'stored':>8}"
+            )
+            for label, store, disk_path in stores:
+                tracemalloc.start()
+                timings = self.run_workload(store, sessions, turns, content)
+                heap = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+                tracemalloc.stop()
+
+                timings.sort()
+                disk = self.disk_size(disk_path) / 1024 / 1024 if disk_path else 0
+                size = store.size()
+                self.stdout.write(
+                    f"{label:<10} {len(timings) / (sum(timings) / 1000):>10.0f} "
+                    f"{statistics.median(timings):>9.3f} {timings[int(len(timings) * 0.99) - 1]:>9.3f} "
+                    f"{heap:>11.1f} {disk:>9.1f} {size if size is not None else '-':>8}"
+                )
+
+    def run_workload(self, store, sessions, turns, content):
+        """Create sessions, then replay turns round-robin like interleaved guests"""
+        timings = []
+        ids = []
+        for _ in range(sessions):
+            start = time.perf_counter()
+            ids.append(store.create({'analysis_type': 'general', 'title': 'Bench', 'messages': [], 'created_at': 'Just now'}))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        for _ in range(turns):
+            for session_id in ids:
+                start = time.perf_counter()
+                data = store.get(session_id)
+                if data is not None:
+                    data['messages'].append({'content': content, 'is_user': True, 'timestamp': 'Now'})
+                    data['messages'].append({'content': content, 'is_user': False, 'timestamp': 'Now'})
+                    store.save(session_id, data)
+                timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def disk_size(self, path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path)
+            for name in names
+        )
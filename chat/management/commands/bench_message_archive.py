@@ -0,0 +1,143 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from chat import archive
+from chat.models import AnalysisSession, ChatMessage, MessageArchive
+from chat.rendering import render_markdown
+from chat.views import message_window
+
+WORDS = (
+    "sleep energy stress water hydration caffeine exercise routine morning evening week day hours meal protein "
+    "vitamin iron magnesium fibre sugar balance habit screen light rest recovery walk stretch posture focus "
+    "mood anxiety pressure heart rate digestion gut symptoms fatigue headache pain mobility strength cardio "
+    "doctor advice professional consistent small change help usually often sometimes rarely notice pattern "
+    "track journal goal plan schedule breakfast lunch dinner snack fruit vegetables grains alcohol weekend "
+    "the a and or of to in for with your you is are can may could might should this that it how when what"
+).split()
+
+
+def reply_text(chars):
+    """Markdown of about ``chars`` characters, varied like a real reply"""
+    blocks = []
+    while sum(len(block) + 2 for block in blocks) < chars:
+        sentence = " ".join(random.choices(WORDS, k=random.randint(8, 20))).capitalize() + "."
+        kind = random.random()
+        if kind < 0.3:
+            blocks.append(f"* **{random.choice(WORDS).title()}**: {sentence}")
+        elif kind < 0.4:
+            blocks.append(f"### {random.choice(WORDS).title()} and {random.choice(WORDS)}")
+        else:
+            blocks.append(sentence)
+    return "\n\n".join(blocks)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Build idle sessions with realistic replies, archive them, and report the space saved and the "
+        "latency of loading a conversation from the hot table and from the archive. Everything runs in "
+        "a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=40, help='Messages per session')
+        parser.add_argument('--reply-chars', type=int, default=2500, help='Approximate length of an AI reply')
+        parser.add_argument('--loads', type=int, default=300, help='Timed conversation loads per case')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        session_ids = self.populate(options)
+        hot_bytes = ChatMessage.objects.filter(session_id__in=session_ids).aggregate(
+            total=Sum(Length('content') + Length('content_html'))
+        )['total']
+        self.stdout.write(
+            f"{len(session_ids)} sessions x {options['messages']} messages on {connection.vendor}, "
+            f"{hot_bytes / 1024 / 1024:.1f} MB of message text"
+        )
+
+        hot = self.measure(session_ids, options['loads'])
+
+        started = time.perf_counter()
+        idle_before = timezone.now()
+        for session_id in session_ids:
+            archive.archive_session(session_id, idle_before)
+        archive_seconds = time.perf_counter() - started
+        stored = MessageArchive.objects.filter(pk__in=session_ids).aggregate(
+            raw=Sum('raw_bytes'), compressed=Sum('compressed_bytes')
+        )
+        self.stdout.write(
+            f"archived in {archive_seconds:.1f}s: {ChatMessage.objects.filter(session_id__in=session_ids).count()} "
+            f"messages left in the hot table, {stored['raw'] / 1024 / 1024:.1f} MB of rows stored in "
+            f"{stored['compressed'] / 1024 / 1024:.2f} MB ({stored['raw'] / stored['compressed']:.1f}x)"
+        )
+
+        cold = self.measure(session_ids, options['loads'])
+
+        self.stdout.write(f"{'conversation load':<20} {'median ms':>10} {'p95 ms':>10}")
+        for label, timings in (('hot table', hot), ('archive', cold)):
+            self.stdout.write(
+                f"{label:<20} {statistics.median(timings):>10.2f} {statistics.quantiles(timings, n=20)[-1]:>10.2f}"
+            )
+
+        timings = []
+        for session_id in random.sample(session_ids, min(len(session_ids), 50)):
+            started = time.perf_counter()
+            archive.restore(session_id)
+            timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(f"restore on the next turn: median {statistics.median(timings):.2f} ms")
+
+    def populate(self, options):
+        user = User.objects.create_user('bench-archive')
+        idle_since = timezone.now() - timedelta(days=90)
+        sessions = AnalysisSession.objects.bulk_create(
+            AnalysisSession(user=user, analysis_type='sleep_quality', message_count=options['messages'])
+            for _ in range(options['sessions'])
+        )
+        session_ids = [session.id for session in sessions]
+        batch = []
+        for session_id in session_ids:
+            for turn in range(options['messages']):
+                if turn % 2:
+                    content = reply_text(options['reply_chars'])
+                    batch.append(ChatMessage(session_id=session_id, content=content, content_html=render_markdown(content)))
+                else:
+                    content = " ".join(random.choices(WORDS, k=random.randint(5, 40)))
+                    batch.append(ChatMessage(session_id=session_id, content=content, is_user=True))
+            if len(batch) >= 2000:
+                ChatMessage.objects.bulk_create(batch)
+                batch = []
+        ChatMessage.objects.bulk_create(batch)
+        # Idle for months; update() because updated_at is auto_now
+        AnalysisSession.objects.filter(pk__in=session_ids).update(updated_at=idle_since)
+        return session_ids
+
+    def measure(self, session_ids, loads):
+        """Milliseconds to load the latest page of a random conversation, as load_session does"""
+        timings = []
+        for _ in range(loads):
+            session_id = random.choice(session_ids)
+            started = time.perf_counter()
+            session = AnalysisSession.objects.only('id', 'archived_at').get(pk=session_id)
+            message_window(session)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
@@ -0,0 +1,101 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chat import search
+from chat.management.commands.bench_message_archive import WORDS, reply_text
+from chat.models import AnalysisSession, ChatMessage
+
+
+# Each message also mentions a few of these, as real messages mention specific things
+RARE_TERMS = 20000
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a synthetic message history and compare a user's search through the full-text index "
+        "(chat/search.py) with the icontains scan it replaces. Everything runs in a transaction that is "
+        "rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--messages', type=int, default=50000, help='Messages in total')
+        parser.add_argument('--reply-chars', type=int, default=600)
+        parser.add_argument('--queries', type=int, default=100, help='Timed searches per case')
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stderr.write(f"Full-text search is not available on {connection.vendor}.")
+            return
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        started = time.perf_counter()
+        users = self.populate(options)
+        self.stdout.write(
+            f"{options['messages']} messages from {len(users)} users on {connection.vendor} "
+            f"({time.perf_counter() - started:.1f}s to build)"
+        )
+
+        rare = lambda: f"term{random.randrange(RARE_TERMS)}"
+        common = lambda: random.choice(WORDS)
+        cases = [
+            ('user, rare word', rare, lambda user, word: list(
+                ChatMessage.objects.filter(session__user=user, content__icontains=word).values_list('id', flat=True)[:20]
+            ), lambda user, word: search.search_messages(user, word, 20)),
+            ('user, common word', common, lambda user, word: list(
+                ChatMessage.objects.filter(session__user=user, content__icontains=word).values_list('id', flat=True)[:20]
+            ), lambda user, word: search.search_messages(user, word, 20)),
+            # The admin searches every user's messages and counts the matches
+            ('admin, rare word', rare, lambda user, word: ChatMessage.objects.filter(content__icontains=word).count(),
+             lambda user, word: ChatMessage.objects.filter(search.matches(word)).count()),
+        ]
+        self.stdout.write(f"{'search':<20} {'scan median ms':>15} {'index median ms':>16}")
+        for label, pick_word, scan, indexed in cases:
+            medians = []
+            for run in (scan, indexed):
+                timings = []
+                for _ in range(options['queries']):
+                    user, word = random.choice(users), pick_word()
+                    query_started = time.perf_counter()
+                    run(user, word)
+                    timings.append((time.perf_counter() - query_started) * 1000)
+                medians.append(statistics.median(timings))
+            self.stdout.write(f"{label:<20} {medians[0]:>15.2f} {medians[1]:>16.2f}")
+
+    def populate(self, options):
+        users = User.objects.bulk_create(User(username=f'bench-search-{n}') for n in range(options['users']))
+        sessions = AnalysisSession.objects.bulk_create(
+            AnalysisSession(user=user, analysis_type='general') for user in users for _ in range(5)
+        )
+        batch = []
+        for n in range(options['messages']):
+            batch.append(ChatMessage(
+                session=random.choice(sessions),
+                content=reply_text(options['reply_chars']) + ' ' + ' '.join(
+                    f"term{random.randrange(RARE_TERMS)}" for _ in range(3)
+                ),
+                is_user=n % 2 == 0,
+            ))
+            if len(batch) >= 2000:
+                ChatMessage.objects.bulk_create(batch)
+                batch = []
+        ChatMessage.objects.bulk_create(batch)
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        return users
@@ -0,0 +1,94 @@
+import json
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import Client, override_settings
+
+PASSWORD = 'bench-session-password'
+CONFIGS = [
+    ('save every request', {'SESSION_ENGINE': 'django.contrib.sessions.backends.db', 'SESSION_SAVE_EVERY_REQUEST': True}),
+    ('refresh threshold', {'SESSION_ENGINE': 'chat.session_backend', 'SESSION_SAVE_EVERY_REQUEST': False}),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Count django_session writes per request with the old save-every-request setup and with "
+        "chat.session_backend. A signed-in user browses for --hours of simulated time; Gemini is "
+        "replaced by the offline stub. Everything runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per setup')
+        parser.add_argument('--hours', type=float, default=72, help='Simulated time the requests are spread over')
+
+    def handle(self, *args, **options):
+        # Per-request info logs would bury the results
+        logging.getLogger('chat').setLevel(logging.WARNING)
+        self.stdout.write(
+            f"{options['requests']} requests over {options['hours']:g} simulated hours per setup"
+        )
+        self.stdout.write(f"{'setup':<20} {'writes':>7} {'per request':>12}   by statement")
+        for label, overrides in CONFIGS:
+            try:
+                with transaction.atomic(), override_settings(
+                    GEMINI_STUB=True,
+                    GEMINI_STUB_LATENCY=0.001,
+                    # Compaction threads would not see the uncommitted rows
+                    CHAT_CONTEXT_BACKGROUND=False,
+                    ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                    **overrides,
+                ):
+                    writes = self.run(options)
+                    raise Rollback
+            except Rollback:
+                pass
+            total = sum(writes.values())
+            detail = ', '.join(f"{statement} {count}" for statement, count in sorted(writes.items()))
+            self.stdout.write(f"{label:<20} {total:>7} {total / options['requests']:>12.3f}   {detail or '-'}")
+
+    def run(self, options):
+        user = User.objects.create_user('bench-session', password=PASSWORD)
+        client = Client()
+        client.post('/login/', {'username': user.username, 'password': PASSWORD})
+        session_id = client.post(
+            '/api/start_analysis/', json.dumps({'analysis_type': 'sleep_quality'}), content_type='application/json',
+        ).json()['session_id']
+        pages = [
+            ('GET', '/dashboard/'),
+            ('GET', f'/chat/{session_id}/'),
+            ('GET', '/api/sessions/'),
+            ('GET', f'/api/sessions/{session_id}/'),
+            ('POST', '/api/send_message/'),
+        ]
+        step = timedelta(hours=options['hours'] / options['requests'])
+
+        writes = Counter()
+
+        def count_writes(execute, sql, params, many, context):
+            if 'django_session' in sql and not sql.startswith('SELECT'):
+                writes[sql.split(None, 1)[0]] += 1
+            return execute(sql, params, many, context)
+
+        for n in range(options['requests']):
+            method, path = pages[n % len(pages)]
+            with connection.execute_wrapper(count_writes):
+                if method == 'POST':
+                    client.post(path, json.dumps({'message': 'Still tired', 'session_id': session_id}),
+                                content_type='application/json')
+                else:
+                    client.get(path)
+            # Time passes: the session gets closer to its expiry
+            Session.objects.update(expire_date=F('expire_date') - step)
+        return writes
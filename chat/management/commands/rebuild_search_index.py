@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chat import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreate the full-text message index (chat/search.py) and reindex every message. Needed on SQLite "
+        "after a migration has remade chat_chatmessage, which drops the triggers that keep the index current."
+    )
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stderr.write(f"Full-text search is not available on {connection.vendor}.")
+            return
+        with transaction.atomic():
+            search.drop_index(connection)
+            search.create_index(connection)
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(f"Search index rebuilt on {connection.vendor}"))
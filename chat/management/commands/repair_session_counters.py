@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from chat import session_counters
+from chat.models import AnalysisSession
+
+
+class Command(BaseCommand):
+    help = "Recompute the message counters of sessions from their messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', nargs='*', type=int, help='Session ids to repair (default: all)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Sessions per transaction')
+
+    def handle(self, *args, **options):
+        sessions = AnalysisSession.objects.order_by('pk')
+        if options['sessions']:
+            sessions = sessions.filter(pk__in=options['sessions'])
+
+        # Walk the sessions in id order, one short transaction per chunk
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            session_ids = list(sessions.filter(pk__gt=last_id).values_list('pk', flat=True)[:options['chunk_size']])
+            if not session_ids:
+                break
+            repaired += session_counters.repair(session_ids)
+            checked += len(session_ids)
+            last_id = session_ids[-1]
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  up to session {last_id}: {checked} checked, {repaired} repaired")
+
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(f"{checked} sessions checked, {repaired} repaired"))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Add the sessions, messages and completed reports created since the last run to the hourly usage "
+        "rollups, then recompute the daily rollups of the days touched (chat/rollups.py). Each chunk commits "
+        "with its watermark, so the command can be stopped and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag', type=int, default=settings.USAGE_ROLLUP_LAG,
+            help='Leave rows younger than this many seconds for the next run',
+        )
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Ids read per transaction')
+
+    def handle(self, *args, **options):
+        read = rollups.roll_up(chunk_size=options['chunk_size'], lag=options['lag'])
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Rolled up {read['sessions']} sessions, {read['messages']} messages "
+                f"and {read['completions']} completed reports"
+            ))
@@ -0,0 +1,60 @@
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from chat.report_jobs import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued analysis report jobs from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.REPORT_WORKER_CONCURRENCY,
+            help='Reports generated in parallel',
+        )
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when no job is due')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of polling')
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.once = options['once']
+        self.poll_interval = options['poll_interval']
+
+        # Finish the reports in flight, then exit
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self.stop.set())
+
+        worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [
+            threading.Thread(target=self.work, args=(f"{worker_prefix}:{n}",), name=f'report-worker-{n}')
+            for n in range(options['concurrency'])
+        ]
+        self.stdout.write(f"Report worker {worker_prefix} started with {len(threads)} threads")
+        for thread in threads:
+            thread.start()
+        # Join with a timeout so the main thread keeps handling signals
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+        self.stdout.write("Report worker stopped")
+
+    def work(self, worker_id):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                job = claim_next_job(worker_id)
+                if job is None:
+                    if self.once:
+                        return
+                    self.stop.wait(self.poll_interval)
+                    continue
+                succeeded = run_job(job)
+                self.stdout.write(f"{worker_id} job {job.pk}: {'succeeded' if succeeded else 'attempt failed'}")
+        finally:
+            connections.close_all()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import question_pool
+
+
+class Command(BaseCommand):
+    help = "Fill the cached pools of opening questions, one per analysis type"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--types', nargs='*', help='Analysis types to warm (default: all)')
+        parser.add_argument('--variants', type=int, help='Variants to keep per type (default: OPENING_QUESTIONS_POOL_SIZE)')
+        parser.add_argument('--replace', action='store_true', help='Discard the current variants and generate new ones')
+
+    def handle(self, *args, **options):
+        analysis_types = options['types'] or question_pool.analysis_types()
+        unknown = set(analysis_types) - set(question_pool.analysis_types())
+        if unknown:
+            raise CommandError(f"Unknown analysis types: {', '.join(sorted(unknown))}")
+
+        for analysis_type in analysis_types:
+            if options['replace']:
+                question_pool.clear_pool(analysis_type)
+            added = question_pool.refill(analysis_type, options['variants'])
+            size = len(question_pool.load_pool(analysis_type))
+            self.stdout.write(f"{analysis_type}: +{added} variants, {size} in pool")
@@ -0,0 +1,368 @@
+"""
+Prometheus metrics for the chat and Gemini hot paths, served on /metrics.
+
+Each process records counters and histograms in memory. A background thread
+writes them every settings.METRICS_FLUSH_INTERVAL seconds to a SQLite file
+shared by every process on the host (settings.METRICS_SQLITE_PATH), and
+/metrics adds up the rows of all processes. A scrape therefore sees the whole
+host whichever gunicorn worker answers it, and report workers are included,
+without a pushgateway or any other service.
+
+- Counters and histograms are summed over processes. A restarted worker's
+  counters start again from zero, which Prometheus treats as a reset.
+- Gauges are summed over the processes that flushed in the last
+  settings.METRICS_STALE_AFTER seconds, so a stopped worker drops out.
+- Once a process has gone quiet for that long and no longer exists, its
+  counters and histograms are folded into one row (pid 0) and its gauges are
+  dropped, so the file does not grow with every worker restart while the
+  totals never go backwards.
+- Live gauges (the guest session store size) are read when scraped.
+
+The counters kept by the other chat modules (response cache, single-flight,
+question pool, context compaction, circuit breakers) are exported as well.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'doctor_ai_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+_registry_lock = threading.Lock()
+_registry = {}
+_live_gauges = {}
+
+
+def _labels_key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry[self.name] = self
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """(sample name, labels, value) triples for the values recorded in this process"""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _start_flusher()
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(f'{self.name}_total', dict(zip(self.labelnames, key)), value) for key, value in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+        _start_flusher()
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', {**labels, 'le': str(bound)}, cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class StatsMetric(Metric):
+    """A stats function of another module, exported as one labelled counter or gauge family.
+
+    ``read`` returns {label value: number}, or {(label values): number} for
+    several labels, as counted by this process since it started.
+    """
+
+    def __init__(self, name, help_text, labelnames, read, kind='counter'):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self.read = read
+
+    def samples(self):
+        try:
+            values = self.read()
+        except Exception as e:
+            logger.warning("Reading %s failed: %s", self.name, e)
+            return []
+        sample_name = f'{self.name}_total' if self.kind == 'counter' else self.name
+        return [
+            (sample_name, dict(zip(self.labelnames, key if isinstance(key, tuple) else (key,))), value)
+            for key, value in values.items()
+        ]
+
+
+def live_gauge(name, help_text, read):
+    """A gauge read when /metrics is scraped, from the process serving the scrape"""
+    _live_gauges[PREFIX + name] = (help_text, read)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+
+class SQLiteMetricsStore:
+    """Latest samples of every process on the host"""
+
+    def __init__(self, path=None):
+        self.path = str(path or settings.METRICS_SQLITE_PATH)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metric_sample ("
+                " pid INTEGER NOT NULL, family TEXT NOT NULL, kind TEXT NOT NULL,"
+                " sample TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL,"
+                " updated_at REAL NOT NULL, PRIMARY KEY (pid, sample, labels))"
+            )
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def write(self, pid, rows):
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO metric_sample (pid, family, kind, sample, labels, value, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(pid, family, kind, sample, _labels_key(labels), value, now)
+                 for family, kind, sample, labels, value in rows],
+            )
+
+    def fold_dead(self, stale_before):
+        """Fold the rows of exited processes into the pid 0 row. Returns the pids folded."""
+        conn = self._connection()
+        stale = [pid for (pid,) in conn.execute(
+            "SELECT pid FROM metric_sample WHERE pid != 0 GROUP BY pid HAVING MAX(updated_at) < ?",
+            (stale_before,),
+        )]
+        # A stalled process that is still alive would write its full counters
+        # again on its next flush, so only processes that are gone are folded
+        dead = [pid for pid in stale if not _pid_alive(pid)]
+        if not dead:
+            return []
+        placeholders = ','.join('?' * len(dead))
+        with conn:
+            conn.execute(
+                "INSERT INTO metric_sample (pid, family, kind, sample, labels, value, updated_at)"
+                " SELECT 0, family, kind, sample, labels, SUM(value), MAX(updated_at) FROM metric_sample"
+                f" WHERE pid IN ({placeholders}) AND kind != 'gauge' GROUP BY family, kind, sample, labels"
+                " ON CONFLICT (pid, sample, labels) DO UPDATE SET"
+                " value = value + excluded.value, updated_at = MAX(updated_at, excluded.updated_at)",
+                dead,
+            )
+            conn.execute(f"DELETE FROM metric_sample WHERE pid IN ({placeholders})", dead)
+        return dead
+
+    def totals(self, stale_before):
+        """Samples summed over processes: [(family, kind, sample, labels, value)]"""
+        try:
+            self.fold_dead(stale_before)
+        except sqlite3.Error as e:
+            logger.warning("Folding metrics of exited processes failed: %s", e)
+        return self._connection().execute(
+            "SELECT family, kind, sample, labels, SUM(value) FROM metric_sample"
+            " WHERE kind != 'gauge' OR updated_at >= ?"
+            " GROUP BY family, kind, sample, labels",
+            (stale_before,),
+        ).fetchall()
+
+
+@lru_cache(maxsize=None)
+def get_metrics_store():
+    return SQLiteMetricsStore()
+
+
+def flush():
+    """Write this process's samples to the shared store"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    rows = [
+        (metric.name, metric.kind, sample, labels, value)
+        for metric in metrics
+        for sample, labels, value in metric.samples()
+    ]
+    try:
+        get_metrics_store().write(os.getpid(), rows)
+    except Exception as e:
+        logger.warning("Writing metrics failed: %s", e)
+
+
+_flusher_lock = threading.Lock()
+_flusher_pid = None
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _start_flusher():
+    # One thread per process; the pid check starts a new one after a fork
+    global _flusher_pid
+    if _flusher_pid == os.getpid() or not settings.METRICS_ENABLED:
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True).start()
+
+
+atexit.register(lambda: _flusher_pid == os.getpid() and flush())
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _sample_order(row):
+    _, _, sample, labels, _ = row
+    labels = json.loads(labels)
+    le = next((float(value) for name, value in labels if name == 'le'), 0.0)
+    return ([pair for pair in labels if pair[0] != 'le'], sample, le)
+
+
+def render():
+    """All metrics of the host in the Prometheus text format"""
+    flush()
+    families = {}
+    for row in get_metrics_store().totals(time.time() - settings.METRICS_STALE_AFTER):
+        families.setdefault(row[0], []).append(row)
+
+    lines = []
+    for family in sorted(families):
+        metric = _registry.get(family)
+        kind = families[family][0][1]
+        lines.append(f"# HELP {family} {metric.help if metric else family}")
+        lines.append(f"# TYPE {family} {kind}")
+        for _, _, sample, labels, value in sorted(families[family], key=_sample_order):
+            lines.append(f"{sample}{_format_labels(json.loads(labels))} {_format_value(value)}")
+
+    for name, (help_text, read) in sorted(_live_gauges.items()):
+        try:
+            value = read()
+        except Exception as e:
+            logger.warning("Reading %s failed: %s", name, e)
+            continue
+        if value is None:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+def register_chat_stats():
+    """Export the counters the other chat modules keep; called once from ChatConfig.ready"""
+    from .circuit_breaker import get_breaker_stats
+    from .context import get_compaction_stats
+    from .guest_store import get_guest_store
+    from .llm_cache import get_llm_cache_stats
+    from .question_pool import get_pool_stats
+    from .single_flight import get_single_flight_stats
+
+    StatsMetric('llm_cache_events', 'Gemini reply cache lookups and stores', ['event'], get_llm_cache_stats)
+    StatsMetric(
+        'single_flight_events', 'Gemini calls made (leaders) and calls that shared one in flight', ['event'],
+        lambda: {event: value for event, value in get_single_flight_stats().items() if event != 'in_flight'},
+    )
+    StatsMetric(
+        'single_flight_in_flight', 'Coalesced Gemini calls in flight', [],
+        lambda: {(): get_single_flight_stats()['in_flight']}, kind='gauge',
+    )
+    StatsMetric('question_pool_events', 'Opening question pool activity', ['event'], get_pool_stats)
+    StatsMetric('context_compaction', 'Estimated prompt tokens with and without compaction', ['event'],
+                get_compaction_stats)
+
+    def breaker_counts():
+        return {
+            (model, event): value
+            for model, stats in get_breaker_stats().items()
+            for event, value in stats.items()
+            if event in ('successes', 'failures', 'rejected', 'opened')
+        }
+
+    StatsMetric('gemini_breaker_events', 'Circuit breaker outcomes per Gemini model', ['model', 'event'],
+                breaker_counts)
+    StatsMetric(
+        'gemini_breaker_open', 'Processes whose circuit breaker for the model is not closed', ['model'],
+        lambda: {model: int(stats['state'] != 'closed') for model, stats in get_breaker_stats().items()},
+        kind='gauge',
+    )
+    live_gauge('guest_sessions', 'Sessions in the guest session store', lambda: get_guest_store().size())
@@ -0,0 +1,98 @@
+"""
+Per-request latency and database metrics (see chat/metrics.py).
+
+Requests are labelled with the URL name of the view that served them. Queries
+are counted through a database execute wrapper installed on every
+connection, and attributed to the request through a context variable, so the
+queries an async view runs in sync_to_async threads are counted too. Work a
+streaming response does after the view returns (saving a streamed reply) is
+not included.
+"""
+import contextvars
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metrics import QUERY_COUNT_BUCKETS, Histogram
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time to produce the response, per view', ['view', 'method', 'status'],
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries per request', ['view'], buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_QUERY_TIME = Histogram(
+    'http_request_db_query_duration_seconds', 'Time spent in database queries per request', ['view'],
+)
+
+# [queries, seconds] for the request being served
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def _count_queries(execute, sql, params, many, context):
+    counts = _request_queries.get()
+    if counts is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counts[0] += 1
+        counts[1] += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # At the front: execute_wrapper() blocks pop the last wrapper when they exit
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_queries)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            instrument_connection(None, connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counts = [0, 0.0]
+        token = _request_queries.set(counts)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            _request_queries.reset(token)
+            self.record(request, response, time.perf_counter() - start, counts)
+
+    async def __acall__(self, request):
+        counts = [0, 0.0]
+        token = _request_queries.set(counts)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            _request_queries.reset(token)
+            self.record(request, response, time.perf_counter() - start, counts)
+
+    def record(self, request, response, duration, counts):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        status = response.status_code if response is not None else 500
+        REQUEST_DURATION.observe(duration, view=view, method=request.method, status=status)
+        REQUEST_QUERIES.observe(counts[0], view=view)
+        REQUEST_QUERY_TIME.observe(counts[1], view=view)
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_alter_analysissession_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissession',
+            name='summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='analysissession',
+            name='summary_message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='analysissession',
+            name='summary_source_tokens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
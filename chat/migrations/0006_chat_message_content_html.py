@@ -0,0 +1,104 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:30
+
+import re
+
+from django.db import migrations, models
+from django.utils.html import escape
+
+# A frozen copy of chat.rendering.render_markdown as it stood when this
+# migration was written, so later changes to the renderer don't change it.
+HEADER_RE = re.compile(r'^#+\s+', re.MULTILINE)
+RULE_RE = re.compile(r'^\s*[-*_]{3,}\s*$', re.MULTILINE)
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+
+BULLET_RE = re.compile(r'^\s*[*+-]\s+(.*)$')
+NUMBERED_RE = re.compile(r'^\s*(\d+)[.)]\s+(.*)$')
+CODE_RE = re.compile(r'`([^`\n]+)`')
+BOLD_RE = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__')
+ITALIC_RE = re.compile(r'(?<![*\w])\*(?=\S)(.+?)(?<=\S)\*(?![*\w])|(?<![_\w])_(?=\S)(.+?)(?<=\S)_(?![_\w])')
+
+
+def _emphasis(text):
+    text = BOLD_RE.sub(lambda m: f'<strong>{m.group(1) or m.group(2)}</strong>', text)
+    return ITALIC_RE.sub(lambda m: f'<em>{m.group(1) or m.group(2)}</em>', text)
+
+
+def render_inline(text):
+    parts = CODE_RE.split(escape(text))
+    return ''.join(
+        f'<code>{part}</code>' if i % 2 else _emphasis(part)
+        for i, part in enumerate(parts)
+    )
+
+
+def render_block(block):
+    html = []
+    paragraph = []
+    list_tag = None
+
+    def close_paragraph():
+        if paragraph:
+            html.append(f"<p>{'<br>'.join(paragraph)}</p>")
+            paragraph.clear()
+
+    def close_list():
+        nonlocal list_tag
+        if list_tag:
+            html.append(f'</{list_tag}>')
+            list_tag = None
+
+    for line in block.splitlines():
+        if not line.strip() or RULE_RE.match(line):
+            continue
+        line = HEADER_RE.sub('', line)
+        bullet = BULLET_RE.match(line)
+        numbered = None if bullet else NUMBERED_RE.match(line)
+        if bullet or numbered:
+            close_paragraph()
+            tag = 'ul' if bullet else 'ol'
+            if list_tag != tag:
+                close_list()
+                start = int(numbered.group(1)) if numbered else 1
+                html.append(f'<ol start="{start}">' if start != 1 else f'<{tag}>')
+                list_tag = tag
+            html.append(f'<li>{render_inline(bullet.group(1) if bullet else numbered.group(2))}</li>')
+        elif list_tag and line[:1].isspace():
+            html[-1] = f'{html[-1][:-5]}<br>{render_inline(line.strip())}</li>'
+        else:
+            close_list()
+            paragraph.append(render_inline(line.strip()))
+    close_paragraph()
+    close_list()
+    return ''.join(html)
+
+
+def render_markdown(text):
+    return ''.join(render_block(block) for block in BLANK_LINES_RE.split(text or '') if block.strip())
+
+
+def render_existing_replies(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    batch = []
+    for message in ChatMessage.objects.filter(is_user=False).only('id', 'content').iterator(chunk_size=500):
+        message.content_html = render_markdown(message.content)
+        batch.append(message)
+        if len(batch) >= 500:
+            ChatMessage.objects.bulk_update(batch, ['content_html'])
+            batch = []
+    ChatMessage.objects.bulk_update(batch, ['content_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_report_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='content_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(render_existing_replies, migrations.RunPython.noop),
+    ]
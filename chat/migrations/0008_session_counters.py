@@ -0,0 +1,67 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:41
+
+import re
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+from django.utils.text import Truncator
+
+# A frozen copy of chat.session_counters.message_preview
+PREVIEW_CHARS = 120
+MARKUP_RE = re.compile(r'[*_`#]+')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def message_preview(content):
+    text = WHITESPACE_RE.sub(' ', MARKUP_RE.sub('', content or '')).strip()
+    return Truncator(text).chars(PREVIEW_CHARS)
+
+
+def count_existing_messages(apps, schema_editor):
+    AnalysisSession = apps.get_model('chat', 'AnalysisSession')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    session_ids = list(AnalysisSession.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(session_ids), 500):
+        chunk = session_ids[start:start + 500]
+        rows = (
+            ChatMessage.objects.filter(session_id__in=chunk)
+            .order_by()
+            .values('session_id')
+            .annotate(count=Count('pk'), last_id=Max('pk'))
+        )
+        counts = {row['last_id']: row['count'] for row in rows}
+        sessions = []
+        for message in ChatMessage.objects.filter(pk__in=counts).only('id', 'session_id', 'timestamp', 'content'):
+            sessions.append(AnalysisSession(
+                pk=message.session_id,
+                message_count=counts[message.pk],
+                last_message_at=message.timestamp,
+                last_message_preview=message_preview(message.content),
+            ))
+        AnalysisSession.objects.bulk_update(sessions, ['message_count', 'last_message_at', 'last_message_preview'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_chat_message_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissession',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysissession',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='analysissession',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_session_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='chat.analysissession')),
+                ('data', models.BinaryField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('raw_bytes', models.PositiveIntegerField()),
+                ('compressed_bytes', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='analysissession',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
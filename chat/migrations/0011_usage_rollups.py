@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('source', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('last_time', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('period_start', models.DateTimeField()),
+                ('analysis_type', models.CharField(choices=[('vitamin_minerals', 'Vitamin & Minerals Intake'), ('exercise_routine', 'Weekly Exercise Routine'), ('food_quality', 'Weekly Food Quality'), ('sleep_quality', 'Sleep Quality & Habits'), ('stress_levels', 'Stress Levels & Daily Workload'), ('hydration', 'Hydration Levels'), ('mental_wellbeing', 'Mental Well-being Routine'), ('energy_levels', 'Daily Energy Levels'), ('meal_balance', 'Weekly Meal Balance'), ('digestion', 'Digestion & Gut Health'), ('calorie_intake', 'Daily Calorie Intake'), ('posture', 'Posture & Ergonomics'), ('exercise_balance', 'Cardio vs Strength Training Balance'), ('hormone_health', 'Hormone-supporting Lifestyle'), ('immune_health', 'Immune-supporting Habits'), ('productivity', 'Daily Productivity & Burnout Risk'), ('screen_time', 'Screen Time & Blue-light Exposure'), ('environmental_toxins', 'Environmental Toxins Exposure'), ('caffeine', 'Caffeine & Stimulant Consumption'), ('alcohol', 'Alcohol Intake & Lifestyle Balance'), ('menstrual_health', 'Menstrual Cycle Health'), ('mobility', 'Daily Mobility & Flexibility'), ('chronic_pain', 'Chronic Pain Patterns')], max_length=50)),
+                ('session_type', models.CharField(choices=[('authenticated', 'Authenticated'), ('guest', 'Guest')], max_length=20)),
+                ('sessions_started', models.PositiveIntegerField(default=0)),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('user_messages', models.PositiveIntegerField(default=0)),
+                ('sessions_completed', models.PositiveIntegerField(default=0)),
+                ('completion_turns', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-period_start', 'analysis_type', 'session_type'],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'period_start', 'analysis_type', 'session_type'), name='chat_usagerollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+# The first SQLite index read each message's owner through the view
+# chat_message_fts_source, and its triggers looked the owner up in
+# chat_analysissession. SQLite then refuses the table remakes Django's
+# migrations do on chat_analysissession and chat_chatmessage. This replaces
+# it with the index migration 0010 now creates, which refers to no other
+# table; PostgreSQL is left alone.
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TABLE IF EXISTS chat_message_fts",
+    "DROP VIEW IF EXISTS chat_message_fts_source",
+]
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5(content, "
+    "content='chat_chatmessage', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF content ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+
+
+def replace_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'chat_message_fts_source'")
+        if cursor.fetchone() is None:
+            return
+    for statement in SQLITE_DROP + SQLITE_SCHEMA:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(replace_search_index, migrations.RunPython.noop),
+    ]
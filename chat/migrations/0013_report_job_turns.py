@@ -0,0 +1,27 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def count_existing_turns(apps, schema_editor):
+    # The turns at the time of the report are not known for older jobs; the
+    # session's current count is the nearest there is
+    AnalysisSession = apps.get_model('chat', 'AnalysisSession')
+    ReportJob = apps.get_model('chat', 'ReportJob')
+    message_count = AnalysisSession.objects.filter(pk=OuterRef('session_id')).values('message_count')[:1]
+    ReportJob.objects.filter(status='succeeded').update(turns=Subquery(message_count) / 2)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_search_without_view'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='turns',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_turns, migrations.RunPython.noop),
+    ]
@@ -30,28 +30,161 @@ class AnalysisSession(models.Model):
         ('chronic_pain', 'Chronic Pain Patterns'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # Indexed by chat_session_user_updated below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
     analysis_type = models.CharField(max_length=50, choices=ANALYSIS_TYPES)
     title = models.CharField(max_length=200, default="Health Analysis")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_completed = models.BooleanField(default=False)
+    # Rolling summary of the oldest messages, maintained by chat.context
+    summary = models.TextField(blank=True, default='')
+    summary_message_count = models.PositiveIntegerField(default=0)
+    summary_source_tokens = models.PositiveIntegerField(default=0)
+    # Comprehensive analysis report, written by the report worker (chat.report_jobs)
+    report = models.TextField(blank=True, default='')
+    report_generated_at = models.DateTimeField(null=True, blank=True)
+    # Maintained by chat.session_counters, so session lists never read the messages
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=200, blank=True, default='')
+    # Set while the session's messages are in MessageArchive (chat.archive)
+    archived_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # The dashboard and the sessions API list a user's sessions newest first
+            models.Index(fields=['user', '-updated_at', '-id'], name='chat_session_user_updated'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.get_analysis_type_display()}"
+        owner = self.user.username if self.user_id else 'Guest'
+        return f"{owner} - {self.get_analysis_type_display()}"
 
 
 class ChatMessage(models.Model):
-    session = models.ForeignKey(AnalysisSession, on_delete=models.CASCADE, related_name='messages')
+    # Indexed by chat_message_session_time below
+    session = models.ForeignKey(AnalysisSession, on_delete=models.CASCADE, related_name='messages', db_index=False)
     content = models.TextField()
+    # AI replies rendered to HTML when saved (chat.rendering); empty for user messages
+    content_html = models.TextField(blank=True, default='')
     is_user = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ['timestamp']
+        # A turn's two messages are saved together and can share a timestamp
+        ordering = ['timestamp', 'id']
+        indexes = [
+            # Every turn and session load reads a session's messages in order
+            models.Index(fields=['session', 'timestamp'], name='chat_message_session_time'),
+        ]
 
     def __str__(self):
-        return f"{'User' if self.is_user else 'AI'} - {self.content[:50]}"
\ No newline at end of file
+        return f"{'User' if self.is_user else 'AI'} - {self.content[:50]}"
+
+
+class MessageArchive(models.Model):
+    """The messages of an idle session, moved out of ChatMessage by chat.archive"""
+
+    session = models.OneToOneField(AnalysisSession, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    # zlib-compressed JSON list of the message rows
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    raw_bytes = models.PositiveIntegerField()
+    compressed_bytes = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of session {self.session_id} ({self.message_count} messages)"
+
+
+class ReportJob(models.Model):
+    """A queued analysis report, run by `manage.py run_report_worker`"""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    session = models.ForeignKey(AnalysisSession, on_delete=models.CASCADE, related_name='report_jobs')
+    status = models.CharField(max_length=20, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    # Turns in the conversation the report was written from, for chat.rollups
+    turns = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # Workers poll for the next due job
+            models.Index(fields=['status', 'run_after'], name='chat_reportjob_due'),
+        ]
+        constraints = [
+            # At most one queued or running report per session
+            models.UniqueConstraint(
+                fields=['session'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='chat_reportjob_one_active',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Report for session {self.session_id} ({self.status})"
+
+
+class UsageRollup(models.Model):
+    """Activity counts per hour or day, analysis type and session type, kept by chat.rollups"""
+
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITIES = [(HOUR, 'Hour'), (DAY, 'Day')]
+    AUTHENTICATED = 'authenticated'
+    GUEST = 'guest'
+    SESSION_TYPES = [(AUTHENTICATED, 'Authenticated'), (GUEST, 'Guest')]
+
+    granularity = models.CharField(max_length=10, choices=GRANULARITIES)
+    period_start = models.DateTimeField()
+    analysis_type = models.CharField(max_length=50, choices=AnalysisSession.ANALYSIS_TYPES)
+    session_type = models.CharField(max_length=20, choices=SESSION_TYPES)
+    sessions_started = models.PositiveIntegerField(default=0)
+    messages = models.PositiveIntegerField(default=0)
+    user_messages = models.PositiveIntegerField(default=0)
+    # Sessions whose report was written, and their turns at that point
+    sessions_completed = models.PositiveIntegerField(default=0)
+    completion_turns = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-period_start', 'analysis_type', 'session_type']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'period_start', 'analysis_type', 'session_type'], name='chat_usagerollup_bucket',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_granularity_display()} {self.period_start:%Y-%m-%d %H:%M} {self.analysis_type} {self.session_type}"
+
+
+class RollupWatermark(models.Model):
+    """How far chat.rollups has read a source table"""
+
+    source = models.CharField(max_length=50, primary_key=True)
+    # Rows are read in id order, or in time order for sources without a usable id order
+    last_id = models.BigIntegerField(default=0)
+    last_time = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.source
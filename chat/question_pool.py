@@ -0,0 +1,168 @@
+"""
+Pre-generated opening questions per analysis type.
+
+The opening questions depend only on the analysis type, so they are generated
+ahead of time and served from the cache when an analysis starts. Each type
+keeps a pool of up to settings.OPENING_QUESTIONS_POOL_SIZE variants. Variants
+expire after settings.OPENING_QUESTIONS_TTL seconds, and the oldest is evicted
+when a new one arrives in a full pool. Pools are filled by the
+warm_opening_questions command and topped up in the background when they run
+low. An empty pool serves the static fallback text.
+
+A pool is one cache entry, so adding a variant reads, changes and rewrites
+it. So that concurrent writers (the refill threads, other workers, the
+warm-up command) do not lose each other's variants, a writer holds a
+process lock and a short lock in the cache made with cache.add. cache.add is
+atomic on the Redis, Memcached, database and local-memory backends; on the
+file-based backend it only narrows the window.
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .ai_service import AIService, fallback_questions
+from .models import AnalysisSession
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'opening_questions:{}'
+LOCK_KEY = 'opening_questions:{}:lock'
+# Seconds a pool lock is held at most, and waited for at most
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 5
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'fallbacks': 0, 'generated': 0, 'generation_errors': 0}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='question-pool')
+_pending_lock = threading.Lock()
+_pending = set()
+_pool_lock = threading.Lock()
+
+
+def analysis_types():
+    return [analysis_type for analysis_type, _ in AnalysisSession.ANALYSIS_TYPES]
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def get_pool_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def load_pool(analysis_type):
+    """Return the unexpired variants for an analysis type, oldest first"""
+    cutoff = time.time() - settings.OPENING_QUESTIONS_TTL
+    return [
+        variant for variant in cache.get(CACHE_KEY.format(analysis_type), [])
+        if variant['created_at'] > cutoff
+    ]
+
+
+def _lock_pool(analysis_type):
+    """Take the pool's lock. Returns the token to release it with, or None on timeout."""
+    key, token = LOCK_KEY.format(analysis_type), uuid.uuid4().hex
+    give_up = time.monotonic() + LOCK_WAIT
+    while not cache.add(key, token, timeout=LOCK_TIMEOUT):
+        if time.monotonic() >= give_up:
+            return None
+        time.sleep(0.05)
+    return token
+
+
+def _unlock_pool(analysis_type, token):
+    key = LOCK_KEY.format(analysis_type)
+    # Unless the lock timed out and another writer holds it now
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def add_variant(analysis_type, text):
+    """Add a variant to the pool. Returns False if the pool stayed locked too long."""
+    with _pool_lock:
+        token = _lock_pool(analysis_type)
+        if token is None:
+            logger.warning("Opening question pool for %s is locked; variant dropped", analysis_type)
+            return False
+        try:
+            pool = load_pool(analysis_type)
+            pool.append({'text': text, 'created_at': time.time()})
+            # Evict the oldest variants once the pool is full
+            pool = pool[-settings.OPENING_QUESTIONS_POOL_SIZE:]
+            cache.set(CACHE_KEY.format(analysis_type), pool, timeout=settings.OPENING_QUESTIONS_TTL)
+        finally:
+            _unlock_pool(analysis_type, token)
+    return True
+
+
+def get_opening_questions(analysis_type):
+    """Serve a random pooled variant, or the static fallback text if the pool is empty"""
+    if analysis_type not in analysis_types():
+        _count('fallbacks')
+        return fallback_questions(analysis_type)
+
+    pool = load_pool(analysis_type)
+    if len(pool) < settings.OPENING_QUESTIONS_POOL_SIZE:
+        schedule_refill(analysis_type)
+
+    if not pool:
+        _count('fallbacks')
+        return fallback_questions(analysis_type)
+
+    _count('hits')
+    return random.choice(pool)['text']
+
+
+def refill(analysis_type, variants=None):
+    """Generate variants until the pool holds ``variants`` (default: a full pool).
+
+    Returns the number of variants added. Stops at the first Gemini error, so a
+    failing API never puts the fallback text into the pool.
+    """
+    target = min(variants or settings.OPENING_QUESTIONS_POOL_SIZE, settings.OPENING_QUESTIONS_POOL_SIZE)
+    added = 0
+    ai_service = AIService()
+    for _ in range(target - len(load_pool(analysis_type))):
+        try:
+            text = ai_service.generate_analysis_questions(analysis_type)
+        except Exception as e:
+            _count('generation_errors')
+            logger.warning("Could not generate opening questions for %s: %s", analysis_type, e)
+            break
+        if add_variant(analysis_type, text):
+            added += 1
+    _count('generated', added)
+    return added
+
+
+def clear_pool(analysis_type):
+    cache.delete(CACHE_KEY.format(analysis_type))
+
+
+def schedule_refill(analysis_type):
+    with _pending_lock:
+        if analysis_type in _pending:
+            return
+        _pending.add(analysis_type)
+    _executor.submit(_run_refill, analysis_type)
+
+
+def _run_refill(analysis_type):
+    try:
+        # One variant per refill keeps the upstream load from a cold start low
+        refill(analysis_type, variants=len(load_pool(analysis_type)) + 1)
+    except Exception:
+        logger.exception("Opening question refill failed for %s", analysis_type)
+    finally:
+        with _pending_lock:
+            _pending.discard(analysis_type)
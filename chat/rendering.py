@@ -0,0 +1,118 @@
+"""
+Server-side Markdown rendering of AI replies.
+
+A reply is rendered once, when its message is saved, and the HTML is stored
+in ChatMessage.content_html, so loading a conversation does no Markdown work
+on the server or in the browser.
+
+The renderer covers the formatting the chat system prompt allows: bold,
+italic, inline code, bullet and numbered lists, paragraphs and line breaks.
+Headers and horizontal rules are dropped. The text is escaped before any
+markup is added, so the output is safe to insert as HTML whatever the model
+returns.
+
+MarkdownStream renders a streamed reply as it arrives. Blocks end at a blank
+line, and each finished block is rendered only once.
+"""
+import re
+
+from django.utils.html import escape
+
+HEADER_RE = re.compile(r'^#+\s+', re.MULTILINE)
+RULE_RE = re.compile(r'^\s*[-*_]{3,}\s*$', re.MULTILINE)
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+
+BULLET_RE = re.compile(r'^\s*[*+-]\s+(.*)$')
+NUMBERED_RE = re.compile(r'^\s*(\d+)[.)]\s+(.*)$')
+CODE_RE = re.compile(r'`([^`\n]+)`')
+BOLD_RE = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__')
+ITALIC_RE = re.compile(r'(?<![*\w])\*(?=\S)(.+?)(?<=\S)\*(?![*\w])|(?<![_\w])_(?=\S)(.+?)(?<=\S)_(?![_\w])')
+
+
+def clean_markdown(text):
+    """Remove only problematic markdown, keep useful formatting"""
+    text = HEADER_RE.sub('', text)
+    text = RULE_RE.sub('', text)
+    text = BLANK_LINES_RE.sub('\n\n', text)
+    return text.strip()
+
+
+def _emphasis(text):
+    text = BOLD_RE.sub(lambda m: f'<strong>{m.group(1) or m.group(2)}</strong>', text)
+    return ITALIC_RE.sub(lambda m: f'<em>{m.group(1) or m.group(2)}</em>', text)
+
+
+def render_inline(text):
+    """Escape a line and render its inline formatting"""
+    # Code spans are split out first so their contents are left alone
+    parts = CODE_RE.split(escape(text))
+    return ''.join(
+        f'<code>{part}</code>' if i % 2 else _emphasis(part)
+        for i, part in enumerate(parts)
+    )
+
+
+def render_block(block):
+    """Render one block of text (no blank lines) to HTML"""
+    html = []
+    paragraph = []
+    list_tag = None
+
+    def close_paragraph():
+        if paragraph:
+            html.append(f"<p>{'<br>'.join(paragraph)}</p>")
+            paragraph.clear()
+
+    def close_list():
+        nonlocal list_tag
+        if list_tag:
+            html.append(f'</{list_tag}>')
+            list_tag = None
+
+    for line in block.splitlines():
+        if not line.strip() or RULE_RE.match(line):
+            continue
+        line = HEADER_RE.sub('', line)
+        bullet = BULLET_RE.match(line)
+        numbered = None if bullet else NUMBERED_RE.match(line)
+        if bullet or numbered:
+            close_paragraph()
+            tag = 'ul' if bullet else 'ol'
+            if list_tag != tag:
+                close_list()
+                start = int(numbered.group(1)) if numbered else 1
+                html.append(f'<ol start="{start}">' if start != 1 else f'<{tag}>')
+                list_tag = tag
+            html.append(f'<li>{render_inline(bullet.group(1) if bullet else numbered.group(2))}</li>')
+        elif list_tag and line[:1].isspace():
+            # An indented line continues the list item above it
+            html[-1] = f'{html[-1][:-5]}<br>{render_inline(line.strip())}</li>'
+        else:
+            close_list()
+            paragraph.append(render_inline(line.strip()))
+    close_paragraph()
+    close_list()
+    return ''.join(html)
+
+
+def render_markdown(text):
+    """Render a reply to sanitised HTML"""
+    return ''.join(render_block(block) for block in BLANK_LINES_RE.split(text or '') if block.strip())
+
+
+class MarkdownStream:
+    """Incremental render_markdown for a reply that arrives in chunks"""
+
+    def __init__(self):
+        self._pending = ''
+
+    def feed(self, chunk):
+        """Add a chunk. Returns (html, tail): the HTML of the blocks this chunk
+        finished, and a rendering of the block still in progress, which the
+        next call replaces.
+        """
+        self._pending += chunk
+        blocks = BLANK_LINES_RE.split(self._pending)
+        self._pending = blocks.pop()
+        html = ''.join(render_block(block) for block in blocks if block.strip())
+        return html, render_block(self._pending)
@@ -0,0 +1,175 @@
+"""
+Background generation of comprehensive analysis reports.
+
+A report is one long gemini-2.5-pro call, far too slow to make inside a
+request. Views only queue a ReportJob row; `manage.py run_report_worker`
+claims due jobs from the database and writes the finished report onto the
+session. The job table is the queue, so no broker is needed.
+
+A failed attempt is retried with exponential backoff until
+settings.REPORT_JOB_MAX_ATTEMPTS is reached. A job whose worker died is
+claimed again once its lease (settings.REPORT_JOB_LEASE seconds) runs out.
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .ai_service import AIService
+from .archive import all_messages
+from .context import format_history
+from .models import ReportJob
+from .rendering import render_markdown
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = [ReportJob.PENDING, ReportJob.RUNNING]
+
+
+def submit_report(session):
+    """Queue a report for a session, or return the job already queued or running"""
+    job = session.report_jobs.filter(status__in=ACTIVE_STATUSES).first()
+    if job is not None:
+        return job
+    try:
+        with transaction.atomic():
+            return ReportJob.objects.create(session=session)
+    except IntegrityError:
+        # Another request queued one first (chat_reportjob_one_active)
+        return session.report_jobs.filter(status__in=ACTIVE_STATUSES).first() or submit_report(session)
+
+
+def _claimable(now):
+    lease_expired = now - timedelta(seconds=settings.REPORT_JOB_LEASE)
+    return Q(status=ReportJob.PENDING, run_after__lte=now) | Q(status=ReportJob.RUNNING, locked_at__lt=lease_expired)
+
+
+def claim_next_job(worker_id):
+    """Lock the next due job for ``worker_id`` and return it, or None if nothing is due.
+
+    Claiming is a conditional UPDATE, so it works the same on SQLite and
+    Postgres and two workers never get the same job.
+    """
+    now = timezone.now()
+    candidates = list(
+        ReportJob.objects.filter(_claimable(now)).order_by('run_after').values_list('pk', flat=True)[:10]
+    )
+    for pk in candidates:
+        claimed = ReportJob.objects.filter(_claimable(now), pk=pk).update(
+            status=ReportJob.RUNNING,
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return ReportJob.objects.select_related('session').get(pk=pk)
+    return None
+
+
+def session_transcript(session):
+    """The conversation as report input: the running summary plus the messages after it"""
+    if session.archived_at:
+        messages = [
+            (row['is_user'], row['content']) for row in all_messages(session.pk)
+        ][session.summary_message_count:]
+    else:
+        messages = list(
+            session.messages.order_by('timestamp', 'id')
+            .values_list('is_user', 'content')[session.summary_message_count:]
+        )
+    transcript = format_history(messages)
+    if session.summary:
+        transcript = f"Summary of the earlier conversation:\n{session.summary}\n\n{transcript}"
+    return transcript
+
+
+def run_job(job):
+    """Generate the report for a claimed job. Returns True if it succeeded."""
+    if job.attempts > settings.REPORT_JOB_MAX_ATTEMPTS:
+        # Claimed again after a worker died on it too many times
+        _finish(job, ReportJob.FAILED, last_error='Abandoned after repeated worker failures')
+        return False
+
+    session = job.session
+    # Each turn is a user message and a reply; counted now, as the session may go on after the report
+    turns = session.message_count // 2
+    try:
+        report = AIService().write_analysis_report(
+            session.analysis_type,
+            session_transcript(session),
+            deadline=settings.REPORT_DEADLINE,
+            attempt_timeout=settings.REPORT_ATTEMPT_TIMEOUT,
+        )
+    except Exception as e:
+        _fail(job, e)
+        return False
+
+    with transaction.atomic():
+        if not _finish(job, ReportJob.SUCCEEDED, turns=turns):
+            # The lease ran out and another worker owns the job now; its report counts
+            logger.warning("Report job %s was taken over by another worker; dropping this report", job.pk)
+            return False
+        session.report = report
+        session.report_generated_at = timezone.now()
+        session.is_completed = True
+        session.save(update_fields=['report', 'report_generated_at', 'is_completed', 'updated_at'])
+    logger.info("Report job %s for session %s succeeded", job.pk, session.pk)
+    return True
+
+
+def backoff_delay(attempts):
+    """Seconds before retry number ``attempts``: exponential, capped and jittered"""
+    delay = min(settings.REPORT_JOB_BACKOFF * 2 ** (attempts - 1), settings.REPORT_JOB_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _fail(job, error):
+    if job.attempts >= settings.REPORT_JOB_MAX_ATTEMPTS:
+        logger.error("Report job %s failed after %s attempts: %s", job.pk, job.attempts, error)
+        _finish(job, ReportJob.FAILED, last_error=str(error))
+        return
+
+    delay = backoff_delay(job.attempts)
+    logger.warning("Report job %s attempt %s failed, retrying in %.0fs: %s", job.pk, job.attempts, delay, error)
+    ReportJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status=ReportJob.PENDING,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        locked_by='',
+        locked_at=None,
+        last_error=str(error),
+    )
+
+
+def _finish(job, status, last_error='', turns=0):
+    """Close the job if this worker still owns it. Returns the rows updated: 0 if it lost the lease."""
+    # locked_by guards against a worker whose lease ran out overwriting the new owner
+    return ReportJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status=status,
+        finished_at=timezone.now(),
+        locked_by='',
+        locked_at=None,
+        last_error=last_error,
+        turns=turns,
+    )
+
+
+def job_payload(job):
+    """What the status endpoint reports about a job"""
+    payload = {
+        'job_id': job.pk,
+        'session_id': job.session_id,
+        'status': job.status,
+        'attempts': job.attempts,
+    }
+    if job.status == ReportJob.PENDING and job.attempts:
+        payload['retry_at'] = job.run_after.isoformat()
+    if job.status == ReportJob.SUCCEEDED:
+        payload['report'] = job.session.report
+        payload['report_html'] = render_markdown(job.session.report)
+    if job.status == ReportJob.FAILED:
+        payload['error'] = 'The report could not be generated. Please try again later.'
+    return payload
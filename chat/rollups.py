@@ -0,0 +1,244 @@
+"""
+Pre-aggregated usage counts for the admin and analytics.
+
+UsageRollup holds, per hour and per day, analysis type and session type:
+sessions started, messages, user messages, and sessions completed (report
+written) with their turns. Usage questions are answered from these rows;
+nothing outside this module groups the message or session tables.
+
+`manage.py rollup_usage` maintains them incrementally. For each source it
+reads only the rows past its RollupWatermark and adds them to the hourly
+rows, in chunks. Each chunk's additions and its new watermark commit
+together, so a run can stop anywhere and the next one carries on without
+counting anything twice. Then the daily rows of the days it touched are
+recomputed from the hourly rows.
+
+- Messages and sessions are read in id order, up to the rows older than
+  settings.USAGE_ROLLUP_LAG seconds. Ids are handed out before commit, so
+  the lag keeps a turn still committing from being skipped. Messages
+  restored from the archive keep their old ids and are not counted again.
+- Completions are read in finished_at order from the report jobs, with the
+  turns each job recorded when it wrote the report.
+- Guest sessions are not in the database (chat.guest_store). Each process
+  counts them in memory (record_guest) and adds them to the hourly rows at
+  most every settings.USAGE_GUEST_FLUSH_INTERVAL seconds.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import AnalysisSession, ChatMessage, ReportJob, RollupWatermark, UsageRollup
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('sessions_started', 'messages', 'user_messages', 'sessions_completed', 'completion_turns')
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(moment):
+    return timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_hourly(buckets):
+    """Add {(hour, analysis_type, session_type): {counter: amount}} to the hourly rows"""
+    for (hour, analysis_type, session_type), amounts in buckets.items():
+        key = dict(granularity=UsageRollup.HOUR, period_start=hour, analysis_type=analysis_type, session_type=session_type)
+        increments = {name: F(name) + amount for name, amount in amounts.items() if amount}
+        if not increments or UsageRollup.objects.filter(**key).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                UsageRollup.objects.create(**key, **amounts)
+        except IntegrityError:
+            # Created by a concurrent flush
+            UsageRollup.objects.filter(**key).update(**increments)
+
+
+def _watermark(source):
+    watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(source=source)
+    return watermark
+
+
+def _roll_up_by_id(source, model, time_field, counted, rows, cutoff, chunk_size):
+    """Add the rows of ``model`` past the source's watermark, one chunk per transaction.
+
+    ``rows(queryset)`` turns a queryset of new rows into
+    [(hour, analysis_type, session_type, {counter: amount})], where the
+    ``counted`` counter counts the rows themselves. Returns (rows read, hours
+    touched).
+    """
+    read, hours = 0, set()
+    while True:
+        with transaction.atomic():
+            watermark = _watermark(source)
+            start, end = watermark.last_id, watermark.last_id + chunk_size
+            chunk = model.objects.filter(pk__gt=start, pk__lte=end)
+            # Stop before the first row recent enough for an earlier id to be uncommitted
+            too_new = chunk.filter(**{f'{time_field}__gt': cutoff}).aggregate(first=Min('pk'))['first']
+            if too_new is not None:
+                end = too_new - 1
+                chunk = chunk.filter(pk__lte=end)
+            last = chunk.order_by('-pk').values_list('pk', flat=True).first()
+            if last is None:
+                # Nothing more, or a gap in the ids: move past it unless newer rows wait behind it
+                if too_new is None and model.objects.filter(pk__gt=end).exists():
+                    watermark.last_id = end
+                    watermark.save()
+                    continue
+                return read, hours
+            buckets = {}
+            for hour, analysis_type, session_type, amounts in rows(chunk):
+                buckets.setdefault((hour, analysis_type, session_type), Counter()).update(amounts)
+                read += amounts[counted]
+            add_hourly(buckets)
+            hours.update(hour for hour, _, _ in buckets)
+            watermark.last_id = last if too_new is None else end
+            watermark.save()
+
+
+def _session_type(user_id):
+    return UsageRollup.AUTHENTICATED if user_id is not None else UsageRollup.GUEST
+
+
+def _message_rows(chunk):
+    rows = (
+        chunk.order_by()
+        .values(hour=TruncHour('timestamp'), analysis_type=F('session__analysis_type'), user_id=F('session__user_id'))
+        .annotate(messages=Count('pk'), user_messages=Count('pk', filter=Q(is_user=True)))
+    )
+    for row in rows:
+        yield row['hour'], row['analysis_type'], _session_type(row['user_id']), {
+            'messages': row['messages'], 'user_messages': row['user_messages'],
+        }
+
+
+def _session_rows(chunk):
+    rows = (
+        chunk.order_by()
+        .values('analysis_type', 'user_id', hour=TruncHour('created_at'))
+        .annotate(sessions_started=Count('pk'))
+    )
+    for row in rows:
+        yield row['hour'], row['analysis_type'], _session_type(row['user_id']), {
+            'sessions_started': row['sessions_started'],
+        }
+
+
+def _roll_up_completions(cutoff):
+    """Add the reports finished since the watermark. Returns (reports read, hours touched)."""
+    with transaction.atomic():
+        watermark = _watermark('completions')
+        jobs = ReportJob.objects.filter(status=ReportJob.SUCCEEDED, finished_at__lte=cutoff)
+        if watermark.last_time is not None:
+            jobs = jobs.filter(finished_at__gt=watermark.last_time)
+        rows = list(
+            jobs.order_by()
+            .values(
+                hour=TruncHour('finished_at'),
+                analysis_type=F('session__analysis_type'),
+                user_id=F('session__user_id'),
+            )
+            .annotate(
+                sessions_completed=Count('pk'),
+                completion_turns=Sum('turns'),
+            )
+        )
+        buckets = {
+            (row['hour'], row['analysis_type'], _session_type(row['user_id'])): Counter({
+                'sessions_completed': row['sessions_completed'],
+                'completion_turns': row['completion_turns'] or 0,
+            })
+            for row in rows
+        }
+        add_hourly(buckets)
+        watermark.last_time = cutoff
+        watermark.save()
+    return sum(row['sessions_completed'] for row in rows), {hour for hour, _, _ in buckets}
+
+
+def rebuild_days(days):
+    """Recompute the daily rows of ``days`` (local midnights) from the hourly rows"""
+    for day in sorted(days):
+        with transaction.atomic():
+            totals = (
+                UsageRollup.objects.filter(
+                    granularity=UsageRollup.HOUR, period_start__gte=day, period_start__lt=day + timedelta(days=1),
+                )
+                .values('analysis_type', 'session_type')
+                .annotate(**{name: Sum(name) for name in COUNTERS})
+            )
+            UsageRollup.objects.filter(granularity=UsageRollup.DAY, period_start=day).delete()
+            UsageRollup.objects.bulk_create(
+                UsageRollup(granularity=UsageRollup.DAY, period_start=day, **row) for row in totals
+            )
+
+
+def roll_up(chunk_size=10000, lag=None):
+    """Bring the rollups up to date. Returns {source: rows read}."""
+    cutoff = timezone.now() - timedelta(seconds=settings.USAGE_ROLLUP_LAG if lag is None else lag)
+    flush_guests()
+    read = {}
+    hours = set()
+    read['sessions'], touched = _roll_up_by_id(
+        'sessions', AnalysisSession, 'created_at', 'sessions_started', _session_rows, cutoff, chunk_size,
+    )
+    hours |= touched
+    read['messages'], touched = _roll_up_by_id(
+        'messages', ChatMessage, 'timestamp', 'messages', _message_rows, cutoff, chunk_size,
+    )
+    hours |= touched
+    read['completions'], touched = _roll_up_completions(cutoff)
+    hours |= touched
+    # Plus the days guest flushes may have added to since the last run
+    now = timezone.now()
+    rebuild_days({day_start(hour) for hour in hours} | {day_start(now), day_start(now - timedelta(days=1))})
+    return read
+
+
+# Guest activity, counted per process between flushes
+_guest_lock = threading.Lock()
+_guest_counts = {}
+_guest_flushed_at = time.monotonic()
+
+
+def record_guest(analysis_type, **amounts):
+    """Count guest activity (sessions_started, messages, user_messages) in the current hour"""
+    global _guest_flushed_at
+    key = (hour_start(timezone.now()), analysis_type, UsageRollup.GUEST)
+    with _guest_lock:
+        _guest_counts.setdefault(key, Counter()).update(amounts)
+        due = time.monotonic() - _guest_flushed_at >= settings.USAGE_GUEST_FLUSH_INTERVAL
+    if due:
+        flush_guests()
+
+
+def flush_guests():
+    global _guest_counts, _guest_flushed_at
+    with _guest_lock:
+        counts, _guest_counts = _guest_counts, {}
+        _guest_flushed_at = time.monotonic()
+    if not counts:
+        return
+    try:
+        with transaction.atomic():
+            add_hourly(counts)
+    except Exception:
+        logger.exception("Could not flush guest usage counts")
+        with _guest_lock:
+            for key, amounts in counts.items():
+                _guest_counts.setdefault(key, Counter()).update(amounts)
+
+
+atexit.register(flush_guests)
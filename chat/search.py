@@ -0,0 +1,267 @@
+"""
+Full-text search over chat messages.
+
+The index lives in the database and is maintained by the database itself,
+so every write path (bulk_create in the chat turn, the archive restore, the
+admin) keeps it current without signals:
+
+- SQLite: an FTS5 table, chat_message_fts, with chat_chatmessage as its
+  external content, kept in sync by insert/update/delete triggers. Matches
+  are ranked with bm25 and excerpted with snippet(); the owner is looked up
+  in chat_analysissession at query time. Nothing in the index refers to any
+  other table, so Django can still remake chat_analysissession (or any
+  table but chat_chatmessage) in a migration.
+- PostgreSQL: a generated tsvector column, chat_chatmessage.search_vector,
+  with a GIN index. Matches are ranked with ts_rank_cd and excerpted with
+  ts_headline.
+
+Migration 0010 creates them, and 0012 moves SQLite databases off the first
+version of the index, which read each message's owner through a view.
+`manage.py rebuild_search_index` recreates them and reindexes every
+message, e.g. after a migration remade chat_chatmessage on SQLite (which
+drops its triggers).
+
+Messages moved to the archive (chat.archive) leave the index, as their rows
+are deleted, and come back when they are restored. search_messages() still
+finds them: once the index has no more matches, it goes on to the user's
+archived messages, decompressing each archive and matching the query words
+as word prefixes ("headache" finds "headaches", but there is no stemming).
+A user's archives are only read on the pages past the index's last match.
+
+Queries are reduced to their words, all of which must match, so user input
+can never be a syntax error.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from .archive import unpack
+from .models import ChatMessage, MessageArchive
+
+WORD_RE = re.compile(r'\w+')
+# Private-use characters mark the matched words in excerpts until they are escaped
+MARK_START, MARK_END = '\ue000', '\ue001'
+SNIPPET_WORDS = 16
+# Longer queries are cut to their first words
+MAX_QUERY_WORDS = 12
+
+# The triggers only use the new and old rows: SQLite refuses to rename a
+# table that a trigger or view elsewhere refers to, which breaks the table
+# remakes of Django's SQLite migrations
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5(content, "
+    "content='chat_chatmessage', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF content ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+SQLITE_REBUILD = "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')"
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+POSTGRES_SCHEMA = [
+    "ALTER TABLE chat_chatmessage ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', content)) STORED",
+    "CREATE INDEX IF NOT EXISTS chat_message_search ON chat_chatmessage USING GIN (search_vector)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS chat_message_search",
+    "ALTER TABLE chat_chatmessage DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def create_index(db, rebuild=True):
+    """Create the index on the database connection ``db`` and fill it from the messages"""
+    with db.cursor() as cursor:
+        if db.vendor == 'sqlite':
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement)
+            if rebuild:
+                cursor.execute(SQLITE_REBUILD)
+        elif db.vendor == 'postgresql':
+            # The generated column is computed for every existing row when it is added
+            for statement in POSTGRES_SCHEMA:
+                cursor.execute(statement)
+
+
+def drop_index(db):
+    with db.cursor() as cursor:
+        for statement in {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}.get(db.vendor, []):
+            cursor.execute(statement)
+
+
+def is_supported():
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def query_words(query):
+    return WORD_RE.findall(query or '')[:MAX_QUERY_WORDS]
+
+
+def _sqlite_match(words):
+    # Each word quoted, so FTS5 operators in user input are plain words
+    return ' AND '.join('"%s"' % word for word in words)
+
+
+def matches(query):
+    """A filter() expression selecting the ChatMessage rows matching ``query``"""
+    words = query_words(query)
+    if not words:
+        return RawSQL('1 = 0', [], output_field=BooleanField())
+    if connection.vendor == 'sqlite':
+        return RawSQL(
+            '"chat_chatmessage"."id" IN (SELECT rowid FROM chat_message_fts WHERE chat_message_fts MATCH %s)',
+            [_sqlite_match(words)],
+            output_field=BooleanField(),
+        )
+    if connection.vendor == 'postgresql':
+        return RawSQL(
+            '"chat_chatmessage"."search_vector" @@ plainto_tsquery(\'english\', %s)',
+            [' '.join(words)],
+            output_field=BooleanField(),
+        )
+    # Other databases fall back to a scan
+    return RawSQL('"chat_chatmessage"."content" LIKE %s', [f"%{' '.join(words)}%"], output_field=BooleanField())
+
+
+def _ranked_page(user_id, words, limit, offset):
+    """[(message id, raw excerpt)] of the best matches among the user's messages"""
+    if connection.vendor == 'sqlite':
+        # A join, not "rowid IN (the user's messages)": FTS5 would run the
+        # match once per rowid in the list
+        sql = (
+            "SELECT f.rowid, snippet(chat_message_fts, 0, %s, %s, '…', %s) "
+            "FROM chat_message_fts f "
+            "JOIN chat_chatmessage m ON m.id = f.rowid "
+            "JOIN chat_analysissession s ON s.id = m.session_id "
+            "WHERE chat_message_fts MATCH %s AND s.user_id = %s "
+            "ORDER BY f.rank, f.rowid DESC LIMIT %s OFFSET %s"
+        )
+        params = [MARK_START, MARK_END, SNIPPET_WORDS, _sqlite_match(words), user_id, limit, offset]
+    else:
+        # ts_headline re-parses the message, so only the rows of the page get one
+        sql = (
+            "SELECT page.id, ts_headline('english', page.content, query, %s) "
+            "FROM ("
+            "  SELECT m.id, m.content, ts_rank_cd(m.search_vector, query) AS rank "
+            "  FROM chat_chatmessage m, plainto_tsquery('english', %s) query "
+            "  WHERE m.search_vector @@ query "
+            "  AND m.session_id IN (SELECT id FROM chat_analysissession WHERE user_id = %s) "
+            "  ORDER BY rank DESC, m.id DESC LIMIT %s OFFSET %s"
+            ") page, plainto_tsquery('english', %s) query "
+            "ORDER BY page.rank DESC, page.id DESC"
+        )
+        options = f'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords=6'
+        text = ' '.join(words)
+        params = [options, text, user_id, limit, offset, text]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def excerpt_html(excerpt):
+    """An excerpt with its matches in <mark>, everything else escaped"""
+    return escape(excerpt).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def _word_patterns(words):
+    return [re.compile(r'\b' + re.escape(word), re.IGNORECASE) for word in words]
+
+
+def _archive_excerpt(content, patterns):
+    """snippet() for an archived message: SNIPPET_WORDS words around the first match, matches marked"""
+    tokens = content.split()
+    first = next((i for i, token in enumerate(tokens) if any(p.search(token) for p in patterns)), 0)
+    start = max(0, min(first - SNIPPET_WORDS // 4, len(tokens) - SNIPPET_WORDS))
+    excerpt = ' '.join(tokens[start:start + SNIPPET_WORDS])
+    marked = re.compile('|'.join(rf'(?:{p.pattern}\w*)' for p in patterns), re.IGNORECASE)
+    excerpt = marked.sub(lambda m: f'{MARK_START}{m.group(0)}{MARK_END}', excerpt)
+    return ('…' if start else '') + excerpt + ('…' if start + SNIPPET_WORDS < len(tokens) else '')
+
+
+def archived_matches(user_id, words):
+    """Search results for the user's archived messages containing every word, newest first"""
+    patterns = _word_patterns(words)
+    archives = (
+        MessageArchive.objects.filter(session__user_id=user_id)
+        .order_by('-session__updated_at', '-session_id')
+        .values_list('session_id', 'session__title', 'session__analysis_type', 'data')
+    )
+    results = []
+    for session_id, title, analysis_type, data in archives.iterator(chunk_size=20):
+        for message in reversed(unpack(data)):
+            if all(pattern.search(message['content']) for pattern in patterns):
+                results.append({
+                    'message_id': message['id'],
+                    'session_id': session_id,
+                    'session_title': title,
+                    'analysis_type': analysis_type,
+                    'is_user': message['is_user'],
+                    'timestamp': message['timestamp'].isoformat(),
+                    'snippet': excerpt_html(_archive_excerpt(message['content'], patterns)),
+                    'archived': True,
+                })
+    return results
+
+
+def search_messages(user, query, limit, offset=0):
+    """One page of the user's messages matching ``query``, best first.
+
+    Returns (results, has_more). Each result describes the message and its
+    session and carries an HTML ``snippet``. Archived messages come after
+    everything in the index, marked ``archived``.
+    """
+    words = query_words(query)
+    if not words:
+        return [], False
+    if not is_supported():
+        raise NotImplementedError(f"Full-text search is not available on {connection.vendor}")
+
+    rows = _ranked_page(user.pk, words, limit + 1, offset)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    details = {
+        message['id']: message
+        for message in ChatMessage.objects.filter(pk__in=[message_id for message_id, _ in rows]).values(
+            'id', 'session_id', 'session__title', 'session__analysis_type', 'is_user', 'timestamp',
+        )
+    }
+    results = []
+    for message_id, excerpt in rows:
+        message = details.get(message_id)
+        if message is None:
+            # Deleted since the search
+            continue
+        results.append({
+            'message_id': message_id,
+            'session_id': message['session_id'],
+            'session_title': message['session__title'],
+            'analysis_type': message['session__analysis_type'],
+            'is_user': message['is_user'],
+            'timestamp': message['timestamp'].isoformat(),
+            'snippet': excerpt_html(excerpt),
+            'archived': False,
+        })
+    if has_more:
+        return results, True
+
+    # The index has no more matches: go on into the archive
+    if rows:
+        indexed = offset + len(rows)
+    else:
+        indexed = ChatMessage.objects.filter(matches(query), session__user_id=user.pk).count() if offset else 0
+    start = max(offset - indexed, 0)
+    wanted = limit - len(rows)
+    archived = archived_matches(user.pk, words)
+    return results + archived[start:start + wanted], len(archived) > start + wanted
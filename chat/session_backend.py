@@ -0,0 +1,35 @@
+"""
+Database sessions that are rewritten only when their expiry needs refreshing.
+
+With SESSION_SAVE_EVERY_REQUEST every request that reads the session also
+rewrites its row, just to push the expiry date forward. This store loads a
+session like Django's database backend, and marks it modified only when less
+than settings.SESSION_REFRESH_THRESHOLD seconds of its lifetime are left. The
+session middleware then saves it and sends the cookie with a fresh max-age.
+
+With the defaults (two week sessions, refreshed below thirteen days) an
+active user's session is written at most about once a day, and it still
+never expires while in use. Sessions changed by a view are saved as usual.
+
+Use it with SESSION_ENGINE = 'chat.session_backend' and
+SESSION_SAVE_EVERY_REQUEST = False.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends import db
+from django.utils import timezone
+
+
+class SessionStore(db.SessionStore):
+    def _refresh_if_due(self, session):
+        if session is None:
+            return {}
+        remaining = (session.expire_date - timezone.now()).total_seconds()
+        if remaining < settings.SESSION_REFRESH_THRESHOLD:
+            self.modified = True
+        return self.decode(session.session_data)
+
+    def load(self):
+        return self._refresh_if_due(self._get_session_from_db())
+
+    async def aload(self):
+        return self._refresh_if_due(await self._aget_session_from_db())
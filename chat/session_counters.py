@@ -0,0 +1,94 @@
+"""
+Per-session message counters.
+
+AnalysisSession.message_count, last_message_at and last_message_preview
+describe a session's messages, so the dashboard, the sessions API and the
+admin can list sessions from the session table alone.
+
+The write path keeps them up to date: each save of new messages is followed
+by one UPDATE with an F() increment, in the same transaction, so concurrent
+turns on a session never lose a count. Each update also invalidates the
+user's cached dashboard fragments (chat.fragment_cache). Messages changed any other way (the
+admin, a shell) can leave them stale; `manage.py repair_session_counters`
+recomputes them from the messages, archived ones included.
+"""
+import re
+
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from .archive import unpack
+from .fragment_cache import invalidate_user_fragments
+from .models import AnalysisSession, ChatMessage, MessageArchive
+
+PREVIEW_CHARS = 120
+MARKUP_RE = re.compile(r'[*_`#]+')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def message_preview(content):
+    """One line of plain text for a session list"""
+    text = WHITESPACE_RE.sub(' ', MARKUP_RE.sub('', content or '')).strip()
+    return Truncator(text).chars(PREVIEW_CHARS)
+
+
+def record_messages(session, messages):
+    """Count saved ``messages`` (in order) on their session; also bumps updated_at"""
+    last = messages[-1]
+    updated = AnalysisSession.objects.filter(pk=session.pk).update(
+        message_count=F('message_count') + len(messages),
+        last_message_at=last.timestamp,
+        last_message_preview=message_preview(last.content),
+        updated_at=timezone.now(),
+    )
+    invalidate_user_fragments(session.user_id)
+    return updated
+
+
+def counters_for(session_ids):
+    """{session id: (message_count, last_message_at, last_message_preview)} from the messages"""
+    counters = {session_id: (0, None, '') for session_id in session_ids}
+    rows = (
+        ChatMessage.objects.filter(session_id__in=session_ids)
+        .order_by()
+        .values('session_id')
+        .annotate(count=Count('pk'), last_id=Max('pk'))
+    )
+    last_ids = {}
+    for row in rows:
+        last_ids[row['last_id']] = row['session_id']
+        counters[row['session_id']] = (row['count'], None, '')
+    # Messages are saved in order, so a session's highest id is its last message
+    for message in ChatMessage.objects.filter(pk__in=last_ids).only('id', 'timestamp', 'content'):
+        count = counters[last_ids[message.pk]][0]
+        counters[last_ids[message.pk]] = (count, message.timestamp, message_preview(message.content))
+    # Plus the messages of archived sessions (chat.archive)
+    for archive in MessageArchive.objects.filter(pk__in=session_ids):
+        count, last_at, preview = counters[archive.pk]
+        last = unpack(archive.data)[-1]
+        if last_at is None or last['timestamp'] > last_at:
+            last_at, preview = last['timestamp'], message_preview(last['content'])
+        counters[archive.pk] = (count + archive.message_count, last_at, preview)
+    return counters
+
+
+def repair(session_ids):
+    """Recompute the counters of the given sessions; returns how many were wrong"""
+    with transaction.atomic():
+        sessions = list(
+            AnalysisSession.objects.select_for_update()
+            .filter(pk__in=session_ids)
+            .only('id', 'user', 'message_count', 'last_message_at', 'last_message_preview')
+        )
+        counters = counters_for([session.pk for session in sessions])
+        stale = []
+        for session in sessions:
+            current = (session.message_count, session.last_message_at, session.last_message_preview)
+            if current != counters[session.pk]:
+                session.message_count, session.last_message_at, session.last_message_preview = counters[session.pk]
+                stale.append(session)
+        AnalysisSession.objects.bulk_update(stale, ['message_count', 'last_message_at', 'last_message_preview'])
+        invalidate_user_fragments(*(session.user_id for session in stale))
+    return len(stale)
@@ -0,0 +1,257 @@
+"""
+Single-flight coalescing of identical Gemini calls.
+
+Double-clicks and client retries send the same prompt again while the first
+call is still running. Calls are keyed by the prompt hash
+(chat.llm_cache.prompt_key); while a call for a key is in flight, further
+callers wait for it and share its result instead of calling Gemini again.
+
+- Within a process, threads and async callers wait on the same future.
+- Across the workers on a host, the first caller takes a lease in a local
+  SQLite file (settings.SINGLE_FLIGHT_SQLITE_PATH). Callers in other workers
+  poll the LLM response cache for the leader's reply and only call Gemini
+  themselves if the lease is released without one (fallback model, cache
+  disabled) or runs out after settings.SINGLE_FLIGHT_LEASE seconds. This
+  needs a response cache shared between workers, such as the default
+  SQLiteResponseCache.
+
+A failed call fails every caller waiting on it, so a double-click gets the
+same fallback reply twice rather than two Gemini errors. A leader that is
+cancelled or interrupted (its client went away) fails its followers with
+FlightAbandoned instead of passing its cancellation on to other requests,
+and a follower that gives up waiting leaves the shared call alone.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from functools import lru_cache
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {'leaders': 0, 'coalesced': 0, 'coalesced_shared': 0, 'shared_misses': 0, 'lease_errors': 0}
+
+_inflight_lock = threading.Lock()
+_inflight = {}
+
+
+class FlightAbandoned(Exception):
+    """The leader stopped before finishing, e.g. its own request was cancelled"""
+
+
+class SQLiteLeaseStore:
+    """Short leases on in-flight keys, shared by every process on the host"""
+
+    def __init__(self, path=None):
+        self.path = str(path or settings.SINGLE_FLIGHT_SQLITE_PATH)
+        self.owner = uuid.uuid4().hex
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flight_lease ("
+                " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key, ttl):
+        """Take the lease on a key. Returns False if another process holds it."""
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("DELETE FROM flight_lease WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO flight_lease (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self.owner, now + ttl),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM flight_lease WHERE key = ? AND owner = ?", (key, self.owner))
+
+    def held(self, key):
+        row = self._connection().execute(
+            "SELECT 1 FROM flight_lease WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+
+@lru_cache(maxsize=None)
+def get_lease_store():
+    return SQLiteLeaseStore()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def begin(key):
+    """Join the in-flight call for a key. Returns (future, is_leader).
+
+    The leader makes the call and must hand its outcome to finish(); everyone
+    else waits on the future.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    _count('leaders' if leader else 'coalesced')
+    return future, leader
+
+
+def finish(key, future, result=None, error=None):
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _acquire_lease(key):
+    if not settings.SINGLE_FLIGHT_SHARED:
+        return None
+    try:
+        return get_lease_store().acquire(key, settings.SINGLE_FLIGHT_LEASE)
+    except Exception as e:
+        # Without the lease store, each worker just makes its own call
+        _count('lease_errors')
+        logger.warning("Single-flight lease store failed: %s", e)
+        return None
+
+
+def _release_lease(key):
+    try:
+        get_lease_store().release(key)
+    except Exception as e:
+        _count('lease_errors')
+        logger.warning("Single-flight lease release failed: %s", e)
+
+
+def _shared_result_ready(key, shared_result):
+    """Return (done, result) for another worker's call on a key"""
+    result = shared_result()
+    if result is not None:
+        return True, result
+    try:
+        return not get_lease_store().held(key), None
+    except Exception:
+        return True, None
+
+
+def _lead(key, call, shared_result):
+    acquired = _acquire_lease(key) if shared_result else None
+    if acquired is False:
+        give_up = time.monotonic() + settings.SINGLE_FLIGHT_LEASE
+        while time.monotonic() < give_up:
+            time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+            done, result = _shared_result_ready(key, shared_result)
+            if result is not None:
+                _count('coalesced_shared')
+                return result
+            if done:
+                break
+        _count('shared_misses')
+        return call()
+    try:
+        return call()
+    finally:
+        if acquired:
+            _release_lease(key)
+
+
+async def _alead(key, acall, shared_result):
+    acquired = await asyncio.to_thread(_acquire_lease, key) if shared_result else None
+    if acquired is False:
+        give_up = time.monotonic() + settings.SINGLE_FLIGHT_LEASE
+        while time.monotonic() < give_up:
+            await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+            done, result = await asyncio.to_thread(_shared_result_ready, key, shared_result)
+            if result is not None:
+                _count('coalesced_shared')
+                return result
+            if done:
+                break
+        _count('shared_misses')
+        return await acall()
+    try:
+        return await acall()
+    finally:
+        if acquired:
+            await asyncio.to_thread(_release_lease, key)
+
+
+def run(key, call, shared_result=None):
+    """Return call(), sharing one call between concurrent callers with the same key.
+
+    ``shared_result`` returns another worker's result for the key, or None;
+    without it the call is only coalesced within this process. A None key
+    calls straight through.
+    """
+    if key is None:
+        return call()
+    future, leader = begin(key)
+    if not leader:
+        return future.result(timeout=settings.SINGLE_FLIGHT_LEASE)
+    try:
+        result = _lead(key, call, shared_result)
+    except Exception as e:
+        finish(key, future, error=e)
+        raise
+    except BaseException:
+        finish(key, future, error=FlightAbandoned(key))
+        raise
+    finish(key, future, result=result)
+    return result
+
+
+async def arun(key, acall, shared_result=None):
+    """Async run(); async and thread callers in a process share the same call"""
+    if key is None:
+        return await acall()
+    future, leader = begin(key)
+    if not leader:
+        # Shielded: a follower timing out or being cancelled would otherwise
+        # cancel the future everyone else is waiting on
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), settings.SINGLE_FLIGHT_LEASE)
+    try:
+        result = await _alead(key, acall, shared_result)
+    except Exception as e:
+        finish(key, future, error=e)
+        raise
+    except BaseException:
+        # Cancelled: the followers are other requests and get a plain error
+        finish(key, future, error=FlightAbandoned(key))
+        raise
+    finish(key, future, result=result)
+    return result
+
+
+def get_single_flight_stats():
+    """Calls made (leaders) and calls that waited on another one instead"""
+    with _stats_lock:
+        stats = dict(_stats)
+    with _inflight_lock:
+        stats['in_flight'] = len(_inflight)
+    return stats
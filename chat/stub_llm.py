@@ -0,0 +1,100 @@
+"""
+Offline stand-in for Gemini, for load tests and local development.
+
+With settings.GEMINI_STUB=True, get_gemini_model() and
+get_async_gemini_model() return a StubModel instead of a client, so every
+Gemini call in the app (chat replies, opening questions, summaries, reports)
+runs without the network or an API key.
+
+- Latency is log-normal with median GEMINI_STUB_LATENCY seconds and spread
+  GEMINI_STUB_LATENCY_SIGMA.
+- A streamed reply arrives in GEMINI_STUB_STREAM_CHUNKS chunks spread over
+  that latency.
+- GEMINI_STUB_ERROR_RATE of the calls fail with ServiceUnavailable, so the
+  circuit breakers and the fallback chain behave as they would in
+  production.
+- A call slower than its request timeout fails with DeadlineExceeded once
+  the timeout has passed, like the real client.
+
+Replies are about GEMINI_STUB_REPLY_CHARS characters of Markdown.
+"""
+import asyncio
+import math
+import random
+import time
+
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+REPLY_PARTS = [
+    "Thank you for sharing that.",
+    "To understand your situation better, could you tell me a bit more?",
+    "* How many **hours** does this usually last?",
+    "* Has anything changed in your *daily routine* recently?",
+    "* Do you notice it more at a particular time of day?",
+    "Small, consistent changes tend to help more than big ones.",
+    "Please remember this is informational only and does not replace advice from a healthcare professional.",
+]
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def _plan(self, request_options):
+        """(seconds to wait, error to raise after waiting or None)"""
+        latency = random.lognormvariate(math.log(settings.GEMINI_STUB_LATENCY), settings.GEMINI_STUB_LATENCY_SIGMA)
+        timeout = (request_options or {}).get('timeout')
+        if timeout is not None and latency > timeout:
+            return timeout, google_exceptions.DeadlineExceeded(f"Stub {self.model_name} took {latency:.1f}s")
+        if random.random() < settings.GEMINI_STUB_ERROR_RATE:
+            return latency, google_exceptions.ServiceUnavailable(f"Stub {self.model_name} failure")
+        return latency, None
+
+    def reply(self, prompt):
+        parts = []
+        while sum(len(part) + 2 for part in parts) < settings.GEMINI_STUB_REPLY_CHARS:
+            parts.append(random.choice(REPLY_PARTS))
+        return "\n\n".join(parts)
+
+    def _chunks(self, text):
+        count = max(settings.GEMINI_STUB_STREAM_CHUNKS, 1)
+        size = math.ceil(len(text) / count)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        latency, error = self._plan(request_options)
+        if stream:
+            return self._stream(prompt, latency, error)
+        time.sleep(latency)
+        if error:
+            raise error
+        return StubResponse(self.reply(prompt))
+
+    def _stream(self, prompt, latency, error):
+        if error:
+            time.sleep(latency)
+            raise error
+        chunks = self._chunks(self.reply(prompt))
+        for chunk in chunks:
+            time.sleep(latency / len(chunks))
+            yield StubResponse(chunk)
+
+    async def generate_content_async(self, prompt, request_options=None, **kwargs):
+        latency, error = self._plan(request_options)
+        await asyncio.sleep(latency)
+        if error:
+            raise error
+        return StubResponse(self.reply(prompt))
+
+
+_stub_models = {}
+
+
+def get_stub_model(model_name):
+    return _stub_models.setdefault(model_name, StubModel(model_name))
@@ -1,3 +1,1375 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from datetime import timedelta
+
+from asgiref.testing import ApplicationCommunicator
+from google.api_core.exceptions import InvalidArgument, ServiceUnavailable
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import ai_service, archive, circuit_breaker, context, llm_cache, metrics, question_pool, report_jobs, rollups, single_flight, views
+from .guest_store import CacheGuestSessionStore, InMemoryGuestSessionStore, SQLiteGuestSessionStore
+from .models import AnalysisSession, ChatMessage, MessageArchive, ReportJob, UsageRollup
+from .rendering import MarkdownStream, render_markdown
+from .websocket import websocket_application
+
+
+class ChatTurnWriteTests(TestCase):
+    """The write path of a chat turn: few queries, and all or nothing"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.session = AnalysisSession.objects.create(user=self.user, analysis_type='general', title='General Chat')
+        ChatMessage.objects.create(session=self.session, content='Hello', is_user=True)
+        ChatMessage.objects.create(session=self.session, content='Hi, how can I help?', is_user=False)
+        call_command('repair_session_counters', verbosity=0)
+
+    def request(self):
+        request = RequestFactory().post('/api/send_message/')
+        request.user = self.user
+        return request
+
+    def test_begin_turn_only_reads(self):
+        # The session, then its messages
+        with self.assertNumQueries(2):
+            turn = views._begin_turn(self.request(), self.session.id, 'I have a headache')
+        self.assertEqual(ChatMessage.objects.filter(session=self.session).count(), 2)
+        self.assertEqual(turn['unsummarized_count'], 4)
+
+    def test_finish_turn_writes_in_one_transaction(self):
+        turn = views._begin_turn(self.request(), self.session.id, 'I have a headache')
+        updated_at = AnalysisSession.objects.get(id=self.session.id).updated_at
+        # SAVEPOINT, bulk insert, updated_at, RELEASE SAVEPOINT
+        with self.assertNumQueries(4):
+            views._finish_turn(turn, 'How long has it lasted?', '<p>How long has it lasted?</p>')
+
+        messages = list(ChatMessage.objects.filter(session=self.session).values_list('is_user', 'content'))
+        self.assertEqual(messages[2:], [(True, 'I have a headache'), (False, 'How long has it lasted?')])
+        self.assertGreater(AnalysisSession.objects.get(id=self.session.id).updated_at, updated_at)
+
+    def test_first_turn_creates_the_session_with_its_messages(self):
+        turn = views._begin_turn(self.request(), None, 'I have a headache')
+        self.assertIsNone(turn['session_id'])
+        views._finish_turn(turn, 'How long has it lasted?', '<p>How long has it lasted?</p>')
+
+        session = AnalysisSession.objects.get(id=turn['session_id'])
+        self.assertEqual(session.messages.count(), 2)
+
+    def test_failed_reply_saves_nothing(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(views.AIService, 'generate_response', side_effect=RuntimeError('Gemini down')), \
+                self.assertLogs('chat.views', 'ERROR'):
+            response = self.client.post(
+                '/api/send_message/',
+                json.dumps({'message': 'I have a headache', 'session_id': self.session.id}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(ChatMessage.objects.filter(session=self.session).count(), 2)
+
+    def test_send_message_queries(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(views.AIService, 'generate_response', return_value='How long has it lasted?'):
+            # Session and user lookups, the two turn reads and the four turn writes
+            with self.assertNumQueries(8):
+                response = self.client.post(
+                    '/api/send_message/',
+                    json.dumps({'message': 'I have a headache', 'session_id': self.session.id}),
+                    content_type='application/json',
+                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ChatMessage.objects.filter(session=self.session).count(), 4)
+
+    def stream(self, chunks):
+        self.client.force_login(self.user)
+        # The reply is generated as the response is read
+        self.enterContext(mock.patch.object(views.AIService, 'stream_response', return_value=chunks))
+        return self.client.post(
+            '/api/send_message/stream/',
+            json.dumps({'message': 'I have a headache', 'session_id': self.session.id}),
+            content_type='application/json',
+        )
+
+    def test_stream_failure_ends_with_an_error_event(self):
+        def chunks():
+            yield 'How long '
+            raise RuntimeError('Gemini down')
+
+        with self.assertLogs('chat.views', 'ERROR'):
+            response = self.stream(chunks())
+            events = b''.join(response.streaming_content).decode().split('\n\n')
+        self.assertEqual(events[-2].split('\n')[0], 'event: error')
+        error = json.loads(events[-2].split('\n')[1][len('data: '):])
+        self.assertEqual((error['error'], error['session_id']), ('Gemini down', self.session.id))
+        # What was streamed is kept
+        messages = list(ChatMessage.objects.filter(session=self.session).values_list('is_user', 'content'))
+        self.assertEqual(messages[2:], [(True, 'I have a headache'), (False, 'How long')])
+
+    def test_disconnect_mid_stream_saves_the_partial_turn(self):
+        response = self.stream(iter(['How long ', 'has it lasted?']))
+        next(iter(response.streaming_content))
+        self.assertEqual(ChatMessage.objects.filter(session=self.session).count(), 2)
+        # The server closes the response when the client goes away
+        response.close()
+        messages = list(ChatMessage.objects.filter(session=self.session).values_list('is_user', 'content'))
+        self.assertEqual(messages[2:], [(True, 'I have a headache'), (False, 'How long')])
+
+
+MARKUP_RE = re.compile(r'</?(?:p|br|strong|em|code|ul|li)>|<ol(?: start="\d+")?>|</ol>')
+
+HOSTILE_REPLIES = [
+    '<script>alert(1)</script>',
+    'Try <img src=x onerror=alert(1)> tonight',
+    '**<a href="javascript:alert(1)">sleep</a>**',
+    '*" onmouseover="alert(1)*',
+    '[click](javascript:alert(1)) and ![x](x" onerror="alert(1))',
+    '`<b>` and **`</code><script>`**',
+    '- <iframe src=//evil>\n  continued <svg onload=alert(1)>\n\n1) <style>*{}</style>',
+    '_<u>_ __&lt;i&gt;__ &amp; \'quoted\'',
+]
+
+
+class RenderingTests(TestCase):
+    def assertOnlyOwnMarkup(self, html):
+        # Every tag left is one the renderer writes itself, with no attributes beyond a list start
+        self.assertNotIn('<', MARKUP_RE.sub('', html), html)
+
+    def test_raw_html_is_escaped(self):
+        self.assertEqual(render_markdown('<script>alert(1)</script>'), '<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>')
+        for reply in HOSTILE_REPLIES:
+            self.assertOnlyOwnMarkup(render_markdown(reply))
+
+    def test_markup_cannot_carry_attributes(self):
+        self.assertEqual(
+            render_markdown('**<a href="javascript:alert(1)">sleep</a>**'),
+            '<p><strong>&lt;a href=&quot;javascript:alert(1)&quot;&gt;sleep&lt;/a&gt;</strong></p>',
+        )
+        self.assertEqual(render_markdown('*" onmouseover="alert(1)*'), '<p><em>&quot; onmouseover=&quot;alert(1)</em></p>')
+        # Links are not rendered at all
+        self.assertEqual(render_markdown('[click](javascript:alert(1))'), '<p>[click](javascript:alert(1))</p>')
+        self.assertEqual(render_markdown('`<b>` and `**x**`'), '<p><code>&lt;b&gt;</code> and <code>**x**</code></p>')
+        self.assertEqual(render_markdown('3. third\n4. fourth'), '<ol start="3"><li>third</li><li>fourth</li></ol>')
+
+    def test_stream_matches_the_whole_reply_at_every_chunk_boundary(self):
+        replies = HOSTILE_REPLIES + ['**Sleep** well.\n\n- one\n- *two*\n\nThird `para`']
+        for reply in replies:
+            expected = render_markdown(reply)
+            for split in range(len(reply) + 1):
+                stream = MarkdownStream()
+                html = ''
+                for chunk in (reply[:split], reply[split:]):
+                    finished, tail = stream.feed(chunk)
+                    # Whatever is shown mid-stream is as safe as the final reply
+                    self.assertOnlyOwnMarkup(finished + tail)
+                    html += finished
+                self.assertEqual(html + tail, expected, (reply, split))
+
+    def test_stream_in_single_characters(self):
+        reply = HOSTILE_REPLIES[6]
+        stream = MarkdownStream()
+        html = ''
+        for char in reply:
+            finished, tail = stream.feed(char)
+            self.assertOnlyOwnMarkup(finished + tail)
+            html += finished
+        self.assertEqual(html + tail, render_markdown(reply))
+
+
+class SessionCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.client.force_login(self.user)
+
+    def send(self, message, session_id=None):
+        with mock.patch.object(views.AIService, 'generate_response', return_value='**How long** has it lasted?'):
+            return self.client.post(
+                '/api/send_message/',
+                json.dumps({'message': message, 'session_id': session_id}),
+                content_type='application/json',
+            ).json()['session_id']
+
+    def test_turns_update_the_counters(self):
+        session_id = self.send('I have a headache')
+        self.send('Since this morning', session_id)
+
+        session = AnalysisSession.objects.get(id=session_id)
+        last_message = session.messages.last()
+        self.assertEqual(session.message_count, 4)
+        self.assertEqual(session.last_message_at, last_message.timestamp)
+        self.assertEqual(session.last_message_preview, 'How long has it lasted?')
+
+    def test_sessions_page_does_not_read_messages(self):
+        session_id = self.send('I have a headache')
+        with CaptureQueriesContext(connection) as queries:
+            sessions = self.client.get('/api/sessions/').json()['sessions']
+        self.assertFalse([query for query in queries if 'chat_chatmessage' in query['sql']])
+        self.assertEqual(sessions[0]['id'], session_id)
+        self.assertEqual(sessions[0]['message_count'], 2)
+
+    def test_repair_recomputes_stale_counters(self):
+        session_id = self.send('I have a headache')
+        AnalysisSession.objects.filter(id=session_id).update(message_count=7, last_message_preview='')
+        empty = AnalysisSession.objects.create(user=self.user, analysis_type='general', message_count=3)
+
+        call_command('repair_session_counters', chunk_size=1, verbosity=0)
+
+        session = AnalysisSession.objects.get(id=session_id)
+        self.assertEqual((session.message_count, session.last_message_preview), (2, 'How long has it lasted?'))
+        empty.refresh_from_db()
+        self.assertEqual((empty.message_count, empty.last_message_at), (0, None))
+
+
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.client.force_login(self.user)
+        self.session = AnalysisSession.objects.create(user=self.user, analysis_type='general', title='General Chat')
+        for n in range(6):
+            ChatMessage.objects.create(session=self.session, content=f'Message **{n}**', is_user=n % 2 == 0)
+        call_command('repair_session_counters', verbosity=0)
+        AnalysisSession.objects.filter(id=self.session.id).update(updated_at=timezone.now() - timedelta(days=60))
+
+    def load(self, query=''):
+        return self.client.get(f'/api/sessions/{self.session.id}/{query}').json()
+
+    def test_archived_session_loads_the_same(self):
+        before = self.load('?limit=4')
+        older = self.load(f"?limit=4&before={before['messages'][0]['id']}")
+        call_command('archive_sessions', verbosity=0)
+
+        self.assertFalse(ChatMessage.objects.filter(session=self.session).exists())
+        self.assertIsNotNone(AnalysisSession.objects.get(id=self.session.id).archived_at)
+        self.assertEqual(self.load('?limit=4'), before)
+        self.assertEqual(self.load(f"?limit=4&before={before['messages'][0]['id']}"), older)
+
+        # The counters still count the archived messages
+        call_command('repair_session_counters', verbosity=0)
+        self.assertEqual(AnalysisSession.objects.get(id=self.session.id).message_count, 6)
+
+    def test_recent_sessions_are_not_archived(self):
+        call_command('archive_sessions', days=90, verbosity=0)
+        self.assertEqual(ChatMessage.objects.filter(session=self.session).count(), 6)
+
+    def test_next_turn_restores_the_messages(self):
+        ids = list(ChatMessage.objects.filter(session=self.session).values_list('id', 'timestamp'))
+        call_command('archive_sessions', verbosity=0)
+
+        with mock.patch.object(views.AIService, 'generate_response', return_value='How long has it lasted?') as reply:
+            self.client.post(
+                '/api/send_message/',
+                json.dumps({'message': 'I have a headache', 'session_id': self.session.id}),
+                content_type='application/json',
+            )
+        self.assertIn('Message **5**', str(reply.call_args))
+        self.assertFalse(MessageArchive.objects.exists())
+        self.assertIsNone(AnalysisSession.objects.get(id=self.session.id).archived_at)
+        messages = list(ChatMessage.objects.filter(session=self.session).values_list('id', 'timestamp'))
+        self.assertEqual(messages[:6], ids)
+        self.assertEqual(len(messages), 8)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.client.force_login(self.user)
+        self.session = AnalysisSession.objects.create(user=self.user, analysis_type='sleep_quality', title='Sleep check')
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=self.session, content='I get headaches after <b>coffee</b>', is_user=True),
+            ChatMessage(session=self.session, content='How much caffeine do you drink?', is_user=False),
+        ])
+        other = User.objects.create_user('other', password='secret')
+        other_session = AnalysisSession.objects.create(user=other, analysis_type='general')
+        ChatMessage.objects.create(session=other_session, content='My headache is worse today', is_user=True)
+
+    def search(self, query, **params):
+        return self.client.get('/api/search/', {'q': query, **params}).json()
+
+    def test_finds_the_users_own_messages(self):
+        results = self.search('headache')['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual((results[0]['session_id'], results[0]['session_title']), (self.session.id, 'Sleep check'))
+        # Stemmed, escaped, and the match marked
+        self.assertIn('<mark>headaches</mark>', results[0]['snippet'])
+        self.assertIn('&lt;b&gt;coffee&lt;/b&gt;', results[0]['snippet'])
+
+    def test_index_follows_writes(self):
+        message = ChatMessage.objects.get(content__startswith='How much')
+        message.content = 'Do you drink tea?'
+        message.save()
+        self.assertEqual(self.search('caffeine')['results'], [])
+        self.assertEqual(len(self.search('tea')['results']), 1)
+        message.delete()
+        self.assertEqual(self.search('tea')['results'], [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        for query in ['"headache', 'NOT headache', 'headache*', 'content:headache OR']:
+            self.assertEqual(self.client.get('/api/search/', {'q': query}).status_code, 200)
+        self.assertEqual(self.search('  ')['results'], [])
+
+    def test_pages(self):
+        ChatMessage.objects.bulk_create(
+            ChatMessage(session=self.session, content=f'Coffee note {n}', is_user=True) for n in range(5)
+        )
+        first = self.search('coffee', limit=4)
+        second = self.search('coffee', limit=4, page=first['next_page'])
+        self.assertEqual((len(first['results']), len(second['results'])), (4, 2))
+        self.assertIsNone(second['next_page'])
+        ids = [result['message_id'] for result in first['results'] + second['results']]
+        self.assertEqual(len(set(ids)), 6)
+
+    def test_archived_messages_come_after_the_index(self):
+        old = AnalysisSession.objects.create(user=self.user, analysis_type='general', title='Old chat')
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=old, content='Coffee keeps me awake when I have it after lunch', is_user=True),
+            ChatMessage(session=old, content='Try switching to decaf.', is_user=False),
+        ])
+        AnalysisSession.objects.filter(pk=old.pk).update(updated_at=timezone.now() - timedelta(days=60))
+        archive.archive_session(old.pk, timezone.now())
+
+        first = self.search('coffee', limit=1)
+        self.assertEqual([result['session_id'] for result in first['results']], [self.session.id])
+        second = self.search('coffee', limit=1, page=first['next_page'])
+        self.assertIsNone(second['next_page'])
+        result = second['results'][0]
+        self.assertEqual((result['session_id'], result['session_title'], result['archived']), (old.id, 'Old chat', True))
+        self.assertEqual(result['snippet'], '<mark>Coffee</mark> keeps me awake when I have it after lunch')
+        # Archived words match by prefix, and every word must match
+        self.assertEqual([result['session_id'] for result in self.search('awak')['results']], [old.id])
+        self.assertEqual(self.search('coffee decaf')['results'], [])
+
+        with transaction.atomic():
+            archive.restore(old.pk)
+        results = self.search('coffee', limit=5)['results']
+        self.assertEqual([result['archived'] for result in results], [False, False])
+
+    def test_unsupported_database_is_reported(self):
+        with mock.patch.object(views.search, 'is_supported', return_value=False):
+            response = self.client.get('/api/search/', {'q': 'headache'})
+        self.assertEqual(response.status_code, 501)
+        self.assertIn('error', response.json())
+
+    def test_index_does_not_block_table_remakes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        # How Django's SQLite migrations alter a table; a view or trigger
+        # reading chat_analysissession makes the rename fail
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'chat_analysissession'")
+            cursor.execute(cursor.fetchone()[0].replace('"chat_analysissession"', '"new__chat_analysissession"', 1))
+            cursor.execute('INSERT INTO new__chat_analysissession SELECT * FROM chat_analysissession')
+            cursor.execute('DROP TABLE chat_analysissession')
+            cursor.execute('ALTER TABLE new__chat_analysissession RENAME TO chat_analysissession')
+        self.assertEqual(len(self.search('headache')['results']), 1)
+
+    def test_admin_searches_the_index(self):
+        User.objects.create_superuser('admin', password='secret')
+        self.client.login(username='admin', password='secret')
+        with override_settings(STORAGES=PLAIN_STATIC):
+            response = self.client.get('/admin/chat/chatmessage/', {'q': 'headaches'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+
+# Pages render without collectstatic's manifest
+PLAIN_STATIC = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(STORAGES=PLAIN_STATIC)
+class SessionWriteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+
+    def session_writes(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(path)
+        return [query for query in queries if query['sql'].startswith('UPDATE "django_session"')]
+
+    def test_fresh_session_is_not_rewritten(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.session_writes('/dashboard/'), [])
+        self.assertEqual(self.session_writes('/api/sessions/'), [])
+
+    def test_session_is_refreshed_below_the_threshold(self):
+        self.client.force_login(self.user)
+        Session.objects.update(expire_date=timezone.now() + timedelta(days=2))
+
+        self.assertEqual(len(self.session_writes('/dashboard/')), 1)
+        self.assertGreater(Session.objects.get().expire_date, timezone.now() + timedelta(days=13))
+        self.assertEqual(self.session_writes('/dashboard/'), [])
+
+    def login(self):
+        return self.client.post('/login/', {'username': 'patient', 'password': 'secret'})
+
+    def test_pendo_event_is_shown_once(self):
+        self.login()
+        self.assertEqual(self.client.get('/dashboard/').context['pendo_event'], 'logged_in')
+        self.assertIsNone(self.client.get('/dashboard/').context['pendo_event'])
+
+    @override_settings(FLASH_STORE='cache')
+    def test_pendo_event_in_the_cache(self):
+        self.login()
+        self.assertNotIn('flash_pendo_event', self.client.cookies)
+        self.assertEqual(self.client.get('/dashboard/').context['pendo_event'], 'logged_in')
+        self.assertIsNone(self.client.get('/dashboard/').context['pendo_event'])
+
+
+@override_settings(STORAGES=PLAIN_STATIC)
+class StaticAssetTests(TestCase):
+    def test_pages_link_their_styles_and_scripts(self):
+        user = User.objects.create_user('patient', password='secret')
+        self.client.force_login(user)
+        for path in ['/chat/', '/dashboard/']:
+            html = self.client.get(path).content.decode()
+            self.assertNotIn('<style>', html)
+            self.assertNotIn('cdnjs.cloudflare.com', html)
+            self.assertIn('/static/vendor/fontawesome/css/all.min.css', html)
+
+
+@override_settings(
+    STORAGES=PLAIN_STATIC,
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragment-tests'},
+    },
+    FRAGMENT_CACHE='fragments',
+)
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.client.force_login(self.user)
+
+    def session_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            html = self.client.get(path).content.decode()
+        return html, [query for query in queries if 'chat_analysissession' in query['sql']]
+
+    def test_dashboard_fragments_are_cached_per_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            session = AnalysisSession.objects.create(user=self.user, analysis_type='general', title='Sleep check')
+        html, queries = self.session_queries('/dashboard/')
+        self.assertIn('Sleep check', html)
+        self.assertTrue(queries)
+
+        html, queries = self.session_queries('/dashboard/')
+        self.assertIn('Sleep check', html)
+        self.assertEqual(queries, [])
+
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_login(other)
+        html, _ = self.session_queries('/dashboard/')
+        self.assertNotIn('Sleep check', html)
+
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            session.title = 'Sleep follow-up'
+            session.save()
+        self.assertIn('Sleep follow-up', self.session_queries('/dashboard/')[0])
+
+    def test_new_messages_invalidate_the_dashboard(self):
+        with mock.patch.object(views.AIService, 'generate_response', return_value='How long has it lasted?'), \
+                self.captureOnCommitCallbacks(execute=True):
+            session_id = self.client.post(
+                '/api/send_message/', json.dumps({'message': 'I have a headache'}), content_type='application/json',
+            ).json()['session_id']
+        self.assertIn('2 messages', self.session_queries('/dashboard/')[0])
+
+        with mock.patch.object(views.AIService, 'generate_response', return_value='And now?'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/send_message/',
+                json.dumps({'message': 'Still there', 'session_id': session_id}),
+                content_type='application/json',
+            )
+        self.assertIn('4 messages', self.session_queries('/dashboard/')[0])
+
+
+class WebSocketChatTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.client.force_login(self.user)
+        self.session = AnalysisSession.objects.create(user=self.user, analysis_type='general', title='General Chat')
+
+    def connect(self, path, origin='http://localhost'):
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        headers = [(b'host', b'localhost'), (b'cookie', cookie.encode())]
+        if origin:
+            headers.append((b'origin', origin.encode()))
+        return ApplicationCommunicator(websocket_application, {
+            'type': 'websocket', 'path': path, 'headers': headers,
+        })
+
+    async def handshake(self, communicator):
+        await communicator.send_input({'type': 'websocket.connect'})
+        return await communicator.receive_output(5)
+
+    async def frames(self, communicator, until):
+        frames = []
+        while not frames or frames[-1]['type'] != until:
+            frames.append(json.loads((await communicator.receive_output(5))['text']))
+        return frames
+
+    async def test_turn_streams_and_saves(self):
+        communicator = self.connect(f'/ws/chat/{self.session.id}/')
+        self.assertEqual((await self.handshake(communicator))['type'], 'websocket.accept')
+
+        with mock.patch.object(views.AIService, 'stream_response', return_value=iter(['**How long**', ' has it lasted?'])):
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({
+                'type': 'message', 'message': 'I have a headache',
+            })})
+            frames = await self.frames(communicator, 'done')
+
+        self.assertEqual([frame['type'] for frame in frames], ['typing', 'typing', 'chunk', 'chunk', 'done'])
+        self.assertEqual(frames[-1]['session_id'], self.session.id)
+        self.assertEqual(frames[-1]['ai_response'], '**How long** has it lasted?')
+        contents = [message.content async for message in ChatMessage.objects.filter(session=self.session)]
+        self.assertEqual(contents, ['I have a headache', '**How long** has it lasted?'])
+
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'ping'})})
+        self.assertEqual(await self.frames(communicator, 'pong'), [{'type': 'pong'}])
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+    async def test_other_users_session_is_not_found(self):
+        other = await User.objects.acreate_user('other', password='secret')
+        session = await AnalysisSession.objects.acreate(user=other, analysis_type='general')
+        communicator = self.connect(f'/ws/chat/{session.id}/')
+        await self.handshake(communicator)
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({
+            'type': 'message', 'message': 'Hello',
+        })})
+        frame = (await self.frames(communicator, 'error'))[-1]
+        self.assertEqual((frame['request'], frame['status']), ('message', 404))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+    async def test_cross_site_handshake_is_refused(self):
+        communicator = self.connect('/ws/chat/', origin='https://evil.example')
+        self.assertEqual(await self.handshake(communicator), {'type': 'websocket.close', 'code': 4403})
+        communicator = self.connect('/ws/chat/', origin='https://doctor.up.railway.app')
+        communicator.scope['headers'][0] = (b'host', b'doctor.up.railway.app')
+        self.assertEqual((await self.handshake(communicator))['type'], 'websocket.accept')
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+    @override_settings(CHAT_SOCKET_REPORT_POLL=0.01)
+    async def test_report_is_pushed_when_ready(self):
+        communicator = self.connect(f'/ws/chat/{self.session.id}/')
+        await self.handshake(communicator)
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'report'})})
+        queued = (await self.frames(communicator, 'report_queued'))[-1]
+        self.assertEqual(queued['status'], ReportJob.PENDING)
+
+        await AnalysisSession.objects.filter(id=self.session.id).aupdate(report='All good')
+        await ReportJob.objects.filter(id=queued['job_id']).aupdate(status=ReportJob.SUCCEEDED)
+        ready = (await self.frames(communicator, 'report_ready'))[-1]
+        self.assertEqual(ready['report'], 'All good')
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.now = timezone.now().replace(minute=30)
+        self.hour = self.now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        self.session = self.chat(self.user, 'sleep_quality', self.hour, turns=2)
+        self.chat(None, 'sleep_quality', self.hour + timedelta(hours=1), turns=1)
+
+    def chat(self, user, analysis_type, at, turns):
+        session = AnalysisSession.objects.create(user=user, analysis_type=analysis_type, message_count=turns * 2)
+        messages = ChatMessage.objects.bulk_create(
+            ChatMessage(session=session, content=f'Message {n}', is_user=n % 2 == 0) for n in range(turns * 2)
+        )
+        AnalysisSession.objects.filter(pk=session.pk).update(created_at=at)
+        ChatMessage.objects.filter(pk__in=[message.pk for message in messages]).update(timestamp=at)
+        return session
+
+    def row(self, granularity, period_start, session_type):
+        return UsageRollup.objects.get(
+            granularity=granularity, period_start=period_start, analysis_type='sleep_quality', session_type=session_type,
+        )
+
+    def test_hourly_and_daily_counts(self):
+        ReportJob.objects.create(session=self.session, status=ReportJob.SUCCEEDED, finished_at=self.hour, turns=2)
+        rollups.roll_up(lag=0)
+        hourly = self.row(UsageRollup.HOUR, self.hour, UsageRollup.AUTHENTICATED)
+        self.assertEqual(
+            (hourly.sessions_started, hourly.messages, hourly.user_messages, hourly.sessions_completed, hourly.completion_turns),
+            (1, 4, 2, 1, 2),
+        )
+        self.assertEqual(self.row(UsageRollup.HOUR, self.hour + timedelta(hours=1), UsageRollup.GUEST).messages, 2)
+        daily = self.row(UsageRollup.DAY, rollups.day_start(self.hour), UsageRollup.AUTHENTICATED)
+        self.assertEqual((daily.sessions_started, daily.messages), (1, 4))
+
+    def test_completion_turns_are_those_the_report_covered(self):
+        ReportJob.objects.create(session=self.session)
+        job = report_jobs.claim_next_job('worker-1')
+        with mock.patch.object(report_jobs.AIService, 'write_analysis_report', return_value='Sleep report'):
+            self.assertTrue(report_jobs.run_job(job))
+        ReportJob.objects.update(finished_at=self.hour)
+        # The conversation goes on after the report
+        AnalysisSession.objects.filter(pk=self.session.pk).update(message_count=10)
+
+        rollups.roll_up(lag=0)
+        hourly = self.row(UsageRollup.HOUR, self.hour, UsageRollup.AUTHENTICATED)
+        self.assertEqual((hourly.sessions_completed, hourly.completion_turns), (1, 2))
+
+    def test_reruns_only_add_new_rows(self):
+        rollups.roll_up(lag=0)
+        rollups.roll_up(lag=0)
+        self.assertEqual(self.row(UsageRollup.HOUR, self.hour, UsageRollup.AUTHENTICATED).messages, 4)
+
+        # Too recent for the lag, then old enough
+        ChatMessage.objects.create(session=self.session, content='One more', is_user=True)
+        self.assertEqual(rollups.roll_up(lag=300)['messages'], 0)
+        ChatMessage.objects.filter(content='One more').update(timestamp=self.hour)
+        self.assertEqual(rollups.roll_up(lag=300, chunk_size=2)['messages'], 1)
+        hourly = self.row(UsageRollup.HOUR, self.hour, UsageRollup.AUTHENTICATED)
+        self.assertEqual((hourly.messages, hourly.user_messages, hourly.sessions_started), (5, 3, 1))
+        self.assertEqual(self.row(UsageRollup.DAY, rollups.day_start(self.hour), UsageRollup.AUTHENTICATED).messages, 5)
+
+    def test_guest_activity_is_counted_in_memory(self):
+        turn = views._begin_turn_guest(None, 'I sleep badly')
+        views._finish_turn(turn, 'How long do you sleep?', '<p>How long do you sleep?</p>')
+        self.assertFalse(UsageRollup.objects.filter(analysis_type='general').exists())
+        rollups.flush_guests()
+        hourly = UsageRollup.objects.get(granularity=UsageRollup.HOUR, analysis_type='general')
+        self.assertEqual(
+            (hourly.session_type, hourly.sessions_started, hourly.messages, hourly.user_messages),
+            (UsageRollup.GUEST, 1, 2, 1),
+        )
+
+    def test_admin_reads_only_the_rollups(self):
+        rollups.roll_up(lag=0)
+        User.objects.create_superuser('admin', password='secret')
+        self.client.login(username='admin', password='secret')
+        with override_settings(STORAGES=PLAIN_STATIC), CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/chat/usagerollup/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([
+            query['sql'] for query in queries
+            if 'chat_chatmessage' in query['sql'] or 'chat_analysissession' in query['sql']
+        ])
+        self.assertEqual(response.context['usage_totals']['messages'], 6)
+
+    def test_large_unfiltered_admin_lists_are_estimated(self):
+        User.objects.create_superuser('admin', password='secret')
+        self.client.login(username='admin', password='secret')
+        with override_settings(STORAGES=PLAIN_STATIC, ADMIN_EXACT_COUNT_LIMIT=1), \
+                mock.patch('chat.admin.estimated_count', return_value=5000):
+            unfiltered = self.client.get('/admin/chat/analysissession/')
+            filtered = self.client.get('/admin/chat/analysissession/', {'is_completed__exact': '0'})
+        self.assertEqual(unfiltered.context['cl'].result_count, 5000)
+        self.assertEqual(filtered.context['cl'].result_count, 2)
+
+
+class ReportQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.session = AnalysisSession.objects.create(user=self.user, analysis_type='sleep_quality')
+        ChatMessage.objects.create(session=self.session, content='I sleep badly', is_user=True)
+
+    def test_async_endpoint_queues_the_report(self):
+        self.client.force_login(self.user)
+        responses = [
+            self.client.post(f'/api/{prefix}sessions/{self.session.id}/report/') for prefix in ('async/', '', 'async/')
+        ]
+        self.assertEqual([response.status_code for response in responses], [202, 202, 202])
+        # One job, whichever endpoint asked
+        self.assertEqual(len({response.json()['job_id'] for response in responses}), 1)
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.PENDING)
+
+    def test_a_job_is_claimed_once(self):
+        job = report_jobs.submit_report(self.session)
+        claimed = report_jobs.claim_next_job('worker-1')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual((claimed.status, claimed.locked_by, claimed.attempts), (ReportJob.RUNNING, 'worker-1', 1))
+        self.assertIsNone(report_jobs.claim_next_job('worker-2'))
+
+    @override_settings(REPORT_JOB_LEASE=600)
+    def test_an_expired_lease_is_claimed_again(self):
+        report_jobs.submit_report(self.session)
+        stale = report_jobs.claim_next_job('worker-1')
+        ReportJob.objects.update(locked_at=timezone.now() - timedelta(seconds=601))
+
+        claimed = report_jobs.claim_next_job('worker-2')
+        self.assertEqual((claimed.locked_by, claimed.attempts), ('worker-2', 2))
+        # The first worker finishing late does not overwrite the new owner
+        report_jobs._finish(stale, ReportJob.SUCCEEDED)
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.RUNNING)
+
+    @override_settings(REPORT_JOB_LEASE=600)
+    def test_a_worker_that_lost_its_lease_does_not_write_the_report(self):
+        report_jobs.submit_report(self.session)
+        stale = report_jobs.claim_next_job('worker-1')
+        ReportJob.objects.update(locked_at=timezone.now() - timedelta(seconds=601))
+        report_jobs.claim_next_job('worker-2')
+
+        with mock.patch.object(report_jobs.AIService, 'write_analysis_report', return_value='Late report'), \
+                self.assertLogs('chat.report_jobs', 'WARNING'):
+            self.assertFalse(report_jobs.run_job(stale))
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.report, self.session.is_completed), ('', False))
+        self.assertEqual(ReportJob.objects.values_list('status', 'locked_by').get(), (ReportJob.RUNNING, 'worker-2'))
+
+    @override_settings(REPORT_JOB_BACKOFF=30, REPORT_JOB_BACKOFF_MAX=600, REPORT_JOB_MAX_ATTEMPTS=4)
+    def test_a_failed_attempt_is_retried_later(self):
+        report_jobs.submit_report(self.session)
+        job = report_jobs.claim_next_job('worker-1')
+        with mock.patch.object(report_jobs.AIService, 'write_analysis_report', side_effect=ServiceUnavailable('busy')), \
+                self.assertLogs('chat.report_jobs', 'WARNING'):
+            self.assertFalse(report_jobs.run_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (ReportJob.PENDING, 1, ''))
+        self.assertIn('busy', job.last_error)
+        # 30s, jittered by up to a fifth
+        delay = (job.run_after - timezone.now()).total_seconds()
+        self.assertTrue(23 < delay <= 36, delay)
+        self.assertIsNone(report_jobs.claim_next_job('worker-1'))
+        with mock.patch.object(report_jobs.random, 'uniform', return_value=1):
+            self.assertEqual([report_jobs.backoff_delay(n) for n in (1, 2, 3, 6)], [30, 60, 120, 600])
+
+    @override_settings(REPORT_JOB_MAX_ATTEMPTS=2)
+    def test_a_job_is_abandoned_after_the_last_attempt(self):
+        report_jobs.submit_report(self.session)
+        with mock.patch.object(report_jobs.AIService, 'write_analysis_report', side_effect=ServiceUnavailable('busy')), \
+                self.assertLogs('chat.report_jobs', 'WARNING') as logs:
+            for _ in range(2):
+                self.assertFalse(report_jobs.run_job(report_jobs.claim_next_job('worker-1')))
+                ReportJob.objects.filter(status=ReportJob.PENDING).update(run_after=timezone.now())
+
+        job = ReportJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (ReportJob.FAILED, 2))
+        self.assertIn('failed after 2 attempts', logs.output[-1])
+        self.assertIsNone(report_jobs.claim_next_job('worker-1'))
+        self.assertIn('error', report_jobs.job_payload(job))
+        # A failed job does not block a new request
+        self.assertNotEqual(report_jobs.submit_report(self.session).pk, job.pk)
+
+    @override_settings(REPORT_JOB_MAX_ATTEMPTS=2, REPORT_JOB_LEASE=600)
+    def test_a_job_whose_workers_keep_dying_is_abandoned(self):
+        report_jobs.submit_report(self.session)
+        for worker in ('worker-1', 'worker-2'):
+            report_jobs.claim_next_job(worker)
+            ReportJob.objects.update(locked_at=timezone.now() - timedelta(seconds=601))
+
+        job = report_jobs.claim_next_job('worker-3')
+        with mock.patch.object(report_jobs.AIService, 'write_analysis_report') as write:
+            self.assertFalse(report_jobs.run_job(job))
+        write.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ReportJob.FAILED, 3))
+        self.assertIn('Abandoned', job.last_error)
+
+    def test_concurrent_submits_share_one_job(self):
+        queued = ReportJob.objects.create(session=self.session)
+        first = QuerySet.first
+        lookups = []
+
+        def miss_once(queryset):
+            # The other request's job was inserted just after this request looked
+            lookups.append(queryset)
+            return None if len(lookups) == 1 else first(queryset)
+
+        with mock.patch.object(QuerySet, 'first', autospec=True, side_effect=miss_once):
+            job = report_jobs.submit_report(self.session)
+        self.assertEqual(job.pk, queued.pk)
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+
+@override_settings(CHAT_CONTEXT_TOKEN_BUDGET=60, CHAT_CONTEXT_RECENT_TURNS=3, CHAT_CONTEXT_BACKGROUND=False)
+class ContextCompactionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.session = AnalysisSession.objects.create(user=self.user, analysis_type='general')
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=self.session, content='I sleep about five hours', is_user=True),
+            ChatMessage(session=self.session, content='x' * 200, is_user=False),
+            ChatMessage(session=self.session, content='Is that enough?', is_user=True),
+            ChatMessage(session=self.session, content='Most adults need seven.', is_user=False),
+        ])
+
+    def test_messages_over_the_budget_are_left_out_then_folded(self):
+        messages = [(True, 'I sleep about five hours'), (False, 'x' * 200), (True, 'Is that enough?')]
+        history, left_out = context.build_conversation_history(messages)
+        # The long reply does not fit beside the latest message
+        self.assertEqual(left_out, 2)
+        self.assertEqual(history, 'User: Is that enough?')
+
+        # After the turn: within the recent turns, yet folded because they no longer fit
+        with mock.patch.object(context.AIService, 'summarize_conversation', return_value='Sleeps five hours.') as summarize, \
+                self.assertLogs('chat.context', 'INFO'):
+            context.maybe_compact_session(self.session.id, 4, left_out)
+        self.assertIn('I sleep about five hours', summarize.call_args.args[1])
+        session = AnalysisSession.objects.get(pk=self.session.id)
+        self.assertEqual((session.summary, session.summary_message_count), ('Sleeps five hours.', 2))
+
+        history, left_out = context.build_conversation_history(
+            [(True, 'Is that enough?'), (False, 'Most adults need seven.'), (True, 'Why?')], session.summary,
+        )
+        self.assertEqual(left_out, 0)
+        self.assertTrue(history.startswith('Summary of the earlier conversation:\nSleeps five hours.'))
+
+    def test_short_conversations_are_not_compacted(self):
+        ChatMessage.objects.filter(content__startswith='x').update(content='Try going to bed earlier.')
+        with mock.patch.object(context.AIService, 'summarize_conversation') as summarize:
+            context.maybe_compact_session(self.session.id, 4)
+        summarize.assert_not_called()
+
+
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+@override_settings(CACHES=LOCAL_CACHE, OPENING_QUESTIONS_POOL_SIZE=10)
+class QuestionPoolTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_writers_keep_every_variant(self):
+        load_pool = question_pool.load_pool
+
+        def slow_load_pool(analysis_type):
+            # Widen the window between reading and rewriting the pool
+            pool = load_pool(analysis_type)
+            time.sleep(0.01)
+            return pool
+
+        with mock.patch.object(question_pool, 'load_pool', side_effect=slow_load_pool):
+            threads = [
+                threading.Thread(target=question_pool.add_variant, args=('sleep_quality', f'Variant {n}'))
+                for n in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(question_pool.load_pool('sleep_quality')), 8)
+
+    def test_locked_pool_drops_the_variant(self):
+        cache.add(question_pool.LOCK_KEY.format('sleep_quality'), 'another writer')
+        with mock.patch.object(question_pool, 'LOCK_WAIT', 0.1), self.assertLogs('chat.question_pool', 'WARNING'):
+            self.assertFalse(question_pool.add_variant('sleep_quality', 'Variant'))
+        self.assertEqual(question_pool.load_pool('sleep_quality'), [])
+        # Not released by the writer that gave up
+        self.assertEqual(cache.get(question_pool.LOCK_KEY.format('sleep_quality')), 'another writer')
+
+        cache.delete(question_pool.LOCK_KEY.format('sleep_quality'))
+        self.assertTrue(question_pool.add_variant('sleep_quality', 'Variant'))
+        self.assertIsNone(cache.get(question_pool.LOCK_KEY.format('sleep_quality')))
+
+
+class GuestStoreTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'guest_sessions.sqlite3')
+
+    def conversation(self, *contents):
+        return {'analysis_type': 'general', 'messages': [{'content': content, 'is_user': True} for content in contents]}
+
+    def test_caps_drop_the_oldest_messages(self):
+        store = InMemoryGuestSessionStore(max_messages=3, max_chars=10)
+        data = self.conversation('a', 'b', 'c', 'd')
+        data['summary_message_count'] = 2
+        session_id = store.create(data)
+        saved = store.get(session_id)
+        self.assertEqual([message['content'] for message in saved['messages']], ['b', 'c', 'd'])
+        # Still pointing after the same summarized messages
+        self.assertEqual(saved['summary_message_count'], 1)
+
+        session_id = store.create(self.conversation('12345', '1234', '12'))
+        self.assertEqual([message['content'] for message in store.get(session_id)['messages']], ['1234', '12'])
+        # The latest message is kept however long
+        session_id = store.create(self.conversation('12345', '12345678901'))
+        self.assertEqual([message['content'] for message in store.get(session_id)['messages']], ['12345678901'])
+
+    def test_memory_store_expires_and_evicts_the_least_recently_used(self):
+        store = InMemoryGuestSessionStore(ttl=60, max_entries=2)
+        first, second = store.create(self.conversation('a')), store.create(self.conversation('b'))
+        # Reading keeps a session in use
+        store.get(first)['messages'].append({'content': 'not saved', 'is_user': True})
+        third = store.create(self.conversation('c'))
+        self.assertIsNone(store.get(second))
+        self.assertEqual(len(store.get(first)['messages']), 1)
+        self.assertEqual(store.size(), 2)
+
+        with mock.patch('chat.guest_store.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(store.get(third))
+
+    def test_memory_store_reads_renew_the_expiry(self):
+        store = InMemoryGuestSessionStore(ttl=60, max_entries=10)
+        start = time.monotonic()
+        read, idle = store.create(self.conversation('a')), store.create(self.conversation('b'))
+        with mock.patch('chat.guest_store.time.monotonic', return_value=start + 50):
+            store.get(read)
+        with mock.patch('chat.guest_store.time.monotonic', return_value=start + 61):
+            store.create(self.conversation('c'))
+            # The idle session expired at the front and was evicted
+            self.assertEqual(store.size(), 2)
+        with mock.patch('chat.guest_store.time.monotonic', return_value=start + 100):
+            self.assertIsNotNone(store.get(read))
+        self.assertIsNone(store.get(idle))
+
+    def test_sqlite_store_is_shared_and_evicted(self):
+        store = SQLiteGuestSessionStore(path=self.path, ttl=60, max_entries=2)
+        store.evict_every = 1
+        session_ids = [store.create(self.conversation(str(n))) for n in range(3)]
+        # Another worker on the host sees the same sessions
+        other = SQLiteGuestSessionStore(path=self.path)
+        self.assertIsNone(other.get(session_ids[0]))
+        self.assertEqual(other.get(session_ids[2])['messages'][0]['content'], '2')
+        self.assertEqual(store.size(), 2)
+
+        with mock.patch('chat.guest_store.time.time', return_value=time.time() + 61):
+            self.assertIsNone(store.get(session_ids[2]))
+            store.evict()
+        self.assertEqual(store.size(), 0)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_cache_store_applies_the_caps(self):
+        store = CacheGuestSessionStore(cache_alias='default', max_messages=1)
+        session_id = store.create(self.conversation('a', 'b'))
+        self.assertEqual(store.get(session_id)['messages'], [{'content': 'b', 'is_user': True}])
+        store.delete(session_id)
+        self.assertIsNone(store.get(session_id))
+
+
+class SessionListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.client.force_login(self.user)
+        sessions = AnalysisSession.objects.bulk_create(
+            AnalysisSession(user=self.user, analysis_type='general', title=f'Session {n}') for n in range(5)
+        )
+        # Ties on updated_at are broken by id
+        self.updated_at = timezone.now() - timedelta(hours=1)
+        AnalysisSession.objects.filter(pk__in=[session.pk for session in sessions[:3]]).update(updated_at=self.updated_at)
+        self.order = [session.pk for session in reversed(sessions[3:])] + [session.pk for session in reversed(sessions[:3])]
+
+    def test_cursor_round_trip(self):
+        cursor = views.encode_sessions_cursor(self.updated_at, 42)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(views.decode_sessions_cursor(cursor), (self.updated_at, 42))
+
+    def test_pages_walk_every_session_once(self):
+        seen, cursor = [], None
+        while True:
+            page = self.client.get('/api/sessions/', {'limit': 2, **({'cursor': cursor} if cursor else {})}).json()
+            seen += [session['id'] for session in page['sessions']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.order)
+
+    def test_invalid_cursor_or_limit(self):
+        encode = lambda raw: base64.urlsafe_b64encode(raw.encode()).decode()
+        cursors = [
+            'not a cursor', '!!!', 'é', encode('no separator'), encode('yesterday|1'),
+            encode(f'{self.updated_at.isoformat()}|one'),
+        ]
+        for cursor in cursors:
+            with self.assertRaises(ValueError):
+                views.decode_sessions_cursor(cursor)
+            response = self.client.get('/api/sessions/', {'cursor': cursor})
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid cursor'}))
+        self.assertEqual(self.client.get('/api/sessions/', {'limit': 'ten'}).status_code, 400)
+        # Out-of-range limits are clamped
+        self.assertEqual(len(self.client.get('/api/sessions/', {'limit': 0}).json()['sessions']), 1)
+
+
+class SessionLoadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.client.force_login(self.user)
+        self.session = AnalysisSession.objects.create(user=self.user, analysis_type='general', title='General Chat')
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=self.session, content='I have a headache', is_user=True),
+            ChatMessage(session=self.session, content='How long has it lasted?', is_user=False),
+        ])
+        self.url = f'/api/sessions/{self.session.id}/'
+
+    def test_unchanged_session_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), 2)
+        self.assertIn('private', response['Cache-Control'])
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content, response['ETag']), (304, b'', etag))
+        self.assertFalse([query for query in queries if 'chat_chatmessage' in query['sql']])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        # A new turn moves updated_at, and with it the ETag
+        request = RequestFactory().post('/api/send_message/')
+        request.user = self.user
+        turn = views._begin_turn(request, self.session.id, 'Since this morning')
+        views._finish_turn(turn, 'Have you had water today?', '<p>Have you had water today?</p>')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['messages']), 4)
+
+    def test_other_users_session_is_not_found(self):
+        etag = self.client.get(self.url)['ETag']
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'llm_responses.sqlite3')
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_every_backend_clears(self):
+        cache.clear()
+        cache.set('unrelated', 'kept')
+        backends = [
+            llm_cache.InMemoryResponseCache(),
+            llm_cache.SQLiteResponseCache(path=self.path),
+            llm_cache.CacheResponseCache(cache_alias='default'),
+        ]
+        for backend in backends:
+            with self.subTest(backend=type(backend).__name__):
+                backend.set('prompt', 'How long has it lasted?')
+                self.assertEqual(backend.get('prompt'), 'How long has it lasted?')
+                backend.clear()
+                self.assertIsNone(backend.get('prompt'))
+                backend.set('prompt', 'Since when?')
+                self.assertEqual(backend.get('prompt'), 'Since when?')
+        # The Django cache backend leaves the rest of a shared cache alone
+        self.assertEqual(cache.get('unrelated'), 'kept')
+
+
+class CountingCall:
+    """An upstream call that blocks until released and counts how often it ran"""
+
+    def __init__(self, result='reply', error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@override_settings(SINGLE_FLIGHT_SHARED=False, SINGLE_FLIGHT_LEASE=5)
+class SingleFlightTests(TestCase):
+    def run_together(self, key, call, callers=5):
+        """Run ``callers`` threads on one key; returns their results or exceptions"""
+        outcomes = [None] * callers
+
+        def caller(n):
+            try:
+                outcomes[n] = single_flight.run(key, call)
+            except Exception as e:
+                outcomes[n] = e
+
+        coalesced = single_flight.get_single_flight_stats()['coalesced']
+        threads = [threading.Thread(target=caller, args=(n,)) for n in range(callers)]
+        for thread in threads:
+            thread.start()
+        # Release the leader once everyone else is waiting on it
+        deadline = time.monotonic() + 5
+        while single_flight.get_single_flight_stats()['coalesced'] - coalesced < callers - 1:
+            self.assertLess(time.monotonic(), deadline, 'callers did not join the flight')
+            time.sleep(0.01)
+        call.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_identical_calls_make_one_upstream_call(self):
+        call = CountingCall()
+        self.assertEqual(self.run_together('same-prompt', call), ['reply'] * 5)
+        self.assertEqual(call.calls, 1)
+        self.assertEqual(single_flight.get_single_flight_stats()['in_flight'], 0)
+
+        # Once finished, the next call is made afresh
+        self.assertEqual(single_flight.run('same-prompt', lambda: 'again'), 'again')
+
+    def test_the_leaders_failure_reaches_every_caller(self):
+        error = ServiceUnavailable('overloaded')
+        call = CountingCall(error=error)
+        outcomes = self.run_together('failing-prompt', call)
+        self.assertEqual(call.calls, 1)
+        self.assertTrue(all(outcome is error for outcome in outcomes), outcomes)
+
+    @override_settings(SINGLE_FLIGHT_SHARED=True, SINGLE_FLIGHT_LEASE=0.3, SINGLE_FLIGHT_POLL_INTERVAL=0.02)
+    def test_a_lease_held_by_another_worker_times_out(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'single_flight.sqlite3')
+        # Another worker on the host holds the lease and never produces a reply
+        self.assertTrue(single_flight.SQLiteLeaseStore(path).acquire('held-prompt', 60))
+        store = single_flight.SQLiteLeaseStore(path)
+        self.enterContext(mock.patch.object(single_flight, 'get_lease_store', return_value=store))
+
+        call = CountingCall()
+        call.release.set()
+        started = time.monotonic()
+        self.assertEqual(single_flight.run('held-prompt', call, shared_result=lambda: None), 'reply')
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        self.assertEqual(call.calls, 1)
+
+        # The other worker's reply is used as soon as it shows up
+        call = CountingCall()
+        self.assertEqual(single_flight.run('held-prompt', call, shared_result=lambda: 'shared'), 'shared')
+        self.assertEqual(call.calls, 0)
+
+    async def start_async_flight(self, key, release, followers=3):
+        """A leader task blocked on ``release`` and ``followers`` tasks waiting on it"""
+        calls = []
+
+        async def acall():
+            calls.append(key)
+            await release.wait()
+            return 'reply'
+
+        coalesced = single_flight.get_single_flight_stats()['coalesced']
+        leader = asyncio.create_task(single_flight.arun(key, acall))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(single_flight.arun(key, acall)) for _ in range(followers)]
+        while single_flight.get_single_flight_stats()['coalesced'] - coalesced < followers:
+            await asyncio.sleep(0.01)
+        return leader, waiting, calls
+
+    async def test_a_follower_giving_up_leaves_the_flight_alone(self):
+        release = asyncio.Event()
+        leader, (cancelled, *followers), calls = await self.start_async_flight('async-prompt', release)
+        timed_out = asyncio.create_task(asyncio.wait_for(single_flight.arun('async-prompt', None), 0.01))
+        cancelled.cancel()
+        with self.assertRaises(asyncio.TimeoutError):
+            await timed_out
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled
+
+        release.set()
+        self.assertEqual(await leader, 'reply')
+        self.assertEqual(await asyncio.gather(*followers), ['reply', 'reply'])
+        self.assertEqual(calls, ['async-prompt'])
+
+    async def test_a_cancelled_leader_does_not_cancel_its_followers(self):
+        leader, followers, _ = await self.start_async_flight('abandoned-prompt', asyncio.Event())
+        leader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        outcomes = await asyncio.gather(*followers, return_exceptions=True)
+        self.assertTrue(all(isinstance(outcome, single_flight.FlightAbandoned) for outcome in outcomes), outcomes)
+        self.assertEqual(single_flight.get_single_flight_stats()['in_flight'], 0)
+
+    def test_an_expired_lease_can_be_taken(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'single_flight.sqlite3')
+        first, second = single_flight.SQLiteLeaseStore(path), single_flight.SQLiteLeaseStore(path)
+        self.assertTrue(first.acquire('prompt', 60))
+        self.assertFalse(second.acquire('prompt', 60))
+        with mock.patch('chat.single_flight.time.time', return_value=time.time() + 61):
+            self.assertFalse(second.held('prompt'))
+            self.assertTrue(second.acquire('prompt', 60))
+        # The first owner's late release leaves the new lease alone
+        first.release('prompt')
+        self.assertTrue(second.held('prompt'))
+
+
+class FakeClock:
+    """Stands in for the time module where a test moves time by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.enterContext(mock.patch.object(circuit_breaker, 'time', self.clock))
+        self.breaker = circuit_breaker.CircuitBreaker('gemini-test', failure_threshold=3, cooldown=30)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+        with self.assertLogs('chat.circuit_breaker', 'WARNING'):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.clock.advance(29)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.snapshot()['rejected'], 1)
+
+    def test_one_trial_call_after_the_cooldown(self):
+        with self.assertLogs('chat.circuit_breaker', 'WARNING'):
+            self.fail(3)
+        self.clock.advance(30)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, circuit_breaker.HALF_OPEN)
+        # Only the one trial call while it is in flight
+        self.assertFalse(self.breaker.allow())
+
+        with self.assertLogs('chat.circuit_breaker', 'INFO'):
+            self.breaker.record_success()
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_call_opens_again(self):
+        with self.assertLogs('chat.circuit_breaker', 'WARNING'):
+            self.fail(3)
+        self.clock.advance(30)
+        self.assertTrue(self.breaker.allow())
+        with self.assertLogs('chat.circuit_breaker', 'WARNING'):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.clock.advance(29)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.snapshot()['opened'], 2)
+
+    def test_lost_trial_call_is_replaced_after_another_cooldown(self):
+        with self.assertLogs('chat.circuit_breaker', 'WARNING'):
+            self.fail(3)
+        self.clock.advance(30)
+        self.assertTrue(self.breaker.allow())
+        self.clock.advance(29)
+        self.assertFalse(self.breaker.allow())
+        self.clock.advance(1)
+        self.assertTrue(self.breaker.allow())
+
+
+class FakeModel:
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.calls = 0
+
+    def generate_content(self, prompt, request_options=None, stream=False):
+        self.calls += 1
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return mock.Mock(text=self.outcome)
+
+
+@override_settings(
+    GEMINI_MODEL='primary', GEMINI_FALLBACK_MODELS=['fallback'], GEMINI_BREAKER_THRESHOLD=2,
+    GEMINI_DEADLINE=25, GEMINI_MIN_ATTEMPT_TIMEOUT=2,
+)
+class ModelChainTests(TestCase):
+    def setUp(self):
+        # Fresh breakers for the test models
+        self.enterContext(mock.patch.dict(circuit_breaker._breakers, clear=True))
+        self.models = {}
+        self.enterContext(mock.patch.object(ai_service, 'get_gemini_model', side_effect=lambda name: self.models[name]))
+
+    def test_failing_model_falls_through_and_is_skipped_once_open(self):
+        self.models = {'primary': FakeModel(ServiceUnavailable('overloaded')), 'fallback': FakeModel('Hello')}
+        with self.assertLogs('chat.ai_service', 'WARNING'):
+            self.assertEqual(ai_service.generate_text('Hi'), ('Hello', 'fallback'))
+            self.assertEqual(ai_service.generate_text('Hi'), ('Hello', 'fallback'))
+        self.assertEqual(circuit_breaker.get_breaker('primary').state, circuit_breaker.OPEN)
+
+        # The open model is not called at all
+        self.assertEqual(ai_service.generate_text('Hi'), ('Hello', 'fallback'))
+        self.assertEqual((self.models['primary'].calls, self.models['fallback'].calls), (2, 3))
+
+    def test_refused_request_does_not_fall_through(self):
+        self.models = {'primary': FakeModel(InvalidArgument('bad prompt')), 'fallback': FakeModel('Hello')}
+        with self.assertRaises(InvalidArgument):
+            ai_service.generate_text('Hi')
+        self.assertEqual(self.models['fallback'].calls, 0)
+        # The model itself is healthy
+        self.assertEqual(circuit_breaker.get_breaker('primary').consecutive_failures, 0)
+
+    @override_settings(GEMINI_STUB=False, GEMINI_TRANSPORT='rest')
+    async def test_async_calls_honour_the_rest_transport(self):
+        self.models = {'primary': FakeModel('Hello')}
+        self.assertEqual(await ai_service.agenerate_text('Hi'), ('Hello', 'primary'))
+        self.assertEqual(self.models['primary'].calls, 1)
+
+    @override_settings(GEMINI_STUB=False, GEMINI_TRANSPORT='')
+    async def test_async_client_is_shared_within_the_loop(self):
+        self.enterContext(mock.patch.dict(os.environ, {'GEMINI_API_KEY': 'test-key'}))
+        model = ai_service.get_async_gemini_model('primary')
+        self.assertIs(ai_service.get_async_gemini_model('fallback').client, model.client)
+        self.assertEqual(type(model.client.transport).__name__, 'GenerativeServiceGrpcAsyncIOTransport')
+        reply = ai_service.glm.GenerateContentResponse(candidates=[{'content': {'parts': [{'text': 'Hello'}]}, 'finish_reason': 1}])
+        with mock.patch.object(model.client, 'generate_content', new=mock.AsyncMock(return_value=reply)) as call:
+            self.assertEqual(await ai_service.agenerate_text('Hi'), ('Hello', 'primary'))
+        request = call.call_args.args[0]
+        self.assertEqual((request.model, request.contents[0].parts[0].text), ('models/primary', 'Hi'))
+
+    def test_no_model_answers(self):
+        self.models = {'primary': FakeModel(ServiceUnavailable('down')), 'fallback': FakeModel(ServiceUnavailable('down'))}
+        with self.assertLogs('chat.ai_service', 'WARNING'), self.assertRaises(ai_service.GeminiUnavailable):
+            ai_service.generate_text('Hi')
+        # Too little of the deadline left for any attempt
+        self.models = {'primary': FakeModel('Hello')}
+        with self.assertRaises(ai_service.GeminiUnavailable):
+            ai_service.generate_text('Hi', deadline=1)
+        self.assertEqual(self.models['primary'].calls, 0)
+
+
+class MetricsStoreTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = metrics.SQLiteMetricsStore(os.path.join(tmp.name, 'metrics.sqlite3'))
+
+    def write(self, pid, requests, sessions, at):
+        with mock.patch('chat.metrics.time.time', return_value=at):
+            self.store.write(pid, [
+                ('doctor_ai_requests_total', 'counter', 'doctor_ai_requests_total', {'view': 'chat'}, requests),
+                ('doctor_ai_sessions', 'gauge', 'doctor_ai_sessions', {}, sessions),
+            ])
+
+    def test_exited_processes_are_folded_into_one_row(self):
+        live = os.getpid()
+        with mock.patch('chat.metrics._pid_alive', side_effect=lambda pid: pid == live):
+            for restart, pid in enumerate([900001, 900002, 900003]):
+                self.write(pid, 10, 1, at=restart)
+                self.write(live, 5, 2, at=100)
+                totals = {row[0]: row[4] for row in self.store.totals(stale_before=50)}
+                # The counter keeps every exited process; the gauge only the live one
+                self.assertEqual(totals, {'doctor_ai_requests_total': 10 * (restart + 1) + 5, 'doctor_ai_sessions': 2})
+            # The live process is stale but still running, so it keeps its own rows
+            self.assertEqual(self.store.fold_dead(stale_before=200), [])
+        rows = self.store._connection().execute("SELECT pid, kind, value FROM metric_sample ORDER BY pid, kind").fetchall()
+        self.assertEqual(rows, [(0, 'counter', 30), (live, 'counter', 5), (live, 'gauge', 2)])
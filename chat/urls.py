@@ -16,6 +16,17 @@ urlpatterns = [
     # API URLs - Make sure these match your frontend calls
     path('api/start_analysis/', views.start_analysis, name='start_analysis'),
     path('api/send_message/', views.send_message, name='send_message'),
+    path('api/send_message/stream/', views.send_message_stream, name='send_message_stream'),
     path('api/sessions/', views.get_user_sessions, name='get_sessions'),
     path('api/sessions/<int:session_id>/', views.load_session, name='load_session'),
+    path('api/sessions/<int:session_id>/report/', views.request_report, name='request_report'),
+    path('api/reports/<int:job_id>/', views.report_status, name='report_status'),
+    path('api/search/', views.search_messages, name='search_messages'),
+    path('api/status/gemini/', views.gemini_status, name='gemini_status'),
+    path('metrics', views.metrics_view, name='metrics'),
+
+    # Async API URLs - preferred when served through ASGI (Procfile.asgi)
+    path('api/async/start_analysis/', views.start_analysis_async, name='start_analysis_async'),
+    path('api/async/send_message/', views.send_message_async, name='send_message_async'),
+    path('api/async/sessions/<int:session_id>/report/', views.generate_report_async, name='generate_report_async'),
 ]
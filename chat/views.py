@@ -1,22 +1,57 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Q, Subquery
+from datetime import datetime
+import base64
+import binascii
+import hmac
 import json
-import google.generativeai as genai
+import logging
 import os
 from dotenv import load_dotenv
-from .models import AnalysisSession, ChatMessage
+from .models import AnalysisSession, ChatMessage, ReportJob
+from .archive import all_messages, restore
+from .ai_service import agenerate_text, generate_text, model_chain, stream_text
+from .circuit_breaker import get_breaker_stats
+from .flash import clear_flash, get_flash, set_flash
+from .fragment_cache import fragment_context
+from .question_pool import get_opening_questions
+from .report_jobs import job_payload, submit_report
+from .guest_store import get_guest_store
+from . import llm_cache, metrics, search, single_flight
+from .context import build_conversation_history, maybe_compact_guest_session, maybe_compact_session
+from .rendering import MarkdownStream, clean_markdown, render_markdown
+from .session_counters import record_messages
+from .rollups import record_guest
+from asgiref.sync import sync_to_async
 import uuid
 
 load_dotenv()
 
-# Global storage for guest sessions (in production, use Redis)
-guest_sessions = {}
+logger = logging.getLogger(__name__)
+
+SESSIONS_PAGE_SIZE = 20
+SEARCH_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Guest sessions are kept out of the database (see chat/guest_store.py)
+def new_guest_session(analysis_type, title, messages=None):
+    return {
+        'analysis_type': analysis_type,
+        'title': title,
+        'messages': messages or [],
+        'created_at': 'Just now'
+    }
 
 # Authentication Views
 def login_view(request):
@@ -31,8 +66,9 @@ def login_view(request):
             user = authenticate(username=username, password=password)
             if user is not None:
                 login(request, user)
-                request.session['pendo_event'] = 'logged_in'
-                return redirect('dashboard')
+                response = redirect('dashboard')
+                set_flash(request, response, 'pendo_event', 'logged_in')
+                return response
         else:
             return render(request, 'chat/login.html', {'form': form, 'error': 'Invalid credentials'})
     
@@ -48,8 +84,9 @@ def register_view(request):
         if form.is_valid():
             user = form.save()
             login(request, user)
-            request.session['pendo_event'] = 'registered'
-            return redirect('dashboard')
+            response = redirect('dashboard')
+            set_flash(request, response, 'pendo_event', 'registered')
+            return response
         else:
             return render(request, 'chat/register.html', {'form': form})
     
@@ -68,160 +105,34 @@ def index(request):
 
 @login_required
 def dashboard(request):
-    # Get user's recent sessions
+    # Get user's recent sessions. Both are lazy: the template only runs them
+    # when its cached fragment for this user is missing or out of date
     recent_sessions = AnalysisSession.objects.filter(user=request.user)[:5]
-    session_count = AnalysisSession.objects.filter(user=request.user).count()
+    session_count = AnalysisSession.objects.filter(user=request.user).count
     
-    pendo_event = request.session.pop('pendo_event', None)
+    pendo_event = get_flash(request, 'pendo_event')
     
     context = {
         'recent_sessions': recent_sessions,
         'session_count': session_count,
         'pendo_event': pendo_event,
+        **fragment_context(request.user),
     }
-    return render(request, 'chat/dashboard.html', context)
+    response = render(request, 'chat/dashboard.html', context)
+    clear_flash(request, response, 'pendo_event')
+    return response
 
 # AI Service
-class AIService:
-    def __init__(self):
-        try:
-            genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-            self.model = genai.GenerativeModel('gemini-2.5-pro')
-        except:
-            try:
-                self.model = genai.GenerativeModel('models/gemini-pro')
-            except:
-                self.model = genai.GenerativeModel('gemini-1.0-pro')
-    
-    def get_analysis_questions(self, analysis_type):
-        analysis_prompts = {
-            'vitamin_minerals': """
-                You are a medical AI assistant analyzing vitamin and mineral intake.
-                Ask specific questions about daily food consumption, fruits and vegetables intake,
-                dairy and protein sources, supplement usage, and any deficiency symptoms.
-                Ask 3-5 targeted questions to assess potential deficiencies.
-            """,
-            'exercise_routine': """
-                Analyze weekly exercise habits. Ask about types of exercise, frequency, duration,
-                intensity levels, recovery practices, and fitness goals.
-            """,
-            'food_quality': """
-                Analyze weekly food quality. Ask about processed vs whole food consumption,
-                meal preparation habits, fruit and vegetable variety, and eating patterns.
-            """,
-            'sleep_quality': """
-                Analyze sleep quality and habits. Ask about sleep duration, bedtime routine,
-                sleep environment, factors affecting sleep, and energy levels upon waking.
-            """,
-            'stress_levels': """
-                Analyze stress levels and daily workload. Ask about daily stress triggers,
-                workload management, coping mechanisms, and work-life balance.
-            """,
-            'hydration': """
-                Analyze hydration levels. Ask about daily water intake, other fluid consumption,
-                signs of dehydration, and hydration habits throughout the day.
-            """,
-            'mental_wellbeing': """
-                Analyze mental well-being routine. Ask about daily mood patterns,
-                stress management techniques, social connections, and mental health practices.
-            """,
-            'energy_levels': """
-                Analyze daily energy levels. Ask about energy patterns throughout the day,
-                factors that boost or drain energy, and impact of sleep and nutrition.
-            """,
-            'meal_balance': """
-                Analyze weekly meal balance. Ask about macronutrient distribution,
-                meal timing, food variety, and portion sizes.
-            """,
-            'digestion': """
-                Analyze digestion and gut health. Ask about regular digestion patterns,
-                food intolerances, gut symptoms, and fiber intake.
-            """,
-            'calorie_intake': """
-                Analyze daily calorie intake. Ask about typical daily meals, snacking habits,
-                beverage calories, and hunger cues.
-            """,
-            'posture': """
-                Analyze posture and ergonomics. Ask about daily sitting/standing patterns,
-                workstation setup, and any discomfort or pain.
-            """,
-            'exercise_balance': """
-                Analyze cardio vs strength training balance. Ask about current exercise split,
-                fitness goals alignment, and recovery between sessions.
-            """,
-            'hormone_health': """
-                Analyze hormone-supporting lifestyle. Ask about sleep quality, stress management,
-                nutrition for hormonal balance, and environmental factors.
-            """,
-            'immune_health': """
-                Analyze immune-supporting habits. Ask about illness frequency, sleep and stress factors,
-                nutrition for immunity, and supplement usage.
-            """,
-            'productivity': """
-                Analyze daily productivity and burnout risk. Ask about workload, focus and concentration,
-                breaks and recovery, and motivation levels.
-            """,
-            'screen_time': """
-                Analyze screen time and blue-light exposure. Ask about daily screen usage patterns,
-                eye comfort, evening screen habits, and blue light protection.
-            """,
-            'environmental_toxins': """
-                Analyze household environmental toxins. Ask about cleaning product types,
-                air and water quality, and chemical exposure concerns.
-            """,
-            'caffeine': """
-                Analyze caffeine and stimulant consumption. Ask about daily caffeine sources and amounts,
-                timing of consumption, and effects on sleep and energy.
-            """,
-            'alcohol': """
-                Analyze alcohol intake and lifestyle balance. Ask about drinking frequency and quantity,
-                social drinking patterns, and effects on sleep and mood.
-            """,
-            'menstrual_health': """
-                Analyze menstrual cycle health. Ask about cycle regularity and symptoms,
-                PMS experiences, and impact on daily life.
-            """,
-            'mobility': """
-                Analyze daily mobility and flexibility. Ask about daily movement patterns,
-                stretching routine, and joint health.
-            """,
-            'chronic_pain': """
-                Analyze chronic pain or discomfort. Ask about pain locations and patterns,
-                triggers and relievers, and impact on daily activities.
-            """,
-            'default': """
-                Ask relevant questions to analyze this health aspect.
-                Focus on gathering specific, actionable information.
-            """
-        }
-        
-        prompt = analysis_prompts.get(analysis_type, analysis_prompts['default'])
-        
-        try:
-            response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            print(f"Gemini API Error: {e}")
-            return f"I'll help analyze your {analysis_type.replace('_', ' ')}. Could you tell me more about your current habits and any concerns you have?"
+FALLBACK_RESPONSE = "I appreciate you sharing that information. Could you tell me more about your current habits or concerns?"
+
 
+class AIService:
     def clean_basic_markdown(self, text):
         """Remove only problematic markdown, keep useful formatting"""
-        import re
-        
-        # Remove headers but keep the text
-        text = re.sub(r'^#+\s+', '', text, flags=re.MULTILINE)
-        
-        # Remove horizontal rules
-        text = re.sub(r'^\s*[-*_]{3,}\s*$', '', text, flags=re.MULTILINE)
-        
-        # Clean up extra whitespace
-        text = re.sub(r'\n\s*\n', '\n\n', text)
-        text = text.strip()
-        
-        return text
+        return clean_markdown(text)
     
-    def generate_response(self, conversation_history, analysis_type):
-        system_prompt = f"""
+    def system_prompt(self, analysis_type):
+        return f"""
         
         You are Doctor AI, a medical AI assistant currently analyzing the user's {analysis_type.replace('_', ' ')}.
         You are having a conversational assessment to gather information.
@@ -250,20 +161,113 @@ class AIService:
         - DO NOT use horizontal rules (---)
         - Keep formatting minimal and professional
         """
-        
+
+    def build_prompt(self, conversation_history, analysis_type):
+        return f"{self.system_prompt(analysis_type)}\n\nConversation history:\n{conversation_history}\n\nYour response:"
+
+    def response_cache_key(self, conversation_history, analysis_type):
+        return llm_cache.response_cache_key(
+            settings.GEMINI_MODEL, self.system_prompt(analysis_type), conversation_history
+        )
+
+    def flight_key(self, conversation_history, analysis_type):
+        # Identical prompts in flight share one call even when caching is off
+        return llm_cache.prompt_key(settings.GEMINI_MODEL, self.system_prompt(analysis_type), conversation_history)
+
+    def cache_reply(self, cache_key, text, model_name):
+        # A fallback model's reply is not what the cache key promises
+        if model_name == settings.GEMINI_MODEL:
+            llm_cache.store(cache_key, text)
+
+    def call_gemini(self, conversation_history, analysis_type, cache_key):
+        text, model_name = generate_text(self.build_prompt(conversation_history, analysis_type))
+        self.cache_reply(cache_key, text, model_name)
+        return text
+
+    async def acall_gemini(self, conversation_history, analysis_type, cache_key):
+        text, model_name = await agenerate_text(self.build_prompt(conversation_history, analysis_type))
+        await sync_to_async(self.cache_reply, thread_sensitive=False)(cache_key, text, model_name)
+        return text
+
+    def generate_response(self, conversation_history, analysis_type):
+        try:
+            cache_key = self.response_cache_key(conversation_history, analysis_type)
+            text = llm_cache.lookup(cache_key)
+            if text is None:
+                # Another worker's reply for the same prompt shows up in the cache
+                text = single_flight.run(
+                    self.flight_key(conversation_history, analysis_type),
+                    lambda: self.call_gemini(conversation_history, analysis_type, cache_key),
+                    shared_result=(lambda: llm_cache.peek(cache_key)) if cache_key else None,
+                )
+            return self.clean_basic_markdown(text)
+        except Exception as e:
+            logger.warning("Gemini API error: %s", e)
+            return FALLBACK_RESPONSE
+
+    async def generate_response_async(self, conversation_history, analysis_type):
         try:
-            full_prompt = f"{system_prompt}\n\nConversation history:\n{conversation_history}\n\nYour response:"
-            response = self.model.generate_content(full_prompt)
-            cleaned_response = self.clean_basic_markdown(response.text)
-            return cleaned_response
+            cache_key = self.response_cache_key(conversation_history, analysis_type)
+            # The cache backends are blocking (SQLite, Django cache)
+            text = await sync_to_async(llm_cache.lookup, thread_sensitive=False)(cache_key)
+            if text is None:
+                text = await single_flight.arun(
+                    self.flight_key(conversation_history, analysis_type),
+                    lambda: self.acall_gemini(conversation_history, analysis_type, cache_key),
+                    shared_result=(lambda: llm_cache.peek(cache_key)) if cache_key else None,
+                )
+            return self.clean_basic_markdown(text)
         except Exception as e:
-            print(f"Gemini API Error: {e}")
-            return "I appreciate you sharing that information. Could you tell me more about your current habits or concerns?"
+            logger.warning("Gemini API error: %s", e)
+            return FALLBACK_RESPONSE
 
+    def stream_response(self, conversation_history, analysis_type):
+        """Yield the raw reply text chunk by chunk as Gemini produces it.
+
+        A cached reply, or the reply to an identical prompt already streaming
+        in this process, is yielded as a single chunk. Only replies that
+        streamed to the end are cached.
+        """
+        cache_key = self.response_cache_key(conversation_history, analysis_type)
+        text = llm_cache.lookup(cache_key)
+        if text is not None:
+            yield text
+            return
+
+        flight_key = self.flight_key(conversation_history, analysis_type)
+        future, leader = single_flight.begin(flight_key)
+        if not leader:
+            try:
+                text = future.result(timeout=settings.SINGLE_FLIGHT_LEASE)
+            except Exception as e:
+                logger.warning("Gemini API error: %s", e)
+                text = None
+            yield text or FALLBACK_RESPONSE
+            return
+
+        chunks = []
+        model_name = None
+        text = None
+        try:
+            full_prompt = self.build_prompt(conversation_history, analysis_type)
+            for model_name, chunk in stream_text(full_prompt):
+                chunks.append(chunk)
+                yield chunk
+            text = ''.join(chunks)
+            self.cache_reply(cache_key, text, model_name)
+        except Exception as e:
+            logger.warning("Gemini API error: %s", e)
+            # Keep a partially streamed reply rather than appending the fallback to it
+            if not chunks:
+                yield FALLBACK_RESPONSE
+        finally:
+            # Followers of a failed or abandoned stream fall back on their own
+            single_flight.finish(flight_key, future, result=text)
 
 def chat_interface(request, session_id=None):
     """Main chat interface - accessible to both logged-in and guest users"""
     context = {
+        **fragment_context(),
         'session_id': session_id,
         'user_authenticated': request.user.is_authenticated,
         'initial_messages': [],
@@ -277,31 +281,38 @@ def chat_interface(request, session_id=None):
             session = AnalysisSession.objects.get(id=session_id, user=request.user)
             context['session_title'] = session.title
             context['analysis_type'] = session.analysis_type
+            context['session_report'] = session.report
+            context['session_report_html'] = render_markdown(session.report)
             
-            # Load messages for this session
-            messages = ChatMessage.objects.filter(session=session).order_by('timestamp')
-            context['initial_messages'] = [
-                {
-                    'content': msg.content,
-                    'is_user': msg.is_user,
-                    'timestamp': msg.timestamp.strftime('%H:%M')
-                }
-                for msg in messages
-            ]
-            context['message_count'] = len(context['initial_messages'])
+            # Only the latest messages; older ones are fetched from load_session on scroll
+            context['initial_messages'], context['has_older_messages'] = message_window(session)
+            context['message_count'] = session.message_count
             context['session_resumed'] = True
             
-            print(f"Loaded session {session_id} for user {request.user.username}")
-            # print(f"Initial messages: {context['initial_messages']}")
+            logger.info("Loaded session %s for user %s", session_id, request.user.username)
             
         except AnalysisSession.DoesNotExist:
             # Session doesn't exist or doesn't belong to user
             context['error'] = 'Session not found'
-            print(f"Session {session_id} not found for user {request.user.username}")
+            logger.info("Session %s not found for user %s", session_id, request.user.username)
     
     return render(request, 'chat/chat.html', context)
 
 
+def _create_analysis_session(user, analysis_type, title, questions, questions_html):
+    """Save a new session with its opening questions; returns the session id"""
+    with transaction.atomic():
+        session = AnalysisSession.objects.create(user=user, analysis_type=analysis_type, title=title)
+        message = ChatMessage.objects.create(
+            session=session,
+            content=questions,
+            content_html=questions_html,
+            is_user=False
+        )
+        record_messages(session, [message])
+    return session.id
+
+
 # API Views - Support both authenticated and guest users
 @csrf_exempt
 def start_analysis(request):
@@ -310,189 +321,642 @@ def start_analysis(request):
             data = json.loads(request.body)
             analysis_type = data.get('analysis_type')
             
-            ai_service = AIService()
-            questions = ai_service.get_analysis_questions(analysis_type)
+            questions = get_opening_questions(analysis_type)
+            questions_html = render_markdown(questions)
             
             if request.user.is_authenticated:
                 # Create database session for logged-in users
-                session = AnalysisSession.objects.create(
-                    user=request.user,
-                    analysis_type=analysis_type,
-                    title=f"{analysis_type.replace('_', ' ').title()} Analysis"
-                )
-                
-                # Save AI message to database
-                ChatMessage.objects.create(
-                    session=session,
-                    content=questions,
-                    is_user=False
+                session_id = _create_analysis_session(
+                    request.user,
+                    analysis_type,
+                    f"{analysis_type.replace('_', ' ').title()} Analysis",
+                    questions,
+                    questions_html
                 )
-                
-                session_id = session.id
                 session_type = 'authenticated'
             else:
-                # Create in-memory session for guest users
-                session_id = str(uuid.uuid4())
-                guest_sessions[session_id] = {
-                    'analysis_type': analysis_type,
-                    'title': f"{analysis_type.replace('_', ' ').title()} Analysis",
-                    'messages': [
-                        {'content': questions, 'is_user': False, 'timestamp': 'Now'}
-                    ],
-                    'created_at': 'Just now'
-                }
+                # Create guest session outside the database
+                session_id = get_guest_store().create(new_guest_session(
+                    analysis_type,
+                    f"{analysis_type.replace('_', ' ').title()} Analysis",
+                    [{'content': questions, 'is_user': False, 'timestamp': 'Now'}]
+                ))
+                record_guest(analysis_type, sessions_started=1, messages=1)
                 session_type = 'guest'
             
             return JsonResponse({
                 'session_id': session_id,
                 'session_type': session_type,
                 'ai_response': questions,
-                'title': guest_sessions[session_id]['title'] if session_type == 'guest' else f"{analysis_type.replace('_', ' ').title()} Analysis"
+                'ai_html': questions_html,
+                'title': f"{analysis_type.replace('_', ' ').title()} Analysis"
             })
             
         except Exception as e:
-            print(f"Error in start_analysis: {e}")
+            logger.exception("Error in start_analysis")
             return JsonResponse({'error': str(e)}, status=500)
 
 
+# What a turn reads from the session
+TURN_SESSION_FIELDS = (
+    'id', 'user', 'analysis_type', 'summary', 'summary_message_count', 'summary_source_tokens', 'archived_at',
+)
+
+
+def _begin_turn(request, session_id, user_message):
+    """Read what a turn needs and build the conversation history for the AI.
+
+    Nothing is written here: _finish_turn saves the user's message together
+    with the reply, so no transaction is open while Gemini is called and a
+    failed turn leaves nothing half saved.
+    """
+    if request.user.is_authenticated:
+        if session_id:
+            session = AnalysisSession.objects.only(*TURN_SESSION_FIELDS).get(id=session_id, user=request.user)
+            # Messages already folded into the running summary are not read again
+            if session.archived_at:
+                messages = [
+                    (row['is_user'], row['content']) for row in all_messages(session.pk)
+                ][session.summary_message_count:]
+            else:
+                messages = list(
+                    ChatMessage.objects.filter(session=session)
+                    .order_by('timestamp', 'id')
+                    .values_list('is_user', 'content')[session.summary_message_count:]
+                )
+        else:
+            # Saved with the first exchange
+            session = AnalysisSession(user=request.user, analysis_type='general', title='General Chat')
+            messages = []
+        return _authenticated_turn(session, messages, user_message)
+
+    return _begin_turn_guest(session_id, user_message)
+
+
+def _authenticated_turn(session, messages, user_message):
+    messages.append((True, user_message))
+    conversation_history, left_out = build_conversation_history(
+        messages, session.summary, session.summary_source_tokens
+    )
+
+    return {
+        'session': session,
+        'session_id': session.id,
+        'session_type': 'authenticated',
+        'analysis_type': session.analysis_type,
+        'user_message': user_message,
+        'conversation_history': conversation_history,
+        'unsummarized_count': len(messages) + 1,
+        'left_out': left_out,
+    }
+
+
+def _begin_turn_guest(session_id, user_message):
+    guest_store = get_guest_store()
+    guest_session = guest_store.get(session_id) if session_id else None
+    new_session = guest_session is None
+    if new_session:
+        session_id = str(uuid.uuid4())
+        guest_session = new_guest_session('general', 'General Chat')
+
+    messages = [
+        (msg['is_user'], msg['content'])
+        for msg in guest_session['messages'][guest_session.get('summary_message_count', 0):]
+    ]
+    messages.append((True, user_message))
+    conversation_history, left_out = build_conversation_history(
+        messages, guest_session.get('summary', ''), guest_session.get('summary_source_tokens', 0)
+    )
+
+    return {
+        'session': None,
+        'session_id': session_id,
+        'session_type': 'guest',
+        'guest_session': guest_session,
+        'new_session': new_session,
+        'analysis_type': guest_session['analysis_type'],
+        'user_message': user_message,
+        'conversation_history': conversation_history,
+        'unsummarized_count': len(messages) + 1,
+        'left_out': left_out,
+    }
+
+
+def _finish_turn(turn, ai_response, ai_html):
+    """Save the user's message and the reply of a turn started with _begin_turn.
+
+    For a saved session both messages, the session's counters and its
+    updated_at are written in one transaction: a bulk insert and one update.
+    An archived session gets its older messages back first (chat.archive).
+    """
+    session = turn['session']
+    if session is not None:
+        with transaction.atomic():
+            if session.pk is None:
+                session.save()
+            elif session.archived_at:
+                restore(session.pk)
+            messages = ChatMessage.objects.bulk_create([
+                ChatMessage(session=session, content=turn['user_message'], is_user=True),
+                ChatMessage(session=session, content=ai_response, content_html=ai_html, is_user=False),
+            ])
+            record_messages(session, messages)
+        turn['session_id'] = session.pk
+        maybe_compact_session(turn['session_id'], turn['unsummarized_count'], turn['left_out'])
+    else:
+        # Re-read the session: a background compaction may have updated it meanwhile
+        guest_store = get_guest_store()
+        guest_session = guest_store.get(turn['session_id']) or turn['guest_session']
+        guest_session['messages'] += [
+            {'content': turn['user_message'], 'is_user': True, 'timestamp': 'Now'},
+            {'content': ai_response, 'is_user': False, 'timestamp': 'Now'},
+        ]
+        guest_store.save(turn['session_id'], guest_session)
+        # Guest sessions never reach the tables chat.rollups reads
+        record_guest(
+            turn['analysis_type'], sessions_started=int(turn['new_session']), messages=2, user_messages=1,
+        )
+        maybe_compact_guest_session(turn['session_id'], turn['unsummarized_count'], turn['left_out'])
+
+
 @csrf_exempt
 def send_message(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            session_id = data.get('session_id')
             user_message = data.get('message')
-            session_type = data.get('session_type', 'guest')
 
             if not user_message:
                 return JsonResponse({'error': 'Message is required'}, status=400)
 
-            if request.user.is_authenticated:
-                if session_id:
-                    session = AnalysisSession.objects.get(id=session_id, user=request.user)
-                else:
-                    session = AnalysisSession.objects.create(
-                        user=request.user,
-                        analysis_type='general',
-                        title='General Chat'
-                    )
-
-                ChatMessage.objects.create(
-                    session=session,
-                    content=user_message,
-                    is_user=True
-                )
-
-                messages = ChatMessage.objects.filter(session=session).order_by('timestamp')
-                conversation_history = "\n".join([
-                    f"{'User' if msg.is_user else 'Doctor AI'}: {msg.content}"
-                    for msg in messages
-                ])
-
-                analysis_type = session.analysis_type
-                session_id = session.id
-                session_type = 'authenticated'
-
-            else:
-                if not session_id or session_id not in guest_sessions:
-                    session_id = str(uuid.uuid4())
-                    guest_sessions[session_id] = {
-                        'analysis_type': 'general',
-                        'title': 'General Chat',
-                        'messages': [],
-                        'created_at': 'Just now'
-                    }
-
-                guest_sessions[session_id]['messages'].append({
-                    'content': user_message,
-                    'is_user': True,
-                    'timestamp': 'Now'
-                })
-
-                messages = guest_sessions[session_id]['messages']
-                conversation_history = "\n".join([
-                    f"{'User' if msg['is_user'] else 'Doctor AI'}: {msg['content']}"
-                    for msg in messages
-                ])
-
-                analysis_type = guest_sessions[session_id]['analysis_type']
-                session_type = 'guest'
+            turn = _begin_turn(request, data.get('session_id'), user_message)
 
             ai_service = AIService()
-            ai_response = ai_service.generate_response(conversation_history, analysis_type)
+            ai_response = ai_service.generate_response(turn['conversation_history'], turn['analysis_type'])
+            ai_html = render_markdown(ai_response)
 
-            if request.user.is_authenticated:
-                ChatMessage.objects.create(
-                    session=session,
-                    content=ai_response,
-                    is_user=False
-                )
-                session.save()
-            else:
-                guest_sessions[session_id]['messages'].append({
-                    'content': ai_response,
-                    'is_user': False,
-                    'timestamp': 'Now'
-                })
+            _finish_turn(turn, ai_response, ai_html)
 
             return JsonResponse({
                 'ai_response': ai_response,
-                'session_id': session_id,
-                'session_type': session_type
+                'ai_html': ai_html,
+                'session_id': turn['session_id'],
+                'session_type': turn['session_type']
             })
 
         except AnalysisSession.DoesNotExist:
             return JsonResponse({'error': 'Session not found'}, status=404)
         except Exception as e:
-            print(f"Error in send_message: {e}")
+            logger.exception("Error in send_message")
             return JsonResponse({'error': str(e)}, status=500)
 
     return JsonResponse({'error': 'Only POST allowed'}, status=405)
 
 
+def _sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+@csrf_exempt
+def send_message_stream(request):
+    """Same as send_message, but streams the AI reply as Server-Sent Events.
+
+    Each chunk is sent as ``{"chunk": ..., "html": ..., "tail": ...}`` as soon
+    as Gemini produces it: ``html`` is the rendered HTML of the blocks the
+    chunk finished, to append, and ``tail`` renders the block still in
+    progress. The reply is saved once the stream completes and a final
+    ``{"done": true, ...}`` event carries the cleaned full response, its HTML
+    and the session details.
+
+    If the reply fails once streaming has begun, the stream ends with an
+    ``event: error`` frame, ``{"error": ...}``. Whatever part of the reply was
+    already streamed is saved with the user's message, also when the client
+    disconnects mid-reply; the error frame then carries the session details.
+    A turn that failed before any chunk was streamed is not saved.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        user_message = data.get('message')
+
+        if not user_message:
+            return JsonResponse({'error': 'Message is required'}, status=400)
+
+        turn = _begin_turn(request, data.get('session_id'), user_message)
+
+    except AnalysisSession.DoesNotExist:
+        return JsonResponse({'error': 'Session not found'}, status=404)
+    except Exception as e:
+        logger.exception("Error in send_message_stream")
+        return JsonResponse({'error': str(e)}, status=500)
+
+    def event_stream():
+        ai_service = AIService()
+        chunks = []
+        markdown = MarkdownStream()
+        saved = False
+
+        def save(ai_response):
+            # Attempted once, whatever the outcome
+            nonlocal saved
+            saved = True
+            ai_html = render_markdown(ai_response)
+            _finish_turn(turn, ai_response, ai_html)
+            return ai_html
+
+        def save_partial():
+            try:
+                save(ai_service.clean_basic_markdown(''.join(chunks)))
+                return True
+            except Exception:
+                logger.exception("Could not save a partial reply")
+                return False
+
+        try:
+            for chunk in ai_service.stream_response(turn['conversation_history'], turn['analysis_type']):
+                chunks.append(chunk)
+                html, tail = markdown.feed(chunk)
+                yield _sse_event({'chunk': chunk, 'html': html, 'tail': tail})
+
+            ai_response = ai_service.clean_basic_markdown(''.join(chunks))
+            ai_html = save(ai_response)
+
+            yield _sse_event({
+                'done': True,
+                'ai_response': ai_response,
+                'ai_html': ai_html,
+                'session_id': turn['session_id'],
+                'session_type': turn['session_type']
+            })
+        except Exception as e:
+            logger.exception("Error streaming a reply in send_message_stream")
+            error = {'error': str(e)}
+            if not saved and chunks and save_partial():
+                error.update(session_id=turn['session_id'], session_type=turn['session_type'])
+            yield 'event: error\n' + _sse_event(error)
+        finally:
+            # The client went away mid-reply: keep what it was shown
+            if not saved and chunks:
+                save_partial()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def encode_sessions_cursor(updated_at, session_id):
+    """Opaque keyset cursor pointing just past (updated_at, id)"""
+    raw = f"{updated_at.isoformat()}|{session_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_sessions_cursor(cursor):
+    """Return (updated_at, id) from a cursor, or raise ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        updated_at, session_id = raw.split('|')
+        return datetime.fromisoformat(updated_at), int(session_id)
+    except (UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(str(e))
+
+
 @login_required
 @csrf_exempt
 def get_user_sessions(request):
-    """Get all sessions for the current user (authenticated only)"""
-    sessions = AnalysisSession.objects.filter(user=request.user).order_by('-updated_at')
-    sessions_data = []
-    
-    for session in sessions:
-        sessions_data.append({
-            'id': session.id,
-            'title': session.title,
-            'analysis_type': session.analysis_type,
-            'created_at': session.created_at.strftime('%b %d, %Y %H:%M'),
-            'message_count': session.messages.count(),
-            'is_completed': session.is_completed
-        })
-    
-    return JsonResponse({'sessions': sessions_data})
+    """Get a page of sessions for the current user (authenticated only).
+
+    Sessions are ordered newest first. Pass the returned ``next_cursor`` as
+    ``?cursor=`` to get the next page; it is null on the last page.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', SESSIONS_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+
+    sessions = AnalysisSession.objects.filter(user=request.user)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            updated_at, session_id = decode_sessions_cursor(cursor)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        sessions = sessions.filter(
+            Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=session_id)
+        )
+
+    # One query on the session table for the page; one extra row tells us if there is more
+    rows = list(
+        sessions.order_by('-updated_at', '-id').values(
+            'id', 'title', 'analysis_type', 'created_at', 'updated_at', 'is_completed',
+            'message_count', 'last_message_at', 'last_message_preview',
+        )[:limit + 1]
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_sessions_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+
+    sessions_data = [{
+        'id': row['id'],
+        'title': row['title'],
+        'analysis_type': row['analysis_type'],
+        'created_at': row['created_at'].strftime('%b %d, %Y %H:%M'),
+        'message_count': row['message_count'],
+        'last_message_at': row['last_message_at'].isoformat() if row['last_message_at'] else None,
+        'last_message_preview': row['last_message_preview'],
+        'is_completed': row['is_completed']
+    } for row in rows]
+
+    return JsonResponse({'sessions': sessions_data, 'next_cursor': next_cursor})
+
+def message_window(session, before=None, limit=None):
+    """The latest ``limit`` messages of a session, oldest first, optionally before a message id.
+
+    Returns (messages, has_more). The query walks the (session, timestamp)
+    index backwards from the cursor, so its cost does not grow with the
+    length of the session. An archived session is read from its archive.
+    """
+    limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+    if session.archived_at:
+        rows = all_messages(session.pk)
+        if before is not None:
+            ids = [row['id'] for row in rows]
+            rows = rows[:ids.index(before)] if before in ids else []
+        rows = rows[::-1][:limit + 1]
+    else:
+        messages = ChatMessage.objects.filter(session=session)
+        if before is not None:
+            before_timestamp = Subquery(
+                ChatMessage.objects.filter(pk=before, session=session).values('timestamp')
+            )
+            messages = messages.filter(timestamp__lte=before_timestamp).filter(
+                Q(timestamp__lt=before_timestamp) | Q(id__lt=before)
+            )
+        rows = list(
+            messages.order_by('-timestamp', '-id').values('id', 'content', 'content_html', 'is_user', 'timestamp')[:limit + 1]
+        )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return [
+        {
+            'id': row['id'],
+            'content': row['content'],
+            # Rendered when saved; a reply saved without its HTML is rendered here
+            'content_html': '' if row['is_user'] else row['content_html'] or render_markdown(row['content']),
+            'is_user': row['is_user'],
+            'timestamp': row['timestamp'].strftime('%H:%M')
+        }
+        for row in rows
+    ], has_more
+
 
 @login_required
 @csrf_exempt
 def load_session(request, session_id):
-    """Load a specific session and its messages (authenticated only)"""
+    """Load a specific session and a window of its messages (authenticated only).
+
+    Returns the latest messages; pass ``?before=<message id>`` for the page
+    before that message. Responses carry an ETag and Last-Modified, and an
+    unchanged session answers a conditional GET with 304 Not Modified.
+    """
     try:
-        session = AnalysisSession.objects.get(id=session_id, user=request.user)
-        messages = ChatMessage.objects.filter(session=session).order_by('timestamp')
-        
-        messages_data = []
-        for message in messages:
-            messages_data.append({
-                'content': message.content,
-                'is_user': message.is_user,
-                'timestamp': message.timestamp.strftime('%H:%M')
-            })
-        
-        return JsonResponse({
+        session = AnalysisSession.objects.only('id', 'title', 'analysis_type', 'report', 'updated_at', 'archived_at').get(
+            id=session_id, user=request.user
+        )
+    except AnalysisSession.DoesNotExist:
+        return JsonResponse({'error': 'Session not found'}, status=404)
+
+    try:
+        before = int(request.GET['before']) if request.GET.get('before') else None
+        limit = min(max(int(request.GET.get('limit', settings.CHAT_HISTORY_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid before or limit'}, status=400)
+
+    # Every new message saves the session, which moves updated_at
+    etag = quote_etag(f"{session.id}-{session.updated_at.timestamp()}")
+    last_modified = int(session.updated_at.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        messages_data, has_more = message_window(session, before=before, limit=limit)
+        response = JsonResponse({
             'session': {
                 'id': session.id,
                 'title': session.title,
-                'analysis_type': session.analysis_type
+                'analysis_type': session.analysis_type,
+                'report': session.report or None,
+                'report_html': render_markdown(session.report) or None
             },
-            'messages': messages_data
+            'messages': messages_data,
+            'has_more': has_more
         })
-        
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def search_messages(request):
+    """Full-text search of the current user's messages (authenticated only).
+
+    Every word of ``?q=`` must match. Results come best first, each with an
+    HTML ``snippet`` that marks the matches. Pass the returned ``next_page``
+    as ``?page=`` for more; it is null on the last page.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', SEARCH_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit or page'}, status=400)
+    if not search.is_supported():
+        return JsonResponse({'error': 'Search is not available on this server'}, status=501)
+
+    results, has_more = search.search_messages(request.user, request.GET.get('q', ''), limit, (page - 1) * limit)
+    return JsonResponse({'results': results, 'next_page': page + 1 if has_more else None})
+
+
+@login_required
+@csrf_exempt
+def request_report(request, session_id):
+    """Queue the comprehensive analysis report for a session (authenticated only)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+
+    try:
+        session = AnalysisSession.objects.get(id=session_id, user=request.user)
     except AnalysisSession.DoesNotExist:
-        return JsonResponse({'error': 'Session not found'}, status=404)
\ No newline at end of file
+        return JsonResponse({'error': 'Session not found'}, status=404)
+
+    job = submit_report(session)
+    return JsonResponse(job_payload(job), status=202)
+
+
+@login_required
+def report_status(request, job_id):
+    """Status of a queued report, with the report once it is ready (authenticated only)"""
+    try:
+        job = ReportJob.objects.select_related('session').get(id=job_id, session__user=request.user)
+    except ReportJob.DoesNotExist:
+        return JsonResponse({'error': 'Report not found'}, status=404)
+
+    return JsonResponse(job_payload(job))
+
+
+@staff_member_required
+def gemini_status(request):
+    """Circuit breaker state of each Gemini model, as seen by the worker serving the request"""
+    return JsonResponse({
+        'pid': os.getpid(),
+        'model_chain': model_chain(),
+        'breakers': get_breaker_stats(),
+        'single_flight': single_flight.get_single_flight_stats(),
+    })
+
+
+def metrics_view(request):
+    """Prometheus metrics of every worker on the host (see chat/metrics.py).
+
+    Needs ``Authorization: Bearer <METRICS_TOKEN>`` when METRICS_TOKEN is set,
+    and a staff login otherwise.
+    """
+    if not settings.METRICS_ENABLED:
+        return HttpResponse(status=404)
+    if settings.METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied.encode(), settings.METRICS_TOKEN.encode()):
+            return HttpResponseForbidden()
+    elif not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Async API Views - native coroutines for ASGI deployments (see Procfile.asgi).
+# Under WSGI these still work, but each call runs on its own event loop.
+@csrf_exempt
+async def start_analysis_async(request):
+    """Async version of start_analysis"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        analysis_type = data.get('analysis_type')
+        title = f"{analysis_type.replace('_', ' ').title()} Analysis"
+
+        questions = await sync_to_async(get_opening_questions)(analysis_type)
+        questions_html = render_markdown(questions)
+
+        user = await request.auser()
+        if user.is_authenticated:
+            session_id = await sync_to_async(_create_analysis_session)(user, analysis_type, title, questions, questions_html)
+            session_type = 'authenticated'
+        else:
+            session_id = await sync_to_async(get_guest_store().create)(new_guest_session(
+                analysis_type,
+                title,
+                [{'content': questions, 'is_user': False, 'timestamp': 'Now'}]
+            ))
+            await sync_to_async(record_guest)(analysis_type, sessions_started=1, messages=1)
+            session_type = 'guest'
+
+        return JsonResponse({
+            'session_id': session_id,
+            'session_type': session_type,
+            'ai_response': questions,
+            'ai_html': questions_html,
+            'title': title
+        })
+
+    except Exception as e:
+        logger.exception("Error in start_analysis_async")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+async def _abegin_turn(user, session_id, user_message):
+    """Async version of _begin_turn"""
+    if not user.is_authenticated:
+        return await sync_to_async(_begin_turn_guest)(session_id, user_message)
+
+    if session_id:
+        session = await AnalysisSession.objects.only(*TURN_SESSION_FIELDS).aget(id=session_id, user=user)
+        if session.archived_at:
+            messages = [
+                (row['is_user'], row['content']) for row in await sync_to_async(all_messages)(session.pk)
+            ][session.summary_message_count:]
+        else:
+            messages = [
+                message
+                async for message in ChatMessage.objects.filter(session=session)
+                .order_by('timestamp', 'id')
+                .values_list('is_user', 'content')[session.summary_message_count:]
+            ]
+    else:
+        session = AnalysisSession(user=user, analysis_type='general', title='General Chat')
+        messages = []
+    return _authenticated_turn(session, messages, user_message)
+
+
+async def _afinish_turn(turn, ai_response, ai_html):
+    """Async version of _finish_turn"""
+    # transaction.atomic() is not available to async code
+    await sync_to_async(_finish_turn)(turn, ai_response, ai_html)
+
+
+@csrf_exempt
+async def send_message_async(request):
+    """Async version of send_message"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        user_message = data.get('message')
+
+        if not user_message:
+            return JsonResponse({'error': 'Message is required'}, status=400)
+
+        user = await request.auser()
+        turn = await _abegin_turn(user, data.get('session_id'), user_message)
+
+        ai_service = AIService()
+        ai_response = await ai_service.generate_response_async(turn['conversation_history'], turn['analysis_type'])
+        ai_html = render_markdown(ai_response)
+
+        await _afinish_turn(turn, ai_response, ai_html)
+
+        return JsonResponse({
+            'ai_response': ai_response,
+            'ai_html': ai_html,
+            'session_id': turn['session_id'],
+            'session_type': turn['session_type']
+        })
+
+    except AnalysisSession.DoesNotExist:
+        return JsonResponse({'error': 'Session not found'}, status=404)
+    except Exception as e:
+        logger.exception("Error in send_message_async")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@login_required
+@csrf_exempt
+async def generate_report_async(request, session_id):
+    """Async version of request_report: queues the report for the report worker"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+
+    user = await request.auser()
+    try:
+        session = await AnalysisSession.objects.aget(id=session_id, user=user)
+    except AnalysisSession.DoesNotExist:
+        return JsonResponse({'error': 'Session not found'}, status=404)
+
+    # transaction.atomic() is not available to async code
+    job = await sync_to_async(submit_report)(session)
+    return JsonResponse(job_payload(job), status=202)
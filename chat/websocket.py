@@ -0,0 +1,275 @@
+"""
+WebSocket chat transport (ASGI deployments only, see doctor_ai/asgi.py).
+
+A chat tab keeps one connection open for its conversation, on
+``/ws/chat/<session id>/`` or on ``/ws/chat/`` for a conversation that is
+not saved yet (it is bound to the new session after the first turn). The
+HTTP endpoints stay the fallback; under WSGI the connection simply fails
+and the page uses them.
+
+Every frame is a JSON object with a ``type``. The client sends:
+
+- ``{"type": "message", "message": ...}``: a chat turn
+- ``{"type": "report"}``: queue the session's analysis report
+- ``{"type": "ping"}``
+
+and the server answers with:
+
+- ``typing``: ``{"active": true/false}`` around the AI reply
+- ``chunk``: ``{"chunk", "html", "tail"}`` as in send_message_stream
+- ``done``: the saved reply, ``{"ai_response", "ai_html", "session_id", "session_type"}``
+- ``report_queued`` / ``report_ready``: the job_payload() of the report job
+- ``error``: ``{"request", "error", "status"}``
+- ``pong``
+
+Turns go through the same _abegin_turn / _afinish_turn as the HTTP views,
+so a turn is saved once the reply is complete, even if the tab has gone
+away meanwhile. One turn runs at a time per connection.
+
+There is no channel layer: the socket watches a queued report by reading
+its job row every CHAT_SOCKET_REPORT_POLL seconds and pushes it once the
+worker has finished, so the browser no longer polls over HTTP.
+"""
+import asyncio
+import json
+import logging
+import re
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.db import close_old_connections
+from django.http import parse_cookie
+from django.http.request import split_domain_port, validate_host
+from django.utils.http import is_same_domain
+
+from .models import AnalysisSession, ReportJob
+from .rendering import MarkdownStream, render_markdown
+from .report_jobs import ACTIVE_STATUSES, job_payload, submit_report
+from .views import AIService, _abegin_turn, _afinish_turn
+
+logger = logging.getLogger(__name__)
+
+PATH_RE = re.compile(r'^/ws/chat/(?:(?P<session_id>[\w-]+)/)?$')
+
+# Application-defined close codes (4000-4999)
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI application for ``websocket`` scopes"""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    match = PATH_RE.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    if not _origin_allowed(scope):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+    await ChatSocket(scope, receive, send, match['session_id']).run()
+
+
+def _headers(scope):
+    return {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+
+
+def _origin_allowed(scope):
+    """Browsers send cookies with cross-site WebSocket handshakes, so the
+    Origin must be this host or one of CSRF_TRUSTED_ORIGINS"""
+    headers = _headers(scope)
+    host = headers.get('host', '')
+    domain, _port = split_domain_port(host)
+    if not domain or not validate_host(domain, settings.ALLOWED_HOSTS):
+        return False
+    origin = headers.get('origin')
+    if origin is None:
+        # Not a browser
+        return True
+    origin = urlsplit(origin)
+    if origin.netloc == host:
+        return True
+    for trusted in map(urlsplit, settings.CSRF_TRUSTED_ORIGINS):
+        # "https://*.example.com" trusts every subdomain, as for CSRF
+        if trusted.scheme == origin.scheme and is_same_domain(origin.netloc, trusted.netloc.replace('*', '', 1)):
+            return True
+    return False
+
+
+async def _authenticate(scope):
+    """The user of the session cookie sent with the handshake"""
+    session_key = parse_cookie(_headers(scope).get('cookie', '')).get(settings.SESSION_COOKIE_NAME)
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    return await auth.aget_user(SimpleNamespace(session=session))
+
+
+class ChatSocket:
+    """One accepted connection"""
+
+    def __init__(self, scope, receive, send, session_id):
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self.session_id = session_id
+        self.closed = False
+        self.turn = None
+        self.report_watch = None
+
+    async def run(self):
+        await self._send({'type': 'websocket.accept'})
+        try:
+            while True:
+                event = await self.receive()
+                if event['type'] == 'websocket.disconnect':
+                    break
+                if event['type'] == 'websocket.receive':
+                    await self.dispatch(event.get('text') or event.get('bytes', b'').decode('utf-8', 'replace'))
+        finally:
+            self.closed = True
+            # A running turn finishes and is saved; only the report watch is dropped
+            if self.report_watch is not None:
+                self.report_watch.cancel()
+            if self.turn is not None:
+                await asyncio.shield(self.turn)
+
+    async def send(self, type, **data):
+        if self.closed:
+            return
+        try:
+            await self._send({'type': 'websocket.send', 'text': json.dumps({'type': type, **data})})
+        except Exception:
+            # The client went away; the receive loop sees the disconnect
+            self.closed = True
+
+    async def error(self, request, error, status):
+        """Errors name the request they answer and the HTTP status the same error gets from the API"""
+        await self.send('error', request=request, error=error, status=status)
+
+    async def dispatch(self, text):
+        if len(text) > settings.DATA_UPLOAD_MAX_MEMORY_SIZE:
+            await self.error(None, 'Message too large', 413)
+            return
+        try:
+            data = json.loads(text)
+        except ValueError:
+            await self.error(None, 'Invalid JSON', 400)
+            return
+        kind = data.get('type') if isinstance(data, dict) else None
+
+        if kind == 'ping':
+            await self.send('pong')
+        elif kind == 'message':
+            if not data.get('message'):
+                await self.error(kind, 'Message is required', 400)
+            elif self.turn is not None:
+                await self.error(kind, 'A reply is still in progress', 409)
+            else:
+                self.turn = asyncio.create_task(self.chat_turn(data['message']))
+                self.turn.add_done_callback(self._turn_done)
+        elif kind == 'report':
+            await self.request_report()
+        else:
+            await self.error(kind, 'Unknown message type', 400)
+
+    def _turn_done(self, task):
+        self.turn = None
+
+    async def chat_turn(self, user_message):
+        await sync_to_async(close_old_connections)()
+        try:
+            user = await _authenticate(self.scope)
+            turn = await _abegin_turn(user, self.session_id, user_message)
+        except AnalysisSession.DoesNotExist:
+            await self.error('message', 'Session not found', 404)
+            return
+        except Exception as e:
+            logger.exception("Error in websocket chat turn")
+            await self.error('message', str(e), 500)
+            return
+
+        await self.send('typing', active=True)
+        ai_service = AIService()
+        chunks = []
+        markdown = MarkdownStream()
+        try:
+            async for chunk in _stream_in_thread(
+                ai_service.stream_response, turn['conversation_history'], turn['analysis_type']
+            ):
+                if not chunks:
+                    await self.send('typing', active=False)
+                chunks.append(chunk)
+                html, tail = markdown.feed(chunk)
+                await self.send('chunk', chunk=chunk, html=html, tail=tail)
+
+            ai_response = ai_service.clean_basic_markdown(''.join(chunks))
+            ai_html = render_markdown(ai_response)
+            await _afinish_turn(turn, ai_response, ai_html)
+        except Exception as e:
+            logger.exception("Error in websocket chat turn")
+            await self.send('typing', active=False)
+            await self.error('message', str(e), 500)
+            return
+        finally:
+            await sync_to_async(close_old_connections)()
+
+        self.session_id = turn['session_id']
+        await self.send(
+            'done',
+            ai_response=ai_response,
+            ai_html=ai_html,
+            session_id=turn['session_id'],
+            session_type=turn['session_type'],
+        )
+
+    async def request_report(self):
+        user = await _authenticate(self.scope)
+        if not user.is_authenticated or not self.session_id:
+            await self.error('report', 'Reports are only available for saved sessions', 403)
+            return
+        try:
+            session = await AnalysisSession.objects.only('id').aget(id=self.session_id, user=user)
+        except (AnalysisSession.DoesNotExist, ValueError):
+            await self.error('report', 'Session not found', 404)
+            return
+
+        job = await sync_to_async(submit_report)(session)
+        await self.send('report_queued', **await sync_to_async(job_payload)(job))
+        if self.report_watch is None or self.report_watch.done():
+            self.report_watch = asyncio.create_task(self.watch_report(job.pk))
+
+    async def watch_report(self, job_id):
+        """Push the report once the worker has finished its job"""
+        while True:
+            await asyncio.sleep(settings.CHAT_SOCKET_REPORT_POLL)
+            job = await ReportJob.objects.select_related('session').aget(pk=job_id)
+            if job.status not in ACTIVE_STATUSES:
+                break
+        await self.send('report_ready', **await sync_to_async(job_payload)(job))
+
+
+async def _stream_in_thread(generate, *args):
+    """Iterate a blocking generator in a worker thread, yielding as items arrive"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def produce():
+        try:
+            for item in generate(*args):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = asyncio.create_task(asyncio.to_thread(produce))
+    while (item := await queue.get()) is not done:
+        if isinstance(item, Exception):
+            await producer
+            raise item
+        yield item
+    await producer
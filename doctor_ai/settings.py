@@ -93,7 +93,8 @@ WSGI_APPLICATION = 'doctor_ai.wsgi.application'
 DATABASES = {
     "default": dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600,
+        # Use 0 under ASGI: persistent connections are not reused across async requests
+        conn_max_age=int(os.getenv("DB_CONN_MAX_AGE", "600")),
     )
 }
 
@@ -147,8 +148,166 @@ LOGOUT_REDIRECT_URL = '/login/'
 
 # Session settings
 SESSION_COOKIE_AGE = 1209600  # 2 weeks
-SESSION_SAVE_EVERY_REQUEST = True
+# Sessions are rewritten only when less than SESSION_REFRESH_THRESHOLD seconds
+# of their lifetime are left (see chat/session_backend.py), not on every request
+SESSION_ENGINE = os.getenv("SESSION_ENGINE", "chat.session_backend")
+SESSION_SAVE_EVERY_REQUEST = os.getenv("SESSION_SAVE_EVERY_REQUEST", "False") == "True"
+SESSION_REFRESH_THRESHOLD = int(os.getenv("SESSION_REFRESH_THRESHOLD", str(SESSION_COOKIE_AGE - 60 * 60 * 24)))
+# One-shot flags such as the dashboard's Pendo event (see chat/flash.py): "cookie" or "cache"
+FLASH_STORE = os.getenv("FLASH_STORE", "cookie")
+FLASH_MAX_AGE = int(os.getenv("FLASH_MAX_AGE", "300"))
 
-STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+# collectstatic fingerprints every file and writes gzip and Brotli variants
+# next to it; WhiteNoise serves the fingerprinted names with a far-future,
+# immutable Cache-Control header
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
+
+# Gemini settings
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "")  # "grpc" (default) or "rest"; async views make REST calls in a thread
+# Models tried in order when GEMINI_MODEL fails, times out or has its circuit open
+GEMINI_FALLBACK_MODELS = [m for m in os.getenv("GEMINI_FALLBACK_MODELS", "gemini-2.5-flash").split(",") if m]
+# Seconds one Gemini call may take across every model in the chain, and per model
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "25"))
+GEMINI_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "15"))
+GEMINI_MIN_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_MIN_ATTEMPT_TIMEOUT", "2"))
+# Circuit breaker (see chat/circuit_breaker.py)
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+
+# Offline Gemini stand-in for load tests (see chat/stub_llm.py)
+GEMINI_STUB = os.getenv("GEMINI_STUB", "False") == "True"
+GEMINI_STUB_LATENCY = float(os.getenv("GEMINI_STUB_LATENCY", "1.5"))
+GEMINI_STUB_LATENCY_SIGMA = float(os.getenv("GEMINI_STUB_LATENCY_SIGMA", "0.5"))
+GEMINI_STUB_ERROR_RATE = float(os.getenv("GEMINI_STUB_ERROR_RATE", "0"))
+GEMINI_STUB_STREAM_CHUNKS = int(os.getenv("GEMINI_STUB_STREAM_CHUNKS", "8"))
+GEMINI_STUB_REPLY_CHARS = int(os.getenv("GEMINI_STUB_REPLY_CHARS", "600"))
+
+# Conversation context compaction (see chat/context.py)
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "4000"))
+CHAT_CONTEXT_RECENT_TURNS = int(os.getenv("CHAT_CONTEXT_RECENT_TURNS", "6"))
+CHAT_CONTEXT_FOLD_MESSAGES = int(os.getenv("CHAT_CONTEXT_FOLD_MESSAGES", "4"))
+CHAT_CONTEXT_BACKGROUND = os.getenv("CHAT_CONTEXT_BACKGROUND", "True") == "True"
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gemini-2.5-flash")
+
+# Cache shared by all worker processes on a host. Point CACHE_BACKEND and
+# CACHE_LOCATION at e.g. Redis or Memcached to share it across hosts.
+# Template fragments get their own cache, so a burst of dashboard renders
+# cannot cull the question pools, guest sessions and flash flags in the
+# default one. The file, locmem and database backends cull a third of their
+# entries once they hold MAX_ENTRIES; other backends get no OPTIONS, as they
+# pass them to their client.
+CULLING_CACHE_BACKENDS = {
+    "django.core.cache.backends.filebased.FileBasedCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.db.DatabaseCache",
+}
+
+
+def _cache(backend, location, max_entries):
+    config = {"BACKEND": backend, "LOCATION": location}
+    if backend in CULLING_CACHE_BACKENDS:
+        config["OPTIONS"] = {"MAX_ENTRIES": max_entries}
+    return config
+
+
+CACHES = {
+    "default": _cache(
+        os.getenv("CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        os.getenv("CACHE_LOCATION", str(BASE_DIR / ".cache")),
+        int(os.getenv("CACHE_MAX_ENTRIES", "2000")),
+    ),
+    "fragments": _cache(
+        os.getenv("FRAGMENT_CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        os.getenv("FRAGMENT_CACHE_LOCATION", str(BASE_DIR / ".cache" / "fragments")),
+        int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", "5000")),
+    ),
+}
+
+# Cached template fragments (see chat/fragment_cache.py)
+FRAGMENT_CACHE = os.getenv("FRAGMENT_CACHE", "fragments")
+FRAGMENT_CACHE_TTL = int(os.getenv("FRAGMENT_CACHE_TTL", str(60 * 60)))
+
+# Pre-generated opening questions (see chat/question_pool.py)
+OPENING_QUESTIONS_POOL_SIZE = int(os.getenv("OPENING_QUESTIONS_POOL_SIZE", "5"))
+OPENING_QUESTIONS_TTL = int(os.getenv("OPENING_QUESTIONS_TTL", str(60 * 60 * 24)))
+
+# Messages sent per page when a saved conversation is opened or scrolled back
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+
+# `manage.py archive_sessions` moves the messages of sessions idle for this
+# many days into compressed cold storage (see chat/archive.py)
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "30"))
+
+# Usage rollups (see chat/rollups.py): `manage.py rollup_usage` leaves rows
+# younger than USAGE_ROLLUP_LAG seconds for its next run, and each worker
+# writes its guest counts at most every USAGE_GUEST_FLUSH_INTERVAL seconds
+USAGE_ROLLUP_LAG = int(os.getenv("USAGE_ROLLUP_LAG", "300"))
+USAGE_GUEST_FLUSH_INTERVAL = int(os.getenv("USAGE_GUEST_FLUSH_INTERVAL", "60"))
+
+# Admin change lists of larger unfiltered tables show an estimated row count
+# from the database statistics instead of a COUNT(*) (see chat/admin.py)
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", "10000"))
+
+# Guest chat sessions (see chat/guest_store.py). The SQLite store is shared by
+# all workers on a host; use chat.guest_store.CacheGuestSessionStore with a
+# Redis/Memcached cache across hosts, or InMemoryGuestSessionStore for one worker.
+GUEST_SESSION_STORE = os.getenv("GUEST_SESSION_STORE", "chat.guest_store.SQLiteGuestSessionStore")
+GUEST_SESSION_SQLITE_PATH = os.getenv("GUEST_SESSION_SQLITE_PATH", str(BASE_DIR / ".cache" / "guest_sessions.sqlite3"))
+GUEST_SESSION_CACHE = os.getenv("GUEST_SESSION_CACHE", "default")
+GUEST_SESSION_TTL = int(os.getenv("GUEST_SESSION_TTL", str(60 * 60 * 24)))
+GUEST_SESSION_MAX_ENTRIES = int(os.getenv("GUEST_SESSION_MAX_ENTRIES", "10000"))
+GUEST_SESSION_MAX_MESSAGES = int(os.getenv("GUEST_SESSION_MAX_MESSAGES", "200"))
+GUEST_SESSION_MAX_CHARS = int(os.getenv("GUEST_SESSION_MAX_CHARS", "200000"))
+
+# Content-addressed cache of Gemini chat replies (see chat/llm_cache.py)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True") == "True"
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "chat.llm_cache.SQLiteResponseCache")
+LLM_CACHE_SQLITE_PATH = os.getenv("LLM_CACHE_SQLITE_PATH", str(BASE_DIR / ".cache" / "llm_responses.sqlite3"))
+LLM_CACHE_CACHE = os.getenv("LLM_CACHE_CACHE", "default")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(60 * 60 * 24)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+# Identical Gemini calls in flight are shared (see chat/single_flight.py).
+# Workers on a host coordinate through the SQLite lease file.
+SINGLE_FLIGHT_SHARED = os.getenv("SINGLE_FLIGHT_SHARED", "True") == "True"
+SINGLE_FLIGHT_SQLITE_PATH = os.getenv("SINGLE_FLIGHT_SQLITE_PATH", str(BASE_DIR / ".cache" / "single_flight.sqlite3"))
+SINGLE_FLIGHT_LEASE = float(os.getenv("SINGLE_FLIGHT_LEASE", str(GEMINI_DEADLINE + 5)))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.2"))
+
+# Background analysis reports (see chat/report_jobs.py and `manage.py run_report_worker`)
+REPORT_DEADLINE = float(os.getenv("REPORT_DEADLINE", "180"))
+REPORT_ATTEMPT_TIMEOUT = float(os.getenv("REPORT_ATTEMPT_TIMEOUT", "120"))
+REPORT_JOB_MAX_ATTEMPTS = int(os.getenv("REPORT_JOB_MAX_ATTEMPTS", "4"))
+REPORT_JOB_BACKOFF = float(os.getenv("REPORT_JOB_BACKOFF", "30"))
+REPORT_JOB_BACKOFF_MAX = float(os.getenv("REPORT_JOB_BACKOFF_MAX", "600"))
+REPORT_JOB_LEASE = int(os.getenv("REPORT_JOB_LEASE", "600"))
+REPORT_WORKER_CONCURRENCY = int(os.getenv("REPORT_WORKER_CONCURRENCY", "2"))
+
+# WebSocket chat under ASGI (see chat/websocket.py): seconds between checks
+# of a report job the socket is waiting on
+CHAT_SOCKET_REPORT_POLL = float(os.getenv("CHAT_SOCKET_REPORT_POLL", "2"))
+
+# Prometheus metrics on /metrics (see chat/metrics.py). Workers on a host share
+# their samples through the SQLite file. Set METRICS_TOKEN for scrapers; without
+# it only staff users can read the endpoint.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True") == "True"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_SQLITE_PATH = os.getenv("METRICS_SQLITE_PATH", str(BASE_DIR / ".cache" / "metrics.sqlite3"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_STALE_AFTER = float(os.getenv("METRICS_STALE_AFTER", "300"))
+if METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'chat.middleware.MetricsMiddleware')
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "chat": {"handlers": ["console"], "level": os.getenv("LOG_LEVEL", "INFO")},
+    },
+}
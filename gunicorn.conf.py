@@ -0,0 +1,14 @@
+"""
+Gunicorn config, picked up automatically from the working directory by both
+the WSGI (Procfile) and ASGI (Procfile.asgi) start commands.
+"""
+
+
+def post_worker_init(worker):
+    # Build the shared Gemini client at boot instead of on the first chat turn
+    from chat.ai_service import warm_up
+
+    try:
+        warm_up()
+    except Exception as e:
+        worker.log.warning(f"Gemini warm-up failed: {e}")
@@ -0,0 +1,73 @@
+// Analysis specific JavaScript
+async function startAnalysis(analysisType) {
+    showTypingIndicator();
+
+    // Track suggested prompt (user selected an analysis type)
+    var promptMessageId = (typeof crypto !== 'undefined' && crypto.randomUUID) ? crypto.randomUUID() : 'prompt_' + Date.now();
+    if (typeof pendo !== 'undefined' && pendo.trackAgent) {
+        pendo.trackAgent("prompt", {
+            agentId: "yDXPyAbqZ9GkX5qxDjVxHlaJG30",
+            conversationId: String(currentSessionId || ""),
+            messageId: promptMessageId,
+            content: analysisType,
+            suggestedPrompt: true
+        });
+    }
+
+    try {
+        const response = await fetch('/api/start_analysis/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': getCookie('csrftoken')
+            },
+            body: JSON.stringify({
+                analysis_type: analysisType
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error('Failed to start analysis');
+        }
+
+        const data = await response.json();
+        currentSessionId = data.session_id;
+        currentSessionType = data.session_type;
+        currentAnalysisType = analysisType;
+
+        hideTypingIndicator();
+
+        // Track agent response
+        var responseMessageId = (typeof crypto !== 'undefined' && crypto.randomUUID) ? crypto.randomUUID() : 'agent_response_' + Date.now();
+        if (typeof pendo !== 'undefined' && pendo.trackAgent) {
+            pendo.trackAgent("agent_response", {
+                agentId: "yDXPyAbqZ9GkX5qxDjVxHlaJG30",
+                conversationId: String(currentSessionId || ""),
+                messageId: responseMessageId,
+                content: data.ai_response,
+                modelUsed: "gemini-2.5-pro"
+            });
+        }
+
+        addMessage(data.ai_response, false, data.ai_html);
+
+        // Track analysis started event
+        if (typeof pendo !== 'undefined') {
+            pendo.track('analysis_started', {
+                analysis_type: analysisType,
+                session_id: String(data.session_id),
+                session_type: data.session_type
+            });
+        }
+
+        // Reload chat history to show the new session
+        if (data.session_type === 'authenticated' && typeof loadChatHistory === 'function') {
+            loadChatHistory();
+        }
+
+    } catch (error) {
+        console.error('Error starting analysis:', error);
+        hideTypingIndicator();
+        addMessage("I'm having trouble starting the analysis. Please try again.", false);
+    }
+}
@@ -0,0 +1,10 @@
+// Handle logo image loading errors
+document.addEventListener('DOMContentLoaded', function() {
+    const logoImg = document.querySelector('.auth-header .logo-img');
+    if (logoImg) {
+        logoImg.addEventListener('error', function() {
+            console.log('Logo failed to load, hiding image');
+            this.style.display = 'none';
+        });
+    }
+});
@@ -0,0 +1,310 @@
+// Sidebar functionality
+document.addEventListener('DOMContentLoaded', function() {
+    const sidebar = document.getElementById('sidebar');
+    const sidebarToggle = document.getElementById('sidebarToggle');
+    const mobileMenuBtn = document.getElementById('mobileMenuBtn');
+    const sidebarOverlay = document.getElementById('sidebarOverlay');
+    const chatList = document.getElementById('chatList');
+    const askQuestionBtn = document.getElementById('askQuestionBtn');
+    const chatContainer = document.getElementById('chatContainer');
+    const logoImage = document.getElementById('logoImage');
+
+    // Toggle sidebar
+    sidebarToggle.addEventListener('click', function() {
+        sidebar.classList.toggle('expanded');
+        const icon = this.querySelector('i');
+        if (sidebar.classList.contains('expanded')) {
+            icon.className = 'fas fa-chevron-left';
+        } else {
+            icon.className = 'fas fa-chevron-right';
+        }
+    });
+
+    // Mobile menu toggle
+    mobileMenuBtn.addEventListener('click', function() {
+        const isOpen = sidebar.classList.contains('open');
+
+        if (isOpen) {
+            sidebar.classList.remove('open');
+            mobileMenuBtn.classList.remove('active');
+        } else {
+            sidebar.classList.add('open');
+            mobileMenuBtn.classList.add('active');
+        }
+    });
+
+    // Close sidebar when clicking overlay
+    sidebarOverlay.addEventListener('click', function() {
+        sidebar.classList.remove('open');
+        mobileMenuBtn.classList.remove('active');
+    });
+
+    // Close sidebar when clicking outside on mobile
+    document.addEventListener('click', function(event) {
+        if (window.innerWidth <= 768) {
+            const isClickInsideSidebar = sidebar.contains(event.target);
+            const isClickOnMobileBtn = mobileMenuBtn.contains(event.target);
+
+            if (!isClickInsideSidebar && !isClickOnMobileBtn && sidebar.classList.contains('open')) {
+                sidebar.classList.remove('open');
+                mobileMenuBtn.classList.remove('active');
+            }
+        }
+    });
+
+    // Close sidebar when window is resized to desktop size
+    window.addEventListener('resize', function() {
+        if (window.innerWidth > 768) {
+            sidebar.classList.remove('open');
+            mobileMenuBtn.classList.remove('active');
+        }
+    });
+
+    // Scroll to chat functionality
+    askQuestionBtn.addEventListener('click', function() {
+        chatContainer.scrollIntoView({ 
+            behavior: 'smooth',
+            block: 'start'
+        });
+
+        setTimeout(function() {
+            document.getElementById('chat-input').focus();
+        }, 800);
+    });
+
+    // Add fallback if logo image fails to load
+    if (logoImage) {
+        logoImage.addEventListener('error', function() {
+            console.log('Logo image failed to load');
+            this.style.display = 'none';
+        });
+    }
+
+    // Load chat history for authenticated users
+    if (currentSessionType === 'authenticated') {
+        loadChatHistory();
+    }
+
+    // Auto-scroll to bottom
+    const messagesContainer = document.getElementById('chat-messages');
+    if (messagesContainer) {
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+});
+
+// Load user's chat history
+async function loadChatHistory() {
+    try {
+        const response = await fetch('/api/sessions/');
+        if (!response.ok) {
+            throw new Error('Failed to fetch sessions');
+        }
+        const data = await response.json();
+
+        const chatList = document.getElementById('chatList');
+        chatList.innerHTML = '';
+
+        if (data.sessions && data.sessions.length > 0) {
+            data.sessions.forEach(session => {
+                const chatItem = document.createElement('li');
+                chatItem.className = 'chat-item';
+                if (session.id === currentSessionId) {
+                    chatItem.classList.add('active');
+                }
+
+                const tooltip = document.createElement('div');
+                tooltip.className = 'chat-item-tooltip';
+                tooltip.textContent = session.title;
+
+                const icon = document.createElement('i');
+                icon.className = 'chat-item-icon fas fa-comment-medical';
+
+                chatItem.innerHTML = `
+                    <div class="chat-title">${session.title}</div>
+                    <div class="chat-date">${session.created_at}</div>
+                `;
+
+                chatItem.appendChild(tooltip);
+                chatItem.appendChild(icon);
+
+                chatItem.addEventListener('click', function() {
+                    window.location.href = `/chat/${session.id}/`;
+                });
+
+                chatList.appendChild(chatItem);
+            });
+        } else {
+            chatList.innerHTML = `
+                <li style="text-align: center; color: rgba(255, 255, 255, 0.7); padding: 20px;">
+                    <i class="fas fa-comment-medical" style="font-size: 2rem; margin-bottom: 10px;"></i>
+                    <p>No previous chats found</p>
+                    <p style="font-size: 0.9rem;">Start a new analysis to begin!</p>
+                </li>
+            `;
+        }
+    } catch (error) {
+        console.error('Error loading chat history:', error);
+        const chatList = document.getElementById('chatList');
+        chatList.innerHTML = `
+            <li style="text-align: center; color: #ff6b6b; padding: 20px;">
+                <i class="fas fa-exclamation-triangle"></i>
+                <p>Error loading chat history</p>
+            </li>
+        `;
+    }
+}
+
+// Start analysis function
+async function startAnalysis(analysisType) {
+    showTypingIndicator();
+
+    try {
+        const response = await fetch('/api/start_analysis/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': getCookie('csrftoken')
+            },
+            body: JSON.stringify({
+                analysis_type: analysisType
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error('Failed to start analysis');
+        }
+
+        const data = await response.json();
+        currentSessionId = data.session_id;
+        currentSessionType = data.session_type;
+        currentAnalysisType = analysisType;
+
+        hideTypingIndicator();
+        addMessage(data.ai_response, false, data.ai_html);
+
+        // Reload chat history to show the new session
+        if (data.session_type === 'authenticated') {
+            loadChatHistory();
+        }
+
+    } catch (error) {
+        console.error('Error starting analysis:', error);
+        hideTypingIndicator();
+        addMessage("I'm having trouble starting the analysis. Please try again.", false);
+    }
+}
+
+// Send message function
+document.getElementById('send-button').addEventListener('click', sendMessage);
+document.getElementById('chat-input').addEventListener('keypress', function(e) {
+    if (e.key === 'Enter') sendMessage();
+});
+
+async function sendMessage() {
+    const input = document.getElementById('chat-input');
+    const message = input.value.trim();
+
+    if (!message) return;
+
+    addMessage(message, true);
+    input.value = '';
+    showTypingIndicator();
+
+    try {
+        const response = await fetch('/api/send_message/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': getCookie('csrftoken')
+            },
+            body: JSON.stringify({
+                session_id: currentSessionId,
+                session_type: currentSessionType,
+                message: message
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error('Failed to send message');
+        }
+
+        const data = await response.json();
+        hideTypingIndicator();
+
+        if (data.error) {
+            addMessage("Session error. Please start a new analysis.", false);
+        } else {
+            addMessage(data.ai_response, false, data.ai_html);
+        }
+
+    } catch (error) {
+        console.error('Error sending message:', error);
+        hideTypingIndicator();
+        addMessage("I'm having trouble responding. Please try again.", false);
+    }
+}
+
+// Add message function with markdown support
+function addMessage(content, isUser, html) {
+    const messagesContainer = document.getElementById('chat-messages');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${isUser ? 'user-message' : 'ai-message'}`;
+
+    const messageHeader = document.createElement('div');
+    messageHeader.className = 'message-header';
+
+    const avatar = document.createElement('div');
+    avatar.className = `avatar ${isUser ? 'user-avatar' : 'ai-avatar'}`;
+
+    if (isUser) {
+        avatar.innerHTML = '<i class="fas fa-user avatar-icon"></i>';
+    } else {
+        avatar.innerHTML = '<img src="' + document.getElementById('chatContainer').dataset.logoUrl + '" alt="Doctor AI" class="avatar-img" onerror="this.style.display=\'none\'; this.parentNode.innerHTML=\'<i class=\"fas fa-robot avatar-icon\"></i>\';">';
+    }
+
+    const sender = document.createElement('span');
+    sender.textContent = isUser ? 'You' : 'Doctor AI';
+
+    messageHeader.appendChild(avatar);
+    messageHeader.appendChild(sender);
+
+    const messageContent = document.createElement('div');
+    messageContent.className = 'message-content';
+
+    // Server-rendered HTML for AI replies, plain text for everything else
+    if (html) {
+        messageContent.innerHTML = html;
+    } else {
+        messageContent.textContent = content;
+    }
+
+    messageDiv.appendChild(messageHeader);
+    messageDiv.appendChild(messageContent);
+
+    messagesContainer.appendChild(messageDiv);
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+}
+
+function showTypingIndicator() {
+    document.getElementById('typing-indicator').style.display = 'flex';
+    document.getElementById('chat-messages').scrollTop = document.getElementById('chat-messages').scrollHeight;
+}
+
+function hideTypingIndicator() {
+    document.getElementById('typing-indicator').style.display = 'none';
+}
+
+function getCookie(name) {
+    let cookieValue = null;
+    if (document.cookie && document.cookie !== '') {
+        const cookies = document.cookie.split(';');
+        for (let i = 0; i < cookies.length; i++) {
+            const cookie = cookies[i].trim();
+            if (cookie.substring(0, name.length + 1) === (name + '=')) {
+                cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                break;
+            }
+        }
+    }
+    return cookieValue;
+}
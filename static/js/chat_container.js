@@ -0,0 +1,563 @@
+// Chat specific JavaScript
+document.addEventListener("DOMContentLoaded", function () {
+  const askQuestionBtn = document.getElementById("askQuestionBtn");
+  const chatContainer = document.getElementById("chatContainer");
+
+  // Scroll to chat functionality
+  if (askQuestionBtn && chatContainer) {
+    askQuestionBtn.addEventListener("click", function () {
+      chatContainer.scrollIntoView({
+        behavior: "smooth",
+        block: "start",
+      });
+
+      setTimeout(function () {
+        document.getElementById("chat-input").focus();
+      }, 800);
+    });
+  }
+
+  // Auto-scroll to bottom
+  const messagesContainer = document.getElementById("chat-messages");
+  if (messagesContainer) {
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+  }
+
+  // Older messages of a resumed session load when scrolling to the top
+  const loadOlder = document.getElementById("load-older-messages");
+  if (loadOlder && messagesContainer) {
+    loadOlder.querySelector("button").addEventListener("click", loadOlderMessages);
+    messagesContainer.addEventListener("scroll", function () {
+      if (messagesContainer.scrollTop < 40) loadOlderMessages();
+    });
+  }
+
+  // Initialize chat event listeners
+  const sendButton = document.getElementById("send-button");
+  const chatInput = document.getElementById("chat-input");
+
+  if (sendButton) {
+    sendButton.addEventListener("click", sendMessage);
+  }
+
+  if (chatInput) {
+    chatInput.addEventListener("keypress", function (e) {
+      if (e.key === "Enter") sendMessage();
+    });
+  }
+
+  const reportButton = document.getElementById("report-button");
+  if (reportButton) {
+    reportButton.addEventListener("click", requestReport);
+  }
+
+  // Add error handling for logo images
+  const avatarImages = document.querySelectorAll(".avatar-img");
+  avatarImages.forEach((img) => {
+    img.addEventListener("error", function () {
+      console.log("Avatar image failed to load, using fallback icon");
+      const avatar = this.closest(".avatar");
+      if (avatar && avatar.classList.contains("ai-avatar")) {
+        avatar.innerHTML = '<i class="fas fa-robot avatar-icon"></i>';
+      }
+    });
+  });
+});
+
+// Send message function
+async function sendMessage() {
+  const input = document.getElementById("chat-input");
+  const message = input.value.trim();
+
+  if (!message) return;
+
+  // Track user prompt
+  var promptMessageId = (typeof crypto !== 'undefined' && crypto.randomUUID) ? crypto.randomUUID() : 'prompt_' + Date.now();
+  if (typeof pendo !== 'undefined' && pendo.trackAgent) {
+    pendo.trackAgent("prompt", {
+      agentId: "yDXPyAbqZ9GkX5qxDjVxHlaJG30",
+      conversationId: String(currentSessionId || ""),
+      messageId: promptMessageId,
+      content: message,
+      suggestedPrompt: false
+    });
+  }
+
+  addMessage(message, true);
+  input.value = "";
+  showTypingIndicator();
+
+  try {
+    let data;
+    try {
+      data = await socketMessage(message);
+    } catch (socketError) {
+      // Fall back to HTTP if the message never reached the socket
+      if (socketError.partial) throw socketError;
+      try {
+        data = await streamMessage(message);
+      } catch (streamError) {
+        // Fall back to the non-streaming endpoint if nothing was streamed
+        if (streamError.partial) throw streamError;
+        console.warn("Streaming unavailable, falling back:", streamError);
+        data = await requestMessage(message);
+        hideTypingIndicator();
+        if (!data.error) addMessage(data.ai_response, false, data.ai_html);
+      }
+    }
+
+    if (data.session_id) {
+      currentSessionId = data.session_id;
+      currentSessionType = data.session_type || currentSessionType;
+    }
+
+    // Track chat message sent event
+    if (typeof pendo !== 'undefined') {
+        pendo.track('chat_message_sent', {
+            session_id: String(currentSessionId),
+            session_type: currentSessionType,
+            analysis_type: currentAnalysisType,
+            message_length: message.length
+        });
+    }
+
+    if (data.error) {
+      addMessage("Session error. Please start a new analysis.", false);
+    } else {
+      // Track agent response
+      var responseMessageId = (typeof crypto !== 'undefined' && crypto.randomUUID) ? crypto.randomUUID() : 'agent_response_' + Date.now();
+      if (typeof pendo !== 'undefined' && pendo.trackAgent) {
+        pendo.trackAgent("agent_response", {
+          agentId: "yDXPyAbqZ9GkX5qxDjVxHlaJG30",
+          conversationId: String(currentSessionId || ""),
+          messageId: responseMessageId,
+          content: data.ai_response,
+          modelUsed: "gemini-2.5-pro"
+        });
+      }
+
+      // Track AI response received event
+      if (typeof pendo !== 'undefined') {
+          pendo.track('ai_response_received', {
+              session_id: String(currentSessionId),
+              analysis_type: currentAnalysisType,
+              response_length: data.ai_response.length,
+              session_type: currentSessionType
+          });
+      }
+    }
+  } catch (error) {
+    console.error("Error sending message:", error);
+    hideTypingIndicator();
+    addMessage("I'm having trouble responding. Please try again.", false);
+  }
+}
+
+// One WebSocket per tab for the open conversation (ASGI deployments, see chat/websocket.py).
+// Once it has failed to connect the page sticks to the HTTP endpoints.
+let chatSocket = null;
+let chatSocketSessionId = null;
+let chatSocketUnavailable = !("WebSocket" in window);
+let pendingTurn = null;
+let pendingReport = null;
+
+function openChatSocket() {
+  if (chatSocketUnavailable) {
+    return Promise.reject(new Error("WebSocket unavailable"));
+  }
+  const sessionId = currentSessionId ? String(currentSessionId) : null;
+  if (chatSocket && chatSocket.readyState === WebSocket.OPEN && chatSocketSessionId === sessionId) {
+    return Promise.resolve(chatSocket);
+  }
+  // Another conversation was opened in this tab
+  if (chatSocket) chatSocket.close();
+
+  return new Promise((resolve, reject) => {
+    const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+    const socket = new WebSocket(`${scheme}://${window.location.host}/ws/chat/${sessionId ? sessionId + "/" : ""}`);
+    let opened = false;
+
+    socket.onopen = function () {
+      opened = true;
+      chatSocket = socket;
+      chatSocketSessionId = sessionId;
+      resolve(socket);
+    };
+    socket.onmessage = function (event) {
+      handleSocketEvent(JSON.parse(event.data));
+    };
+    socket.onclose = function () {
+      if (!opened) {
+        chatSocketUnavailable = true;
+        reject(new Error("WebSocket unavailable"));
+        return;
+      }
+      if (chatSocket === socket) chatSocket = null;
+      const error = new Error("WebSocket closed");
+      if (pendingTurn) {
+        // The server already saw this message, so do not resend it
+        error.partial = true;
+        pendingTurn.reject(error);
+        pendingTurn = null;
+      }
+      if (pendingReport) {
+        pendingReport.reject(error);
+        pendingReport = null;
+      }
+    };
+  });
+}
+
+function handleSocketEvent(event) {
+  if (event.type === "error") {
+    const pending = event.request === "report" ? pendingReport : pendingTurn;
+    if (!pending) return;
+    if (event.request === "report") pendingReport = null;
+    else pendingTurn = null;
+    hideTypingIndicator();
+    if (event.status === 404 && event.request !== "report") {
+      pending.resolve({ error: event.error });
+    } else {
+      const error = new Error(event.error);
+      error.partial = true;
+      pending.reject(error);
+    }
+  } else if (event.type === "report_ready" && pendingReport) {
+    pendingReport.resolve(event);
+    pendingReport = null;
+  } else if (pendingTurn) {
+    streamSocketEvent(event);
+  }
+}
+
+// Render a reply arriving over the socket; the events are those of streamMessage
+function streamSocketEvent(event) {
+  const turn = pendingTurn;
+  if (event.type === "typing") {
+    if (event.active) showTypingIndicator();
+    else hideTypingIndicator();
+    return;
+  }
+  if (event.type !== "chunk" && event.type !== "done") return;
+
+  if (!turn.messageContent) {
+    hideTypingIndicator();
+    turn.messageContent = addMessage("", false);
+  }
+  if (event.type === "done") {
+    turn.messageContent.innerHTML = event.ai_html;
+    chatSocketSessionId = String(event.session_id);
+    pendingTurn = null;
+    turn.resolve(event);
+    return;
+  }
+  turn.html += event.html;
+  turn.messageContent.innerHTML = turn.html + event.tail;
+  scrollMessagesToBottom();
+}
+
+// Send a message over the WebSocket and render the reply as it streams in
+async function socketMessage(message) {
+  const socket = await openChatSocket();
+  return new Promise((resolve, reject) => {
+    pendingTurn = { resolve, reject, messageContent: null, html: "" };
+    socket.send(JSON.stringify({ type: "message", message: message }));
+  });
+}
+
+// Non-streaming request, used when streaming is not available
+async function requestMessage(message) {
+  const response = await fetch("/api/send_message/", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      "X-CSRFToken": getCookie("csrftoken"),
+    },
+    body: JSON.stringify({
+      session_id: currentSessionId,
+      session_type: currentSessionType,
+      message: message,
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error("Failed to send message");
+  }
+
+  return response.json();
+}
+
+// Stream the AI reply and render it as the chunks arrive
+async function streamMessage(message) {
+  const response = await fetch("/api/send_message/stream/", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      "X-CSRFToken": getCookie("csrftoken"),
+    },
+    body: JSON.stringify({
+      session_id: currentSessionId,
+      session_type: currentSessionType,
+      message: message,
+    }),
+  });
+
+  if (response.status === 404) {
+    return response.json();
+  }
+  if (!response.ok) {
+    // The server already saw this message, so do not resend it
+    const error = new Error("Failed to stream message");
+    error.partial = true;
+    throw error;
+  }
+  if (!response.body) {
+    throw new Error("Streaming responses are not supported");
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let html = "";
+  let messageContent = null;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Server-Sent Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const lines = rawEvent.split("\n");
+      const dataLine = lines.find((line) => line.startsWith("data: "));
+      if (!dataLine) continue;
+
+      const event = JSON.parse(dataLine.slice(6));
+      if (lines.includes("event: error")) {
+        // The reply broke off; the part already shown was saved with the message
+        if (event.session_id) {
+          currentSessionId = event.session_id;
+          currentSessionType = event.session_type || currentSessionType;
+        }
+        const error = new Error(event.error);
+        error.partial = true;
+        throw error;
+      }
+      if (!messageContent) {
+        hideTypingIndicator();
+        messageContent = addMessage("", false);
+      }
+
+      if (event.done) {
+        // The final event carries the cleaned-up full reply
+        messageContent.innerHTML = event.ai_html;
+        return event;
+      }
+
+      // Finished blocks arrive rendered once; the block in progress is re-sent as the tail
+      html += event.html;
+      messageContent.innerHTML = html + event.tail;
+      scrollMessagesToBottom();
+    }
+  }
+
+  const error = new Error("Stream ended before completion");
+  error.partial = true;
+  throw error;
+}
+
+// Queue the analysis report and wait until the report worker has written it
+async function requestReport() {
+  if (!currentSessionId || currentSessionType !== "authenticated") {
+    addMessage("Start an analysis and answer a few questions first, then I can write your report.", false);
+    return;
+  }
+
+  const reportButton = document.getElementById("report-button");
+  reportButton.disabled = true;
+  showTypingIndicator();
+
+  try {
+    let job;
+    try {
+      job = await socketReport();
+    } catch (socketError) {
+      // Queueing again returns the job the socket may already have queued
+      console.warn("WebSocket unavailable, polling for the report:", socketError);
+      job = await pollReport();
+    }
+
+    hideTypingIndicator();
+    if (job.status === "succeeded") {
+      addMessage(job.report, false, job.report_html);
+    } else {
+      addMessage(job.error, false);
+    }
+
+    if (typeof pendo !== 'undefined') {
+      pendo.track('analysis_report_generated', {
+        session_id: String(currentSessionId),
+        analysis_type: currentAnalysisType,
+        status: job.status
+      });
+    }
+  } catch (error) {
+    console.error("Error generating report:", error);
+    hideTypingIndicator();
+    addMessage("Sorry, I couldn't generate your report right now. Please try again in a moment.", false);
+  } finally {
+    reportButton.disabled = false;
+  }
+}
+
+// The socket pushes the report once it is written
+async function socketReport() {
+  const socket = await openChatSocket();
+  return new Promise((resolve, reject) => {
+    pendingReport = { resolve, reject };
+    socket.send(JSON.stringify({ type: "report" }));
+  });
+}
+
+async function pollReport() {
+  const response = await fetch(`/api/sessions/${currentSessionId}/report/`, { method: "POST" });
+  if (!response.ok) {
+    throw new Error("Failed to queue the report");
+  }
+  let job = await response.json();
+
+  while (job.status === "pending" || job.status === "running") {
+    await new Promise((resolve) => setTimeout(resolve, 3000));
+    const statusResponse = await fetch(`/api/reports/${job.job_id}/`);
+    if (!statusResponse.ok) {
+      throw new Error("Failed to check the report");
+    }
+    job = await statusResponse.json();
+  }
+  return job;
+}
+
+// Prepend the page of messages before the oldest one shown
+let loadingOlderMessages = false;
+
+async function loadOlderMessages() {
+  const loadOlder = document.getElementById("load-older-messages");
+  if (!loadOlder || loadingOlderMessages || !currentSessionId) return;
+  loadingOlderMessages = true;
+
+  try {
+    const response = await fetch(
+      `/api/sessions/${currentSessionId}/?before=${loadOlder.dataset.before}`
+    );
+    if (!response.ok) {
+      throw new Error("Failed to load earlier messages");
+    }
+    const data = await response.json();
+
+    // Keep the visible messages in place while content is added above them
+    const messagesContainer = document.getElementById("chat-messages");
+    const previousHeight = messagesContainer.scrollHeight;
+    const anchor = loadOlder.nextElementSibling;
+    data.messages.forEach((message) => {
+      messagesContainer.insertBefore(
+        buildMessage(message.content, message.is_user, message.content_html),
+        anchor
+      );
+    });
+    messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+
+    if (data.has_more && data.messages.length > 0) {
+      loadOlder.dataset.before = data.messages[0].id;
+    } else {
+      loadOlder.remove();
+    }
+  } catch (error) {
+    console.error("Error loading earlier messages:", error);
+  } finally {
+    loadingOlderMessages = false;
+  }
+}
+
+// Add a message; AI replies come with the HTML rendered by the server
+function addMessage(content, isUser, html) {
+  const messagesContainer = document.getElementById("chat-messages");
+  const messageDiv = buildMessage(content, isUser, html);
+  messagesContainer.appendChild(messageDiv);
+  messagesContainer.scrollTop = messagesContainer.scrollHeight;
+  return messageDiv.querySelector(".message-content");
+}
+
+function buildMessage(content, isUser, html) {
+  const messageDiv = document.createElement("div");
+  messageDiv.className = `message ${isUser ? "user-message" : "ai-message"}`;
+
+  const messageHeader = document.createElement("div");
+  messageHeader.className = "message-header";
+
+  const avatar = document.createElement("div");
+  avatar.className = `avatar ${isUser ? "user-avatar" : "ai-avatar"}`;
+
+  if (isUser) {
+    avatar.innerHTML = '<i class="fas fa-user avatar-icon"></i>';
+  } else {
+    // Create logo with proper error handling
+    const logoImg = document.createElement("img");
+    // Fingerprinted URL, set by the template
+    logoImg.src = document.getElementById("chatContainer").dataset.logoUrl;
+    logoImg.alt = "Doctor AI";
+    logoImg.className = "avatar-img";
+    logoImg.onerror = function () {
+      this.style.display = "none";
+      avatar.innerHTML = '<i class="fas fa-robot avatar-icon"></i>';
+    };
+    avatar.appendChild(logoImg);
+  }
+
+  const sender = document.createElement("span");
+  sender.textContent = isUser ? "You" : "Doctor AI";
+
+  messageHeader.appendChild(avatar);
+  messageHeader.appendChild(sender);
+
+  const messageContent = document.createElement("div");
+  messageContent.className = "message-content";
+
+  // Server-rendered HTML for AI replies, plain text for everything else
+  if (html) {
+    messageContent.innerHTML = html;
+  } else {
+    messageContent.textContent = content;
+  }
+
+  messageDiv.appendChild(messageHeader);
+  messageDiv.appendChild(messageContent);
+  return messageDiv;
+}
+
+function scrollMessagesToBottom() {
+  const messagesContainer = document.getElementById("chat-messages");
+  if (messagesContainer) {
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+  }
+}
+
+function showTypingIndicator() {
+  const typingIndicator = document.getElementById("typing-indicator");
+  const messagesContainer = document.getElementById("chat-messages");
+  if (typingIndicator) {
+    typingIndicator.style.display = "flex";
+  }
+  if (messagesContainer) {
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+  }
+}
+
+function hideTypingIndicator() {
+  const typingIndicator = document.getElementById("typing-indicator");
+  if (typingIndicator) {
+    typingIndicator.style.display = "none";
+  }
+}
@@ -0,0 +1,35 @@
+function togglePassword() {
+    const passwordInput = document.querySelector('input[type="password"]');
+    const toggleIcon = document.querySelector('.toggle-password i');
+
+    if (passwordInput.type === 'password') {
+        passwordInput.type = 'text';
+        toggleIcon.className = 'fas fa-eye-slash';
+    } else {
+        passwordInput.type = 'password';
+        toggleIcon.className = 'fas fa-eye';
+    }
+}
+
+// Add focus effects to form inputs
+document.addEventListener('DOMContentLoaded', function() {
+    const inputs = document.querySelectorAll('input');
+    inputs.forEach(input => {
+        // Add placeholder for better UX
+        if (input.type === 'text' && !input.placeholder) {
+            input.placeholder = 'Enter your username';
+        }
+        if (input.type === 'password' && !input.placeholder) {
+            input.placeholder = 'Enter your password';
+        }
+
+        // Add focus/blur effects
+        input.addEventListener('focus', function() {
+            this.parentElement.classList.add('focused');
+        });
+
+        input.addEventListener('blur', function() {
+            this.parentElement.classList.remove('focused');
+        });
+    });
+});
@@ -0,0 +1,85 @@
+function togglePassword(fieldId) {
+    const passwordInput = document.getElementById(fieldId);
+    const toggleIcon = passwordInput.parentElement.querySelector('.toggle-password i');
+
+    if (passwordInput.type === 'password') {
+        passwordInput.type = 'text';
+        toggleIcon.className = 'fas fa-eye-slash';
+    } else {
+        passwordInput.type = 'password';
+        toggleIcon.className = 'fas fa-eye';
+    }
+}
+
+// Password strength indicator
+document.getElementById('id_password1').addEventListener('input', function() {
+    const password = this.value;
+    const strengthBar = document.getElementById('strength-bar');
+    const strengthText = document.getElementById('strength-text');
+
+    let strength = 0;
+    let text = 'None';
+    let className = '';
+
+    if (password.length > 0) {
+        strength++;
+        if (password.length >= 8) strength++;
+        if (/[A-Z]/.test(password)) strength++;
+        if (/[0-9]/.test(password)) strength++;
+        if (/[^A-Za-z0-9]/.test(password)) strength++;
+    }
+
+    switch(strength) {
+        case 0:
+            text = 'None';
+            className = '';
+            break;
+        case 1:
+        case 2:
+            text = 'Weak';
+            className = 'strength-weak';
+            break;
+        case 3:
+            text = 'Fair';
+            className = 'strength-fair';
+            break;
+        case 4:
+            text = 'Good';
+            className = 'strength-good';
+            break;
+        case 5:
+            text = 'Strong';
+            className = 'strength-strong';
+            break;
+    }
+
+    strengthBar.className = 'strength-fill ' + className;
+    strengthText.textContent = text;
+    strengthText.style.color = getComputedStyle(strengthBar).backgroundColor;
+});
+
+// Add focus effects to form inputs
+document.addEventListener('DOMContentLoaded', function() {
+    const inputs = document.querySelectorAll('input');
+    inputs.forEach(input => {
+        // Add placeholder for better UX
+        if (input.type === 'text' && !input.placeholder) {
+            input.placeholder = 'Choose a username';
+        }
+        if (input.id === 'id_password1' && !input.placeholder) {
+            input.placeholder = 'Create a strong password';
+        }
+        if (input.id === 'id_password2' && !input.placeholder) {
+            input.placeholder = 'Confirm your password';
+        }
+
+        // Add focus/blur effects
+        input.addEventListener('focus', function() {
+            this.parentElement.classList.add('focused');
+        });
+
+        input.addEventListener('blur', function() {
+            this.parentElement.classList.remove('focused');
+        });
+    });
+});
@@ -0,0 +1,345 @@
+// SIDEBAR FUNCTIONALITY - RUNS ONCE
+(function() {
+    // Prevent multiple initializations
+    if (window.sidebarInitialized) {
+        console.log('Sidebar already initialized, skipping...');
+        return;
+    }
+
+    window.sidebarInitialized = true;
+    console.log('Initializing sidebar...');
+
+    document.addEventListener('DOMContentLoaded', function() {
+        const sidebar = document.getElementById('sidebar');
+        const sidebarToggle = document.getElementById('sidebarToggle');
+        const mobileMenuBtn = document.getElementById('mobileMenuBtn');
+        const sidebarOverlay = document.getElementById('sidebarOverlay');
+
+        console.log('Sidebar elements found:', {
+            sidebar: !!sidebar,
+            sidebarToggle: !!sidebarToggle,
+            mobileMenuBtn: !!mobileMenuBtn,
+            sidebarOverlay: !!sidebarOverlay
+        });
+
+        if (!sidebar) {
+            console.error('Sidebar element not found!');
+            return;
+        }
+
+        // Check if mobile
+        function isMobile() {
+            return window.innerWidth <= 768;
+        }
+
+        // Update toggle button icon based on context
+        function updateToggleIcon() {
+            if (!sidebarToggle) return;
+
+            if (isMobile()) {
+                // On mobile, always show X icon to close
+                sidebarToggle.querySelector('i').className = 'fas fa-times';
+            } else {
+                // On desktop, show chevron based on collapsed state
+                const isCollapsed = sidebar.classList.contains('collapsed');
+                sidebarToggle.querySelector('i').className = isCollapsed ? 
+                    'fas fa-chevron-right' : 'fas fa-chevron-left';
+            }
+        }
+
+        // Initialize sidebar state
+        function initializeSidebar() {
+            if (!isMobile()) {
+                // Desktop: start collapsed by default (changed from saved preference)
+                sidebar.classList.add('collapsed');
+                sidebar.classList.remove('mobile-open');
+                if (sidebarOverlay) sidebarOverlay.classList.remove('active');
+            } else {
+                // Mobile: start closed and never collapsed
+                sidebar.classList.remove('mobile-open');
+                sidebar.classList.remove('collapsed');
+                if (sidebarOverlay) sidebarOverlay.classList.remove('active');
+                if (mobileMenuBtn) mobileMenuBtn.classList.remove('active');
+            }
+            updateToggleIcon();
+        }
+
+        // Sidebar toggle button handler
+        if (sidebarToggle) {
+            sidebarToggle.addEventListener('click', function(e) {
+                e.preventDefault();
+                e.stopPropagation();
+
+                console.log('Sidebar toggle clicked');
+
+                if (isMobile()) {
+                    // On mobile, toggle button closes the sidebar
+                    closeMobileSidebar();
+                } else {
+                    // On desktop, toggle collapsed state
+                    sidebar.classList.toggle('collapsed');
+                    updateToggleIcon();
+                }
+            });
+        }
+
+        // Mobile menu button (open sidebar)
+        if (mobileMenuBtn) {
+            mobileMenuBtn.addEventListener('click', function(e) {
+                e.preventDefault();
+                e.stopPropagation();
+
+                console.log('Mobile menu clicked');
+
+                const isOpen = sidebar.classList.contains('mobile-open');
+
+                if (isOpen) {
+                    closeMobileSidebar();
+                } else {
+                    openMobileSidebar();
+                }
+            });
+        }
+
+        // Open mobile sidebar
+        function openMobileSidebar() {
+            console.log('Opening mobile sidebar');
+            sidebar.classList.add('mobile-open');
+            sidebar.classList.remove('collapsed'); // Never collapsed on mobile
+            if (sidebarOverlay) sidebarOverlay.classList.add('active');
+            if (mobileMenuBtn) mobileMenuBtn.classList.add('active');
+            updateToggleIcon();
+        }
+
+        // Close mobile sidebar
+        function closeMobileSidebar() {
+            console.log('Closing mobile sidebar');
+            sidebar.classList.remove('mobile-open');
+            if (sidebarOverlay) sidebarOverlay.classList.remove('active');
+            if (mobileMenuBtn) mobileMenuBtn.classList.remove('active');
+        }
+
+        // Close sidebar when clicking overlay
+        if (sidebarOverlay) {
+            sidebarOverlay.addEventListener('click', function() {
+                if (isMobile()) {
+                    closeMobileSidebar();
+                }
+            });
+        }
+
+        // Close sidebar when clicking a chat item on mobile
+        document.addEventListener('click', function(e) {
+            if (e.target.closest('.chat-item') && isMobile()) {
+                closeMobileSidebar();
+            }
+        });
+
+        // Close sidebar on Escape key
+        document.addEventListener('keydown', function(e) {
+            if (e.key === 'Escape' && isMobile() && sidebar.classList.contains('mobile-open')) {
+                closeMobileSidebar();
+            }
+        });
+
+        // Handle window resize
+        let resizeTimer;
+        window.addEventListener('resize', function() {
+            clearTimeout(resizeTimer);
+            resizeTimer = setTimeout(function() {
+                initializeSidebar();
+            }, 250);
+        });
+
+        // Initialize on load
+        initializeSidebar();
+    });
+})();
+
+// Load user's chat history, one page at a time
+let chatHistoryCursor = null;
+
+function renderChatItem(session) {
+    const chatItem = document.createElement('li');
+    chatItem.className = 'chat-item';
+
+    // Check if this is the current session
+    const isActiveSession = session.id === currentSessionId;
+    if (isActiveSession) {
+        chatItem.classList.add('active');
+    }
+
+    chatItem.innerHTML = `
+        <i class="chat-item-icon fas fa-comment-medical"></i>
+        <div class="chat-item-content">
+            <div class="chat-title">${session.title}</div>
+            <div class="chat-date">${new Date(session.created_at).toLocaleDateString()}</div>
+        </div>
+        <div class="chat-item-tooltip">${session.title}</div>
+    `;
+
+    chatItem.addEventListener('click', function() {
+        window.location.href = `/chat/${session.id}/`;
+    });
+
+    return chatItem;
+}
+
+function renderLoadMore(chatList) {
+    const loadMoreItem = document.createElement('li');
+    loadMoreItem.className = 'chat-item chat-load-more';
+    loadMoreItem.innerHTML = `
+        <i class="chat-item-icon fas fa-ellipsis-h"></i>
+        <div class="chat-item-content">
+            <div class="chat-title">Load older chats</div>
+        </div>
+        <div class="chat-item-tooltip">Load older chats</div>
+    `;
+    loadMoreItem.addEventListener('click', function() {
+        loadMoreItem.remove();
+        loadChatHistory(true);
+    });
+    chatList.appendChild(loadMoreItem);
+}
+
+async function loadChatHistory(append = false) {
+    try {
+        const url = append && chatHistoryCursor
+            ? `/api/sessions/?cursor=${encodeURIComponent(chatHistoryCursor)}`
+            : '/api/sessions/';
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error('Failed to fetch sessions');
+        }
+        const data = await response.json();
+
+        const chatList = document.getElementById('chatList');
+        if (!chatList) return;
+
+        if (!append) {
+            chatList.innerHTML = '';
+        }
+        chatHistoryCursor = data.next_cursor;
+
+        if (data.sessions && data.sessions.length > 0) {
+            data.sessions.forEach(session => {
+                chatList.appendChild(renderChatItem(session));
+            });
+            if (chatHistoryCursor) {
+                renderLoadMore(chatList);
+            }
+        } else if (!append) {
+            chatList.innerHTML = `
+                <li style="text-align: center; color: rgba(255, 255, 255, 0.7); padding: 15px 8px;">
+                    <i class="fas fa-comment-medical" style="font-size: 1.5rem; margin-bottom: 8px; display: block;"></i>
+                    <p style="font-size: 0.8rem;">No previous chats</p>
+                    <p style="font-size: 0.7rem; margin-top: 4px;">Start a new analysis!</p>
+                </li>
+            `;
+        }
+    } catch (error) {
+        console.error('Error loading chat history:', error);
+        const chatList = document.getElementById('chatList');
+        if (chatList && append) {
+            // Let the user retry the page that failed
+            renderLoadMore(chatList);
+        } else if (chatList) {
+            chatList.innerHTML = `
+                <li style="text-align: center; color: #ff6b6b; padding: 15px 8px;">
+                    <i class="fas fa-exclamation-triangle"></i>
+                    <p style="font-size: 0.8rem;">Error loading history</p>
+                </li>
+            `;
+        }
+    }
+}
+
+// Search the user's messages; an empty query shows the history again
+let chatSearchPage = null;
+let chatSearchQuery = '';
+
+function renderSearchResult(result) {
+    const chatItem = document.createElement('li');
+    chatItem.className = 'chat-item';
+    // The snippet is escaped HTML from the server, with the matches in <mark>
+    chatItem.innerHTML = `
+        <i class="chat-item-icon fas ${result.archived ? 'fa-archive' : 'fa-search'}"></i>
+        <div class="chat-item-content">
+            <div class="chat-title"></div>
+            <div class="chat-snippet">${result.snippet}</div>
+            <div class="chat-date">${new Date(result.timestamp).toLocaleDateString()}</div>
+        </div>
+    `;
+    chatItem.querySelector('.chat-title').textContent = result.session_title;
+    chatItem.addEventListener('click', function() {
+        window.location.href = `/chat/${result.session_id}/`;
+    });
+    return chatItem;
+}
+
+async function searchChats(append = false) {
+    const chatList = document.getElementById('chatList');
+    if (!chatList) return;
+    const query = chatSearchQuery;
+    const page = append ? chatSearchPage : 1;
+
+    try {
+        const response = await fetch(`/api/search/?q=${encodeURIComponent(query)}&page=${page}`);
+        if (!response.ok) {
+            throw new Error('Failed to search');
+        }
+        const data = await response.json();
+        // A newer query has been typed meanwhile
+        if (query !== chatSearchQuery) return;
+
+        if (!append) {
+            chatList.innerHTML = '';
+        }
+        chatSearchPage = data.next_page;
+        data.results.forEach(result => {
+            chatList.appendChild(renderSearchResult(result));
+        });
+        if (chatSearchPage) {
+            const moreItem = document.createElement('li');
+            moreItem.className = 'chat-item chat-load-more';
+            moreItem.innerHTML = `
+                <i class="chat-item-icon fas fa-ellipsis-h"></i>
+                <div class="chat-item-content"><div class="chat-title">More results</div></div>
+            `;
+            moreItem.addEventListener('click', function() {
+                moreItem.remove();
+                searchChats(true);
+            });
+            chatList.appendChild(moreItem);
+        } else if (!append && data.results.length === 0) {
+            chatList.innerHTML = `
+                <li style="text-align: center; color: rgba(255, 255, 255, 0.7); padding: 15px 8px;">
+                    <p style="font-size: 0.8rem;">No messages found</p>
+                </li>
+            `;
+        }
+    } catch (error) {
+        console.error('Error searching chats:', error);
+    }
+}
+
+// Call this function when the page loads
+document.addEventListener('DOMContentLoaded', function() {
+    loadChatHistory();
+
+    const searchInput = document.getElementById('chatSearch');
+    if (searchInput) {
+        let searchTimer;
+        searchInput.addEventListener('input', function() {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(function() {
+                chatSearchQuery = searchInput.value.trim();
+                if (chatSearchQuery) {
+                    searchChats();
+                } else {
+                    loadChatHistory();
+                }
+            }, 300);
+        });
+    }
+});